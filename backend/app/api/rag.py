@@ -2,15 +2,25 @@
 RAG 查詢 API - 提供相似案例檢索與維修建議
 """
 
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import Literal, Optional
+import asyncio
+import json
 import logging
+import os
+import shutil
+import uuid
 
-from app.services.rag import RAGService
-from app.services.embedding import EmbeddingService
+from app.db.database import get_db
+from app.services.import_jobs import ImportJobQueue, get_import_queue
+from app.services.pagination import next_cursor
+from app.services.rag import RAGService, SUGGESTIONS_UNAVAILABLE, UPLOAD_DIR, get_rag_service
+from app.services.embedding import EmbeddingService, get_embedding_service
 
-router = APIRouter()
+# 每個請求一個共用 Session，儲存後端經由 session_scope() 取用（見 app.db.database）
+router = APIRouter(dependencies=[Depends(get_db)])
 logger = logging.getLogger(__name__)
 
 
@@ -24,6 +34,8 @@ class RAGQueryRequest(BaseModel):
     extracted_values: Optional[dict] = None
     filters: Optional[dict] = None  # 新增過濾條件
     top_k: int = 5
+    recall: Optional[Literal["fast", "balanced", "accurate"]] = None  # 速度/召回率取捨
+    search_mode: Optional[Literal["hybrid", "vector"]] = None  # 預設 settings.rag_search_mode
     
     class Config:
         json_schema_extra = {
@@ -51,6 +63,7 @@ class RAGQueryResponse(BaseModel):
     query_text: str
     results: list[RAGResult]
     suggestions: list[str]  # AI 生成的維修建議
+    cached: bool = False  # 是否為查詢結果快取命中
 
 
 class AddToRAGRequest(BaseModel):
@@ -80,10 +93,69 @@ class AddToRAGResponse(BaseModel):
     message: str
 
 
+class BulkAddRequest(BaseModel):
+    """批次新增資料到 RAG 知識庫"""
+    items: list[AddToRAGRequest]
+    stream: bool = False  # True 時以 NDJSON 串流回報進度
+
+
+class BulkAddResponse(BaseModel):
+    """批次新增回應"""
+    success: bool
+    count: int
+    ids: list[str]
+    duplicates: int = 0  # 重複項目數（處理方式見 settings.rag_dedup_policy）
+    message: str
+
+
 # ============ API Endpoints ============
 
+def _query_cache_key(rag_service: RAGService, request: RAGQueryRequest) -> str:
+    """查詢結果快取鍵（/query 與 /query/stream 共用）"""
+    return rag_service.query_cache.make_key(
+        [request.equipment_type, request.anomaly_description, request.condition_assessment],
+        request.filters,
+        top_k=request.top_k,
+        recall=request.recall,
+        search_mode=request.search_mode,
+    )
+
+
+def _build_query_text(request: RAGQueryRequest) -> str:
+    """建構查詢文字"""
+    return f"""
+設備類型: {request.equipment_type}
+異常描述: {request.anomaly_description}
+狀況評估: {request.condition_assessment or '無'}
+"""
+
+
+async def _search_for_request(rag_service: RAGService, request: RAGQueryRequest) -> list[dict]:
+    """執行 RAG 查詢"""
+    return await rag_service.search_similar(
+        query_text=_build_query_text(request),
+        top_k=request.top_k,
+        filters=request.filters,
+        recall=request.recall,
+        mode=request.search_mode,
+        lexical_text=" ".join(filter(None, [
+            request.equipment_type,
+            request.anomaly_description,
+            request.condition_assessment,
+        ])),
+    )
+
+
+def _sse(event: str, data: dict) -> str:
+    """格式化一筆 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @router.post("/query", response_model=RAGQueryResponse)
-async def query_similar_cases(request: RAGQueryRequest):
+async def query_similar_cases(
+    request: RAGQueryRequest,
+    rag_service: RAGService = Depends(get_rag_service),
+):
     """
     查詢相似案例
     
@@ -91,21 +163,18 @@ async def query_similar_cases(request: RAGQueryRequest):
     """
     try:
         print(f"🔍 [Backend] RAG Query received: {request.equipment_type}")
-        rag_service = RAGService()
         
-        # 建構查詢文字
-        query_text = f"""
-設備類型: {request.equipment_type}
-異常描述: {request.anomaly_description}
-狀況評估: {request.condition_assessment or '無'}
-"""
+        # 查詢結果快取（知識庫寫入後失效）
+        cache = rag_service.query_cache
+        cache_key = _query_cache_key(rag_service, request)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print(f"⚡ [Backend] RAG Query cache hit")
+            return cached.model_copy(update={"cached": True})
+        generation = cache.generation
         
         # 執行 RAG 查詢
-        results = await rag_service.search_similar(
-            query_text=query_text,
-            top_k=request.top_k,
-            filters=request.filters
-        )
+        results = await _search_for_request(rag_service, request)
         print(f"✅ [Backend] Found {len(results)} similar cases")
         
         # 根據結果生成建議
@@ -115,11 +184,14 @@ async def query_similar_cases(request: RAGQueryRequest):
         )
         print(f"💡 [Backend] Generated {len(suggestions)} suggestions")
         
-        return RAGQueryResponse(
-            query_text=query_text.strip(),
+        response = RAGQueryResponse(
+            query_text=_build_query_text(request).strip(),
             results=results,
             suggestions=suggestions
         )
+        if SUGGESTIONS_UNAVAILABLE not in suggestions:
+            cache.put(cache_key, response, generation=generation)
+        return response
         
     except Exception as e:
         logger.error(f"RAG query failed: {e}")
@@ -127,8 +199,80 @@ async def query_similar_cases(request: RAGQueryRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/query/stream")
+async def query_similar_cases_stream(
+    request: RAGQueryRequest,
+    rag_service: RAGService = Depends(get_rag_service),
+):
+    """
+    查詢相似案例（Server-Sent Events 串流）
+    
+    相似案例查詢完成後立即送出，維修建議則隨模型產生逐條送出：
+    event: results    data: {"query_text", "results", "cached"}
+    event: suggestion data: {"text"}（每條建議一筆）
+    event: done       data: {"count", "cached"}
+    event: error      data: {"detail"}（取代 done；已送出的建議不完整，也不寫入查詢快取）
+    """
+    print(f"🔍 [Backend] RAG Query (stream) received: {request.equipment_type}")
+    
+    cache = rag_service.query_cache
+    cache_key = _query_cache_key(rag_service, request)
+    
+    async def event_stream():
+        try:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                print(f"⚡ [Backend] RAG Query cache hit")
+                yield _sse("results", {
+                    "query_text": cached.query_text,
+                    "results": [r.model_dump() for r in cached.results],
+                    "cached": True,
+                })
+                for suggestion in cached.suggestions:
+                    yield _sse("suggestion", {"text": suggestion})
+                yield _sse("done", {"count": len(cached.suggestions), "cached": True})
+                return
+            generation = cache.generation
+            
+            query_text = _build_query_text(request).strip()
+            results = await _search_for_request(rag_service, request)
+            print(f"✅ [Backend] Found {len(results)} similar cases")
+            yield _sse("results", {"query_text": query_text, "results": results, "cached": False})
+            
+            suggestions: list[str] = []
+            async for suggestion in rag_service.stream_suggestions(
+                query=request.model_dump(),
+                similar_cases=results,
+            ):
+                suggestions.append(suggestion)
+                yield _sse("suggestion", {"text": suggestion})
+            print(f"💡 [Backend] Streamed {len(suggestions)} suggestions")
+            
+            if SUGGESTIONS_UNAVAILABLE not in suggestions:
+                cache.put(cache_key, RAGQueryResponse(
+                    query_text=query_text,
+                    results=results,
+                    suggestions=suggestions,
+                ), generation=generation)
+            yield _sse("done", {"count": len(suggestions), "cached": False})
+            
+        except Exception as e:
+            logger.error(f"RAG stream query failed: {e}")
+            print(f"❌ [Backend] RAG stream query failed: {e}")
+            yield _sse("error", {"detail": str(e)})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post("/add", response_model=AddToRAGResponse)
-async def add_to_knowledge_base(request: AddToRAGRequest):
+async def add_to_knowledge_base(
+    request: AddToRAGRequest,
+    rag_service: RAGService = Depends(get_rag_service),
+):
     """
     新增資料到知識庫
     
@@ -136,7 +280,6 @@ async def add_to_knowledge_base(request: AddToRAGRequest):
     """
     try:
         print(f"📝 [Backend] Adding to knowledge base: {request.equipment_type}")
-        rag_service = RAGService()
         
         # 建構完整內容
         full_content = f"[{request.equipment_type}] {request.content}"
@@ -164,39 +307,171 @@ async def add_to_knowledge_base(request: AddToRAGRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/bulk-add", response_model=BulkAddResponse)
+async def bulk_add_to_knowledge_base(
+    request: BulkAddRequest,
+    rag_service: RAGService = Depends(get_rag_service),
+):
+    """
+    批次新增資料到知識庫
+    
+    以批次 Embedding 向量化，每段以單一交易寫入。
+    stream=true 時回傳 NDJSON 進度串流：
+    {"event": "progress", "processed": n, "total": N} ... {"event": "done", "count": N, "ids": [...], "duplicates": d}
+    
+    重複項目依 settings.rag_dedup_policy 處理（預設 skip：不寫入，ids 中為既有項目 id）。
+    """
+    records = [{
+        "content": f"[{item.equipment_type}] {item.content}",
+        "equipment_type": item.equipment_type,
+        "source_type": item.source_type,
+        "source_id": item.source_id,
+        "metadata": item.metadata,
+    } for item in request.items]
+    
+    print(f"📦 [Backend] Bulk adding {len(records)} items to knowledge base")
+    
+    if request.stream:
+        async def progress_stream():
+            ids: list[str] = []
+            duplicates = 0
+            try:
+                async for progress in rag_service.add_items_iter(records):
+                    ids.extend(progress["ids"])
+                    duplicates += progress["duplicates"]
+                    yield json.dumps({
+                        "event": "progress",
+                        "processed": progress["processed"],
+                        "total": progress["total"],
+                    }) + "\n"
+                yield json.dumps({
+                    "event": "done",
+                    "count": len(ids),
+                    "ids": ids,
+                    "duplicates": duplicates,
+                }) + "\n"
+            except Exception as e:
+                logger.error(f"Bulk add failed: {e}")
+                yield json.dumps({
+                    "event": "error",
+                    "processed": len(ids),
+                    "ids": ids,
+                    "detail": str(e),
+                }) + "\n"
+        
+        return StreamingResponse(progress_stream(), media_type="application/x-ndjson")
+    
+    try:
+        ids: list[str] = []
+        duplicates = 0
+        async for progress in rag_service.add_items_iter(records):
+            ids.extend(progress["ids"])
+            duplicates += progress["duplicates"]
+        print(f"✅ [Backend] Bulk added {len(ids)} items ({duplicates} duplicates)")
+        return BulkAddResponse(
+            success=True,
+            count=len(ids),
+            ids=ids,
+            duplicates=duplicates,
+            message=f"成功加入 {len(ids)} 筆知識"
+        )
+    except Exception as e:
+        logger.error(f"Bulk add failed: {e}")
+        print(f"❌ [Backend] Bulk add failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/stats")
-async def get_knowledge_base_stats():
-    """取得知識庫統計資訊"""
+async def get_knowledge_base_stats(
+    refresh: bool = False,
+    rag_service: RAGService = Depends(get_rag_service),
+):
+    """
+    取得知識庫統計資訊
+    
+    回傳增量維護的計數（reconciled_at 為最後完整計數時間），refresh=true 強制重新計數
+    """
     try:
-        rag_service = RAGService()
-        stats = await rag_service.get_stats()
+        stats = await rag_service.get_stats(refresh=refresh)
         return stats
     except Exception as e:
         logger.error(f"Get stats failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/cache/stats")
+async def get_cache_stats(
+    embedding_service: EmbeddingService = Depends(get_embedding_service),
+    rag_service: RAGService = Depends(get_rag_service),
+):
+    """取得快取命中統計（供快取容量調校）"""
+    return {
+        "embedding": embedding_service.cache_stats(),
+        "query": rag_service.query_cache.stats(),
+    }
+
+
 @router.get("/items")
-async def get_knowledge_items(skip: int = 0, limit: int = 100):
+async def get_knowledge_items(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    rag_service: RAGService = Depends(get_rag_service),
+):
     """
     取得知識庫項目列表
+    
+    依建立時間新到舊排序。深分頁請改用 cursor：
+    回應標頭 X-Next-Cursor 為下一頁游標（最後一頁時不提供），帶入 cursor 參數取得下一頁。
     """
     try:
-        rag_service = RAGService()
-        items = await rag_service.get_all_items(skip=skip, limit=limit)
+        items = await rag_service.get_all_items(skip=skip, limit=limit, cursor=cursor)
+        following = next_cursor(items, limit)
+        if following:
+            response.headers["X-Next-Cursor"] = following
         return items
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Get items failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/items/export")
+async def export_knowledge_items(
+    batch_size: int = 1000,
+    rag_service: RAGService = Depends(get_rag_service),
+):
+    """
+    完整匯出知識庫（NDJSON 串流，每行一筆，不含 embedding）
+    
+    以 keyset 分頁逐批讀取，記憶體用量與知識庫大小無關。
+    """
+    async def item_stream():
+        try:
+            async for item in rag_service.iter_all_items(batch_size=max(1, batch_size)):
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error(f"Export items failed: {e}")
+            yield json.dumps({"event": "error", "detail": str(e)}) + "\n"
+    
+    return StreamingResponse(
+        item_stream(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="rag_items.ndjson"'},
+    )
+
+
 @router.delete("/items/{item_id}")
-async def delete_knowledge_item(item_id: str):
+async def delete_knowledge_item(
+    item_id: str,
+    rag_service: RAGService = Depends(get_rag_service),
+):
     """
     刪除知識庫項目
     """
     try:
-        rag_service = RAGService()
         success = await rag_service.delete_item(item_id)
         if not success:
             raise HTTPException(status_code=404, detail="Item not found")
@@ -208,16 +483,36 @@ async def delete_knowledge_item(item_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/upload")
-async def upload_document(file: UploadFile = File(...)):
+@router.post("/admin/rebuild-index")
+async def rebuild_vector_index(
+    index_type: Optional[Literal["hnsw", "ivfflat"]] = None,
+    rag_service: RAGService = Depends(get_rag_service),
+):
+    """
+    重建向量索引
+
+    大量匯入後呼叫，依目前資料量重新計算 IVFFlat lists 或重建 HNSW 圖。
+    新索引以 CONCURRENTLY 建立，重建期間查詢與寫入不受阻擋。
     """
-    上傳並分析維修手冊
+    try:
+        result = await rag_service.rebuild_index(index_type)
+        return {"success": True, **result}
+    except Exception as e:
+        logger.error(f"Rebuild index failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/upload", status_code=202)
+async def upload_document(
+    file: UploadFile = File(...),
+    import_queue: ImportJobQueue = Depends(get_import_queue),
+):
     """
-    import shutil
-    import os
-    import uuid
-    from app.services.rag import UPLOAD_DIR
+    上傳維修手冊
     
+    檔案存檔後立即回傳工作 id，分析與入庫於背景執行；
+    以 GET /api/rag/upload/jobs/{job_id} 查詢進度。
+    """
     try:
         source_filename = file.filename
         
@@ -225,23 +520,22 @@ async def upload_document(file: UploadFile = File(...)):
         if not os.path.exists(UPLOAD_DIR):
             os.makedirs(UPLOAD_DIR)
             
-        # 儲存暫存檔
+        # 儲存暫存檔（背景工作完成後刪除）
         temp_filename = f"{uuid.uuid4()}_{source_filename}"
         temp_path = os.path.join(UPLOAD_DIR, temp_filename)
         
         with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+            await asyncio.to_thread(shutil.copyfileobj, file.file, buffer)
             
-        print(f"📄 [Backend] Received file: {source_filename}, analyzing...")
-        
-        rag_service = RAGService()
-        result = await rag_service.import_from_document(temp_path, source_filename)
+        job = import_queue.submit(temp_path, source_filename)
+        print(f"📄 [Backend] Received file: {source_filename}, queued as job {job['id']}")
         
-        # 清理暫存檔
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-            
-        return result
+        return {
+            "success": True,
+            "job_id": job["id"],
+            "status": job["status"],
+            "message": f"已排入背景分析：{source_filename}",
+        }
         
     except Exception as e:
         logger.error(f"Upload failed: {e}")
@@ -249,3 +543,27 @@ async def upload_document(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/upload/jobs")
+async def list_import_jobs(
+    limit: int = 50,
+    import_queue: ImportJobQueue = Depends(get_import_queue),
+):
+    """列出最近的文件匯入工作"""
+    return import_queue.recent(limit=limit)
+
+
+@router.get("/upload/jobs/{job_id}")
+async def get_import_job(
+    job_id: str,
+    import_queue: ImportJobQueue = Depends(get_import_queue),
+):
+    """
+    查詢文件匯入工作狀態
+    
+    status: queued / running / retrying / completed / failed；
+    stage 為 uploading / analyzing / importing，importing 時 processed / total 為入庫進度
+    """
+    job = import_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -12,7 +12,7 @@ autofill_core — 通用表單自動回填核心模組
 - `app.constants.INSPECTION_FIELDS`（巡檢專屬欄位）
 - 任何 `app.models.*` 中的巡檢資料結構
 
-允許依賴：openpyxl、python-docx、google.generativeai（AI 映射為 optional）、
+允許依賴：openpyxl、python-docx、lxml（python-docx 的依賴）、google.generativeai（AI 映射為 optional）、
 以及本套件內的模組。
 
 ## 組成
@@ -21,7 +21,11 @@ autofill_core — 通用表單自動回填核心模組
 |------|------|
 | `field_detection` | 欄位標籤、佔位符、型別偵測、值轉換 |
 | `excel_engine` | Excel 讀寫、合併儲存格處理、格式保留 |
+| `xlsx_patch` | xlsx 直接 XML 修補（快速回填路徑，只改寫目標工作表） |
+| `merged_cells` | 合併儲存格索引（座標 → 合併範圍，O(1) 查詢） |
 | `word_engine` | Word 段落/表格讀寫、格式保留 |
+| `docx_patch` | docx 直接 XML 修補（快速回填路徑，只改寫主文件 XML） |
+| `template_cache` | 已解析模板 LRU 快取（同一模板重複回填略過解析） |
 | `structure_analyzer` | Excel/Word 結構深度分析 → field_map |
 | `ai_mapper` | 將任意 source_records 映射到 field_map（通用） |
 
@@ -54,6 +58,10 @@ from app.autofill_core.field_detection import (
     replace_paragraph_text_preserve_format,
     DEFAULT_FIELD_KEYWORDS,
 )
+from app.autofill_core.merged_cells import build_merge_lookup, merged_top_left
+from app.autofill_core.template_cache import TemplateCache
+from app.autofill_core.xlsx_patch import XlsxPatchUnsupported, patch_xlsx
+from app.autofill_core.docx_patch import DocxPatchUnsupported, patch_docx
 from app.autofill_core.excel_engine import ExcelAutoFillEngine
 from app.autofill_core.word_engine import WordAutoFillEngine
 from app.autofill_core.structure_analyzer import StructureAnalyzer
@@ -67,6 +75,13 @@ __all__ = [
     "convert_value",
     "replace_paragraph_text_preserve_format",
     "DEFAULT_FIELD_KEYWORDS",
+    "build_merge_lookup",
+    "merged_top_left",
+    "TemplateCache",
+    "patch_xlsx",
+    "XlsxPatchUnsupported",
+    "patch_docx",
+    "DocxPatchUnsupported",
     "ExcelAutoFillEngine",
     "WordAutoFillEngine",
     "StructureAnalyzer",
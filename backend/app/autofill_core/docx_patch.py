@@ -0,0 +1,83 @@
+"""
+docx 直接 XML 修補 — 只改寫主文件段落 / 表格時的快速回填路徑
+
+不經 python-docx Document（不載入整個套件、圖片、頁首頁尾等 part）與 doc.save：
+- 只解析主文件 XML（通常為 word/document.xml），以 python-docx 的 oxml 解析器建立元素，
+  回填邏輯沿用同一套段落 / 表格代理物件，寫入結果與完整 Document 路徑一致
+- 其餘 zip 成員（圖片、樣式、頁首頁尾、自訂 XML…）內容原樣複製
+
+遇到無法安全處理的情況拋出 DocxPatchUnsupported，由 WordAutoFillEngine 改用 python-docx：
+找不到主文件 part、主文件不是 w:document、XML 無法解析等。
+"""
+
+import io
+import logging
+import posixpath
+import zipfile
+from typing import Callable
+
+from docx.blkcntnr import BlockItemContainer
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.oxml import serialize_part_xml
+from docx.oxml.ns import qn
+from docx.oxml.parser import parse_xml
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+_NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+
+class DocxPatchUnsupported(Exception):
+    """無法以 XML 修補處理，需改用 python-docx"""
+
+
+def patch_docx(file_content: bytes, apply: Callable[[BlockItemContainer], None]) -> bytes:
+    """修補 docx 主文件，回傳新的 docx bytes。
+
+    Args:
+        file_content: 原始 docx bytes
+        apply: 以主文件 body 呼叫的回填函式；body 提供與 Document 相同的
+            paragraphs / tables（只含最上層段落與表格）
+
+    Raises:
+        DocxPatchUnsupported: 需改用 python-docx 回填
+    """
+    try:
+        zin = zipfile.ZipFile(io.BytesIO(file_content))
+    except zipfile.BadZipFile as e:
+        raise DocxPatchUnsupported(f"not a zip file: {e}")
+
+    with zin:
+        part = _main_document_part(zin)
+        try:
+            document = parse_xml(zin.read(part))
+        except etree.XMLSyntaxError as e:
+            raise DocxPatchUnsupported(f"invalid {part}: {e}")
+        if document.tag != qn("w:document") or document.body is None:
+            raise DocxPatchUnsupported(f"unsupported main document root: {document.tag}")
+
+        apply(BlockItemContainer(document.body, None))
+        patched = serialize_part_xml(document)
+
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, "w") as zout:
+            for info in zin.infolist():
+                zout.writestr(info, patched if info.filename == part else zin.read(info))
+    return output.getvalue()
+
+
+def _main_document_part(zin: zipfile.ZipFile) -> str:
+    """主文件 zip 成員路徑（由套件根目錄的 _rels/.rels 解析）"""
+    try:
+        rels = etree.fromstring(zin.read("_rels/.rels"))
+    except KeyError:
+        raise DocxPatchUnsupported("missing package relationships")
+
+    for rel in rels.iterfind(f"{{{_NS_PKG_REL}}}Relationship"):
+        if rel.get("Type") != RT.OFFICE_DOCUMENT or rel.get("TargetMode") == "External":
+            continue
+        part = posixpath.normpath(rel.get("Target", "").lstrip("/"))
+        if part in zin.namelist():
+            return part
+    raise DocxPatchUnsupported("main document part not found")
@@ -2,6 +2,7 @@
 Excel 自動回填引擎 — 通用 openpyxl 操作
 
 負責將 fill_values 寫入 xlsx 檔案的指定位置，保留字體、對齊、數字格式。
+預設先以 xlsx_patch 直接修補工作表 XML（快速路徑），無法處理時改用 openpyxl。
 不含任何 domain 邏輯。
 """
 
@@ -12,9 +13,11 @@ from typing import Optional
 
 from openpyxl import load_workbook
 from openpyxl.cell.cell import MergedCell
-from openpyxl.utils import get_column_letter, coordinate_to_tuple
 
 from app.autofill_core.field_detection import convert_value
+from app.autofill_core.merged_cells import build_merge_lookup, merged_top_left
+from app.autofill_core.template_cache import TemplateCache
+from app.autofill_core.xlsx_patch import XlsxPatchUnsupported, patch_xlsx
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +25,15 @@ logger = logging.getLogger(__name__)
 class ExcelAutoFillEngine:
     """Excel 表單自動回填引擎"""
 
+    def __init__(self, template_cache: Optional[TemplateCache] = None, xml_patch: bool = True):
+        """
+        Args:
+            template_cache: 已解析模板快取；None 則每次回填都重新解析
+            xml_patch: 先嘗試直接修補工作表 XML（不經 openpyxl 載入 / 儲存整本活頁簿）
+        """
+        self._template_cache = template_cache
+        self._xml_patch = xml_patch
+
     async def fill(
         self,
         file_content: bytes,
@@ -38,7 +50,18 @@ class ExcelAutoFillEngine:
         Returns:
             回填後的 xlsx bytes
         """
-        wb = load_workbook(io.BytesIO(file_content))
+        if self._xml_patch:
+            try:
+                return patch_xlsx(file_content, self._plan_writes(field_lookup, value_lookup))
+            except XlsxPatchUnsupported as e:
+                logger.info(f"XML patch unavailable ({e}), falling back to openpyxl")
+
+        if self._template_cache is not None:
+            wb = self._template_cache.workbook(file_content)
+        else:
+            wb = load_workbook(io.BytesIO(file_content))
+        # 每個工作表的合併儲存格索引（首次遇到合併格時建立，本次回填內共用）
+        merge_lookups: dict[str, dict] = {}
 
         for field_id, value in value_lookup.items():
             field = field_lookup.get(field_id)
@@ -47,7 +70,7 @@ class ExcelAutoFillEngine:
 
             val_loc = field.get("value_location")
             if not val_loc:
-                self._fallback_fill_label_cell(wb, field, value)
+                self._fallback_fill_label_cell(wb, field, value, merge_lookups)
                 continue
 
             sheet_name = val_loc.get("sheet")
@@ -64,7 +87,7 @@ class ExcelAutoFillEngine:
 
             target_cell = ws[cell_coord]
             if isinstance(target_cell, MergedCell):
-                resolved = self._resolve_merged_cell(ws, cell_coord)
+                resolved = self._resolve_merged_cell(ws, cell_coord, merge_lookups)
                 if resolved:
                     target_cell = ws[resolved]
                     logger.info(f"MergedCell {cell_coord} → 左上角 {resolved}")
@@ -90,7 +113,33 @@ class ExcelAutoFillEngine:
         output.seek(0)
         return output.read()
 
-    def _fallback_fill_label_cell(self, wb, field: dict, value) -> None:
+    @staticmethod
+    def _plan_writes(field_lookup: dict, value_lookup: dict) -> list[tuple]:
+        """與 openpyxl 路徑相同的寫入規則，整理為 [(sheet, cell, value), ...] 供 patch_xlsx 使用。"""
+        writes = []
+        for field_id, value in value_lookup.items():
+            field = field_lookup.get(field_id)
+            if not field:
+                continue
+
+            val_loc = field.get("value_location")
+            if val_loc:
+                sheet_name = val_loc.get("sheet")
+                cell_coord = val_loc.get("cell")
+                value = convert_value(value, field.get("field_type", "text"))
+            else:
+                # value_location 不存在時寫入 label 所在儲存格（原值，不轉型）
+                label_loc = field.get("label_location", {})
+                sheet_name = label_loc.get("sheet")
+                cell_coord = label_loc.get("cell")
+
+            if sheet_name and cell_coord:
+                writes.append((sheet_name, cell_coord, value))
+        return writes
+
+    def _fallback_fill_label_cell(
+        self, wb, field: dict, value, merge_lookups: Optional[dict] = None
+    ) -> None:
         """value_location 不存在時，退回寫入 label 所在儲存格。"""
         label_loc = field.get("label_location", {})
         sheet_name = label_loc.get("sheet")
@@ -101,25 +150,25 @@ class ExcelAutoFillEngine:
         ws = wb[sheet_name]
         target = ws[cell_coord]
         if isinstance(target, MergedCell):
-            resolved = self._resolve_merged_cell(ws, cell_coord)
+            resolved = self._resolve_merged_cell(ws, cell_coord, merge_lookups)
             if resolved:
                 ws[resolved] = value
         else:
             ws[cell_coord] = value
 
     @staticmethod
-    def _resolve_merged_cell(ws, cell_coord: str) -> Optional[str]:
-        """找到合併儲存格的左上角座標。"""
-        try:
-            row, col = coordinate_to_tuple(cell_coord)
-        except Exception:
-            return None
-
-        for merge_range in ws.merged_cells.ranges:
-            if cell_coord in merge_range or (
-                merge_range.min_row <= row <= merge_range.max_row
-                and merge_range.min_col <= col <= merge_range.max_col
-            ):
-                return f"{get_column_letter(merge_range.min_col)}{merge_range.min_row}"
-
-        return None
+    def _resolve_merged_cell(
+        ws, cell_coord: str, merge_lookups: Optional[dict] = None
+    ) -> Optional[str]:
+        """找到合併儲存格的左上角座標。
+
+        Args:
+            merge_lookups: {sheet_name: merge_lookup} 快取；同一次回填傳入同一份，
+                每個工作表只建立一次索引，之後每個欄位 O(1) 查詢
+        """
+        if merge_lookups is None:
+            merge_lookups = {}
+        merge_lookup = merge_lookups.get(ws.title)
+        if merge_lookup is None:
+            merge_lookup = merge_lookups[ws.title] = build_merge_lookup(ws)
+        return merged_top_left(merge_lookup, cell_coord)
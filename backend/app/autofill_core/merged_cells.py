@@ -0,0 +1,51 @@
+"""
+合併儲存格索引 — 座標 → 所屬合併範圍
+
+每個工作表只走訪一次 ws.merged_cells.ranges，建立「座標 → 合併範圍資訊」字典，
+之後查詢任一座標是否位於合併範圍、其左上角為何都是 O(1)。
+StructureAnalyzer（merge_lookup）與 ExcelAutoFillEngine（MergedCell 解析）共用。
+"""
+
+from typing import Iterable, Optional
+
+from openpyxl.utils import get_column_letter, coordinate_to_tuple, range_boundaries
+
+
+def build_merge_lookup(ws) -> dict[str, dict]:
+    """建立工作表的合併儲存格索引。
+
+    Returns:
+        {座標: {"range", "top_left", "rows", "cols"}}；同一合併範圍內的座標共用同一份資訊
+    """
+    return merge_lookup_from_refs(str(mr) for mr in ws.merged_cells.ranges)
+
+
+def merge_lookup_from_refs(refs: Iterable[str]) -> dict[str, dict]:
+    """由合併範圍字串（如 "B2:D5"，工作表 XML 的 <mergeCell ref>）建立合併儲存格索引。"""
+    lookup: dict[str, dict] = {}
+    for ref in refs:
+        min_col, min_row, max_col, max_row = range_boundaries(ref)
+        info = {
+            "range": ref,
+            "top_left": f"{get_column_letter(min_col)}{min_row}",
+            "rows": max_row - min_row + 1,
+            "cols": max_col - min_col + 1,
+        }
+        for col in range(min_col, max_col + 1):
+            letter = get_column_letter(col)
+            for row in range(min_row, max_row + 1):
+                lookup[f"{letter}{row}"] = info
+    return lookup
+
+
+def merged_top_left(merge_lookup: dict[str, dict], cell_coord: str) -> Optional[str]:
+    """座標所屬合併範圍的左上角；不在合併範圍內（或座標無效）時回傳 None。"""
+    info = merge_lookup.get(cell_coord)
+    if info is None:
+        # 容許小寫或絕對參照（$A$1）寫法
+        try:
+            row, col = coordinate_to_tuple(cell_coord.replace("$", "").upper())
+        except Exception:
+            return None
+        info = merge_lookup.get(f"{get_column_letter(col)}{row}")
+    return info["top_left"] if info else None
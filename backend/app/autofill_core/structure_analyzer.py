@@ -20,6 +20,7 @@ from app.autofill_core.field_detection import (
     is_placeholder,
     guess_field_type,
 )
+from app.autofill_core.merged_cells import build_merge_lookup
 
 logger = logging.getLogger(__name__)
 
@@ -75,18 +76,7 @@ class StructureAnalyzer:
         for sheet_name in wb.sheetnames:
             ws = wb[sheet_name]
 
-            merged_ranges = list(ws.merged_cells.ranges)
-            merge_lookup: dict = {}
-            for mr in merged_ranges:
-                for row in range(mr.min_row, mr.max_row + 1):
-                    for col in range(mr.min_col, mr.max_col + 1):
-                        coord = f"{get_column_letter(col)}{row}"
-                        merge_lookup[coord] = {
-                            "range": str(mr),
-                            "top_left": f"{get_column_letter(mr.min_col)}{mr.min_row}",
-                            "rows": mr.max_row - mr.min_row + 1,
-                            "cols": mr.max_col - mr.min_col + 1,
-                        }
+            merge_lookup = build_merge_lookup(ws)
 
             max_row = min(ws.max_row or 1, self._max_rows)
             max_col = min(ws.max_column or 1, self._max_cols)
@@ -0,0 +1,136 @@
+"""
+已解析模板快取 — 同一份表單重複回填時略過 XML 解析
+
+以模板內容的 SHA-256 為鍵，保存解析後的原始（未回填）狀態，每次回填取得一份獨立複本：
+- xlsx：保存 openpyxl Workbook 的 pickle 快照，還原（pickle.loads）約比 load_workbook 快一個數量級
+- docx：保存 python-docx Document（lxml 元素無法 pickle），以 copy.deepcopy 複製；
+  大小以 zip 內各成員未壓縮大小總和的兩倍估算（快照與解析時的 Document 各一份）
+
+依最近使用順序淘汰（LRU），上限為項目數與快照總大小（位元組）。
+無法建立快照的模板（例如含 openpyxl 無法 pickle 的物件）不快取，照常解析回填。
+"""
+
+import copy
+import hashlib
+import io
+import logging
+import pickle
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from docx import Document
+from openpyxl import load_workbook
+
+logger = logging.getLogger(__name__)
+
+
+class TemplateCache:
+    """以內容雜湊為鍵的已解析模板 LRU 快取"""
+
+    def __init__(self, max_entries: int = 32, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            max_entries: 最多保存的模板數，0 表示停用（每次都重新解析）
+            max_bytes: 快照總大小上限（xlsx 以 pickle 快照、docx 以未壓縮內容的兩倍估算）
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple[str, str], tuple[object, int]] = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    # ================================================================
+    # Public API
+    # ================================================================
+
+    def workbook(self, content: bytes):
+        """取得 xlsx 模板的獨立 openpyxl Workbook 複本。"""
+        return self._checkout("xlsx", content, _parse_workbook, pickle.loads)
+
+    def document(self, content: bytes):
+        """取得 docx 模板的獨立 python-docx Document 複本。"""
+        return self._checkout("docx", content, _parse_document, copy.deepcopy)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    # ================================================================
+    # 內部
+    # ================================================================
+
+    def _checkout(
+        self,
+        kind: str,
+        content: bytes,
+        parse: Callable[[bytes, bool], tuple[object, Optional[object], int]],
+        restore: Callable[[object], object],
+    ):
+        key = (kind, hashlib.sha256(content).hexdigest())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+            else:
+                self._misses += 1
+        if entry is not None:
+            return restore(entry[0])
+
+        # 未命中：本次直接使用剛解析的物件，另存快照供下次複製
+        parsed, snapshot, size = parse(content, self.max_entries > 0)
+        if snapshot is not None and size <= self.max_bytes:
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = (snapshot, size)
+                    self._bytes += size
+                    self._evict()
+        return parsed
+
+    def _evict(self) -> None:
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            _, (_, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+
+
+def _parse_workbook(content: bytes, snapshot: bool):
+    wb = load_workbook(io.BytesIO(content))
+    if not snapshot:
+        return wb, None, 0
+    try:
+        data = pickle.dumps(wb, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        logger.info(f"Workbook template not cacheable: {e}")
+        return wb, None, 0
+    return wb, data, len(data)
+
+
+def _parse_document(content: bytes, snapshot: bool):
+    doc = Document(io.BytesIO(content))
+    if not snapshot:
+        return doc, None, 0
+    # Document 無法序列化計算實際大小；zip 壓縮後的檔案大小遠小於解析後的記憶體用量，
+    # 改以各 part 未壓縮大小估算，並計入快照與本次回填使用的兩份物件
+    with zipfile.ZipFile(io.BytesIO(content)) as zf:
+        size = 2 * sum(info.file_size for info in zf.infolist())
+    return doc, copy.deepcopy(doc), size
@@ -2,15 +2,19 @@
 Word 自動回填引擎 — 通用 python-docx 操作
 
 負責將 fill_values 寫入 docx 檔案的段落或表格儲存格位置，保留格式。
+預設先以 docx_patch 直接修補主文件 XML（快速路徑），無法處理時改用完整 Document。
 不含任何 domain 邏輯。
 """
 
 import io
 import logging
+from typing import Optional
 
 from docx import Document
 
 from app.autofill_core.field_detection import replace_paragraph_text_preserve_format
+from app.autofill_core.docx_patch import DocxPatchUnsupported, patch_docx
+from app.autofill_core.template_cache import TemplateCache
 
 logger = logging.getLogger(__name__)
 
@@ -18,15 +22,53 @@ logger = logging.getLogger(__name__)
 class WordAutoFillEngine:
     """Word 表單自動回填引擎"""
 
+    def __init__(self, template_cache: Optional[TemplateCache] = None, xml_patch: bool = True):
+        """
+        Args:
+            template_cache: 已解析模板快取；None 則每次回填都重新解析
+            xml_patch: 預設先嘗試直接修補主文件 XML（不載入整個 Document）
+        """
+        self._template_cache = template_cache
+        self._xml_patch = xml_patch
+
     async def fill(
         self,
         file_content: bytes,
         field_lookup: dict,
         value_lookup: dict,
+        xml_patch: Optional[bool] = None,
     ) -> bytes:
-        """將 value_lookup 中的值寫入 field_lookup 指定的段落/表格位置。"""
-        doc = Document(io.BytesIO(file_content))
+        """將 value_lookup 中的值寫入 field_lookup 指定的段落/表格位置。
+
+        Args:
+            xml_patch: 本次是否走 XML 修補快速路徑；None 則依建構時的設定
+        """
+        if xml_patch is None:
+            xml_patch = self._xml_patch
+        if xml_patch:
+            try:
+                return patch_docx(
+                    file_content,
+                    lambda body: self._fill_values(body, field_lookup, value_lookup),
+                )
+            except DocxPatchUnsupported as e:
+                logger.info(f"XML patch unavailable ({e}), falling back to python-docx")
+
+        if self._template_cache is not None:
+            doc = self._template_cache.document(file_content)
+        else:
+            doc = Document(io.BytesIO(file_content))
+
+        self._fill_values(doc, field_lookup, value_lookup)
+
+        output = io.BytesIO()
+        doc.save(output)
+        output.seek(0)
+        return output.read()
 
+    def _fill_values(self, doc, field_lookup: dict, value_lookup: dict) -> None:
+        """寫入所有欄位；doc 為 Document 或主文件 body（皆提供 paragraphs / tables）。"""
+        index = _DocumentIndex(doc)
         for field_id, value in value_lookup.items():
             field = field_lookup.get(field_id)
             if not field:
@@ -39,21 +81,16 @@ class WordAutoFillEngine:
             loc_type = val_loc.get("type")
 
             if loc_type == "paragraph":
-                self._fill_paragraph(doc, val_loc, value)
+                self._fill_paragraph(index, val_loc, value)
             elif loc_type == "table":
-                self._fill_table_cell(doc, field, val_loc, value)
+                self._fill_table_cell(index, field, val_loc, value)
 
-        output = io.BytesIO()
-        doc.save(output)
-        output.seek(0)
-        return output.read()
-
-    def _fill_paragraph(self, doc, val_loc: dict, value) -> None:
+    def _fill_paragraph(self, index: "_DocumentIndex", val_loc: dict, value) -> None:
         para_idx = val_loc.get("paragraph_index")
-        if para_idx is None or para_idx >= len(doc.paragraphs):
+        if para_idx is None or para_idx >= len(index.paragraphs):
             return
 
-        para = doc.paragraphs[para_idx]
+        para = index.paragraphs[para_idx]
         replace_pattern = val_loc.get("replace_pattern", "after_colon")
 
         if replace_pattern == "after_colon":
@@ -68,7 +105,7 @@ class WordAutoFillEngine:
         else:
             replace_paragraph_text_preserve_format(para, value)
 
-    def _fill_table_cell(self, doc, field: dict, val_loc: dict, value) -> None:
+    def _fill_table_cell(self, index: "_DocumentIndex", field: dict, val_loc: dict, value) -> None:
         table_idx = val_loc.get("table_index")
         row_idx = val_loc.get("row_index")
         cell_idx = val_loc.get("cell_index")
@@ -81,23 +118,64 @@ class WordAutoFillEngine:
 
         if not (
             table_idx is not None
-            and table_idx < len(doc.tables)
+            and table_idx < len(index.tables)
             and row_idx is not None
             and cell_idx is not None
         ):
             return
 
-        table = doc.tables[table_idx]
-        if row_idx >= len(table.rows):
-            return
-        row = table.rows[row_idx]
-        if cell_idx >= len(row.cells):
+        cells = index.row_cells(table_idx, row_idx)
+        if cells is None or cell_idx >= len(cells):
             return
 
-        cell = row.cells[cell_idx]
+        cell = cells[cell_idx]
         if cell.paragraphs:
             replace_paragraph_text_preserve_format(
                 cell.paragraphs[0], str(value)
             )
         else:
             cell.text = str(value)
+
+
+class _DocumentIndex:
+    """單次回填共用的段落 / 表格 / 儲存格格線索引
+
+    python-docx 每次存取 doc.paragraphs、doc.tables 都重建整份代理清單，row.cells 更會
+    重新展開整張表格的格線，逐欄位存取使回填成本為 O(欄位數 × 文件大小)。
+    每份文件只建立一次（表格格線於首次寫入該表格時建立），之後每個欄位 O(1) 定位。
+    回填只改寫段落 / 儲存格內容，不增刪段落、表格與列，索引在整次回填內有效。
+    """
+
+    def __init__(self, doc):
+        self.paragraphs = doc.paragraphs
+        self.tables = doc.tables
+        self._grids: dict[int, list] = {}
+
+    def row_cells(self, table_idx: int, row_idx: int) -> Optional[list]:
+        """等同 table.rows[row_idx].cells（合併格重複出現）；列不存在時回傳 None"""
+        grid = self._grids.get(table_idx)
+        if grid is None:
+            grid = self._grids[table_idx] = _cell_grid(self.tables[table_idx])
+        if row_idx >= len(grid):
+            return None
+        return grid[row_idx]
+
+
+def _cell_grid(table) -> list:
+    """表格的逐列儲存格清單
+
+    優先以 python-docx 內部的 Table._cells（row.cells 每次呼叫都重新展開的完整格線）
+    一次取得並切成各列；該內部 API 不存在或格線形狀不符時，改用公開的 row.cells
+    （每列各展開一次，仍只在首次寫入該表格時發生）。
+    """
+    rows = list(table.rows)
+    cells = _internal_cells(table)
+    column_count = len(table.columns)
+    if cells is None or len(cells) != len(rows) * column_count:
+        return [list(row.cells) for row in rows]
+    return [cells[i * column_count:(i + 1) * column_count] for i in range(len(rows))]
+
+
+def _internal_cells(table) -> Optional[list]:
+    """python-docx 的 Table._cells（未公開 API，已驗證於 1.1）；不存在時回傳 None"""
+    return getattr(table, "_cells", None)
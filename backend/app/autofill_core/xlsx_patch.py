@@ -0,0 +1,285 @@
+"""
+xlsx 直接 XML 修補 — 只寫入儲存格值時的快速回填路徑
+
+不經 openpyxl 物件模型與 wb.save：
+- 只解析被寫入的工作表 XML（xl/worksheets/sheetN.xml），修補目標 <c> 元素
+  （字串寫為 inline string、數值 / 布林寫入 <v>，保留 s 樣式屬性）
+- 其餘 zip 成員（sharedStrings、styles、圖片、樞紐分析、VBA…）內容原樣複製，
+  不會遺失 openpyxl 不支援的功能
+- 活頁簿含公式時與 openpyxl 相同：於 workbook.xml 設定 <calcPr fullCalcOnLoad="1"/>，
+  並清除被修補工作表中公式儲存格的快取值，避免開啟時顯示依舊值計算的結果
+
+遇到無法安全處理的情況拋出 XlsxPatchUnsupported，由 ExcelAutoFillEngine 改用 openpyxl：
+公式儲存格、以 "=" 開頭或含非法字元的字串、非數值 / 字串型別、列或儲存格缺少座標等。
+"""
+
+import bisect
+import io
+import logging
+import math
+import posixpath
+import re
+import zipfile
+from typing import Any, Optional
+
+from lxml import etree
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import column_index_from_string, coordinate_to_tuple, get_column_letter
+
+from app.autofill_core.merged_cells import merge_lookup_from_refs, merged_top_left
+
+logger = logging.getLogger(__name__)
+
+_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_NS_DOC_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+_XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+
+_ROW = f"{{{_NS}}}row"
+_CELL = f"{{{_NS}}}c"
+_VALUE = f"{{{_NS}}}v"
+_FORMULA = f"{{{_NS}}}f"
+_INLINE = f"{{{_NS}}}is"
+_TEXT = f"{{{_NS}}}t"
+
+_WORKBOOK_PART = "xl/workbook.xml"
+_CALC_PR = f"{{{_NS}}}calcPr"
+# CT_Workbook 中排在 calcPr 之後的元素（新增 calcPr 時插在第一個之前）
+_AFTER_CALC_PR = tuple(
+    f"{{{_NS}}}{name}" for name in (
+        "oleSize", "customWorkbookViews", "pivotCaches", "smartTagPr", "smartTagTypes",
+        "webPublishing", "fileRecoveryPr", "webPublishObjects", "extLst",
+    )
+)
+
+_COLUMN_RE = re.compile(r"^([A-Z]+)")
+# 未修補的工作表只需判斷是否含公式，以位元組搜尋 <f> / <x:f ...> 避免解析
+_FORMULA_TAG_RE = re.compile(rb"<(?:[\w.-]+:)?f[\s/>]")
+
+# 大型工作表（數十萬列）需解除 lxml 預設的樹深度 / 文字長度限制
+_PARSER = etree.XMLParser(huge_tree=True)
+
+
+class XlsxPatchUnsupported(Exception):
+    """無法以 XML 修補處理，需改用 openpyxl"""
+
+
+def patch_xlsx(file_content: bytes, writes: list[tuple[str, str, Any]]) -> bytes:
+    """將 writes 寫入 xlsx，回傳新的 xlsx bytes。
+
+    Args:
+        file_content: 原始 xlsx bytes
+        writes: [(sheet_name, cell_coord, value), ...]；同一儲存格以最後一筆為準，
+            合併範圍內的座標寫入左上角，不存在的工作表略過
+
+    Raises:
+        XlsxPatchUnsupported: 需改用 openpyxl 回填
+    """
+    try:
+        zin = zipfile.ZipFile(io.BytesIO(file_content))
+    except zipfile.BadZipFile as e:
+        raise XlsxPatchUnsupported(f"not a zip file: {e}")
+
+    with zin:
+        sheet_parts = _sheet_parts(zin)
+
+        by_part: dict[str, dict[str, Any]] = {}
+        for sheet_name, cell_coord, value in writes:
+            part = sheet_parts.get(sheet_name)
+            if part is None:
+                logger.warning(f"Sheet '{sheet_name}' not found, skipping cell {cell_coord}")
+                continue
+            _check_value(value)
+            by_part.setdefault(part, {})[_normalize_coord(cell_coord)] = value
+
+        patched: dict[str, bytes] = {}
+        has_formulas = False
+        for part, cells in by_part.items():
+            patched[part], sheet_has_formulas = _patch_sheet(zin.read(part), cells)
+            has_formulas = has_formulas or sheet_has_formulas
+        if patched and not has_formulas:
+            has_formulas = any(
+                _FORMULA_TAG_RE.search(zin.read(part))
+                for part in set(sheet_parts.values()) - patched.keys()
+            )
+        if has_formulas:
+            workbook = _request_full_calc(zin.read(_WORKBOOK_PART))
+            if workbook is not None:
+                patched[_WORKBOOK_PART] = workbook
+
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, "w") as zout:
+            for info in zin.infolist():
+                data = patched.get(info.filename)
+                zout.writestr(info, zin.read(info) if data is None else data)
+    return output.getvalue()
+
+
+# ================================================================
+# 工作表定位
+# ================================================================
+
+def _sheet_parts(zin: zipfile.ZipFile) -> dict[str, str]:
+    """{工作表名稱: zip 成員路徑}（由 workbook.xml 與其 rels 解析）"""
+    try:
+        workbook = etree.fromstring(zin.read(_WORKBOOK_PART))
+        rels = etree.fromstring(zin.read("xl/_rels/workbook.xml.rels"))
+    except KeyError as e:
+        raise XlsxPatchUnsupported(f"missing workbook part: {e}")
+
+    if workbook.tag != f"{{{_NS}}}workbook":
+        raise XlsxPatchUnsupported(f"unsupported workbook namespace: {workbook.tag}")
+
+    targets = {
+        rel.get("Id"): rel.get("Target")
+        for rel in rels.iterfind(f"{{{_NS_PKG_REL}}}Relationship")
+    }
+    names = zin.namelist()
+    parts: dict[str, str] = {}
+    for sheet in workbook.iterfind(f"{{{_NS}}}sheets/{{{_NS}}}sheet"):
+        target = targets.get(sheet.get(f"{{{_NS_DOC_REL}}}id"))
+        if not target:
+            continue
+        if target.startswith("/"):
+            part = target.lstrip("/")
+        else:
+            part = posixpath.normpath(posixpath.join("xl", target))
+        if part in names:
+            parts[sheet.get("name")] = part
+    return parts
+
+
+def _normalize_coord(cell_coord: str) -> str:
+    try:
+        row, col = coordinate_to_tuple(cell_coord.replace("$", "").upper())
+    except Exception:
+        raise XlsxPatchUnsupported(f"invalid cell coordinate: {cell_coord}")
+    return f"{get_column_letter(col)}{row}"
+
+
+def _check_value(value) -> None:
+    """與 openpyxl 寫入語意一致才走快速路徑"""
+    if value is None or isinstance(value, bool):
+        return
+    if isinstance(value, (int, float)):
+        if isinstance(value, float) and not math.isfinite(value):
+            raise XlsxPatchUnsupported(f"non-finite number: {value}")
+        return
+    if isinstance(value, str):
+        # openpyxl 把 "=" 開頭的字串視為公式，含控制字元則拒絕寫入
+        if value.startswith("=") or ILLEGAL_CHARACTERS_RE.search(value):
+            raise XlsxPatchUnsupported("string needs openpyxl handling")
+        return
+    raise XlsxPatchUnsupported(f"unsupported value type: {type(value).__name__}")
+
+
+# ================================================================
+# 工作表修補
+# ================================================================
+
+def _patch_sheet(xml: bytes, cells: dict[str, Any]) -> tuple[bytes, bool]:
+    """回傳 (修補後的工作表 XML, 是否含公式)"""
+    root = etree.fromstring(xml, _PARSER)
+    sheet_data = root.find(f"{{{_NS}}}sheetData")
+    if sheet_data is None:
+        raise XlsxPatchUnsupported("worksheet without sheetData")
+
+    merge_lookup = merge_lookup_from_refs(
+        mc.get("ref") for mc in root.iterfind(f"{{{_NS}}}mergeCells/{{{_NS}}}mergeCell")
+    )
+
+    rows: dict[int, etree._Element] = {}
+    for row in sheet_data.iterchildren(_ROW):
+        if row.get("r") is None:
+            raise XlsxPatchUnsupported("row without r attribute")
+        rows[int(row.get("r"))] = row
+    row_numbers = sorted(rows)
+
+    for coord, value in cells.items():
+        coord = merged_top_left(merge_lookup, coord) or coord
+        row_idx, col_idx = coordinate_to_tuple(coord)
+
+        row = rows.get(row_idx)
+        if row is None:
+            row = etree.Element(_ROW, r=str(row_idx))
+            position = bisect.bisect_left(row_numbers, row_idx)
+            if position < len(row_numbers):
+                rows[row_numbers[position]].addprevious(row)
+            else:
+                sheet_data.append(row)
+            rows[row_idx] = row
+            row_numbers.insert(position, row_idx)
+
+        _set_cell_value(_find_or_insert_cell(row, coord, col_idx), value)
+
+    # 公式的快取值可能依賴剛寫入的儲存格，清除後由試算表軟體重新計算
+    formula_cells = [formula.getparent() for formula in sheet_data.iter(_FORMULA)]
+    for cell in formula_cells:
+        for cached in cell.findall(_VALUE):
+            cell.remove(cached)
+
+    xml = etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+    return xml, bool(formula_cells)
+
+
+def _request_full_calc(xml: bytes) -> Optional[bytes]:
+    """於 workbook.xml 設定 fullCalcOnLoad；已設定時回傳 None（workbook.xml 不需改寫）"""
+    root = etree.fromstring(xml, _PARSER)
+    calc_pr = root.find(_CALC_PR)
+    if calc_pr is None:
+        calc_pr = etree.Element(_CALC_PR)
+        following = next((child for child in root if child.tag in _AFTER_CALC_PR), None)
+        if following is not None:
+            following.addprevious(calc_pr)
+        else:
+            root.append(calc_pr)
+    elif calc_pr.get("fullCalcOnLoad") in ("1", "true"):
+        return None
+    calc_pr.set("fullCalcOnLoad", "1")
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+
+def _find_or_insert_cell(row, coord: str, col_idx: int):
+    for cell in row.iterchildren(_CELL):
+        ref = cell.get("r")
+        if ref is None:
+            raise XlsxPatchUnsupported("cell without r attribute")
+        if ref == coord:
+            return cell
+        if column_index_from_string(_COLUMN_RE.match(ref).group(1)) > col_idx:
+            new_cell = etree.Element(_CELL, r=coord)
+            cell.addprevious(new_cell)
+            return new_cell
+    return etree.SubElement(row, _CELL, r=coord)
+
+
+def _set_cell_value(cell, value) -> None:
+    """改寫儲存格值，保留 r / s 等屬性"""
+    if cell.find(_FORMULA) is not None:
+        raise XlsxPatchUnsupported(f"formula cell {cell.get('r')}")
+
+    for child in list(cell):
+        if child.tag in (_VALUE, _INLINE):
+            cell.remove(child)
+    cell.attrib.pop("t", None)
+    if value is None:
+        return
+
+    # <c> 子元素順序為 f, v, is, extLst；新值放在最前面
+    if isinstance(value, bool):
+        cell.set("t", "b")
+        v = etree.Element(_VALUE)
+        v.text = "1" if value else "0"
+        cell.insert(0, v)
+    elif isinstance(value, (int, float)):
+        v = etree.Element(_VALUE)
+        v.text = repr(value)
+        cell.insert(0, v)
+    else:
+        cell.set("t", "inlineStr")
+        inline = etree.Element(_INLINE)
+        text = etree.SubElement(inline, _TEXT)
+        text.text = value
+        if value != value.strip() or "\n" in value:
+            text.set(_XML_SPACE, "preserve")
+        cell.insert(0, inline)
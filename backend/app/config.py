@@ -15,6 +15,10 @@ class Settings(BaseSettings):
     
     # 資料庫
     database_url: str = "postgresql+asyncpg://localhost:5432/induspect"
+    db_pool_size: int = 5  # 常駐連線數（每個實例）
+    db_max_overflow: int = 10  # 尖峰時可額外建立的連線數
+    db_pool_timeout: float = 30.0  # 連線都被借出時等待歸還的秒數，逾時回傳錯誤
+    db_pool_recycle: int = 1800  # 連線使用超過此秒數後重建，-1 表示不重建
     
     # AI API Keys
     gemini_api_key: str = ""
@@ -29,14 +33,55 @@ class Settings(BaseSettings):
     embedding_provider: str = "gemini"  # "gemini" or "openai"
     embedding_model: str = "embedding-001"  # "text-embedding-004" may have issues
     embedding_dimension: int = 768  # embedding-001 is also 768
+    embedding_batch_size: int = 100  # 單次批次請求筆數上限（仍受供應商上限約束）
+    embedding_batch_concurrency: int = 4  # 同時送出的批次請求數
+    embedding_timeout_seconds: float = 30.0  # 單次 Embedding 請求逾時
+    embedding_executor_workers: int = 8  # 同步 SDK 呼叫的執行緒池大小
+    embedding_cache_size: int = 4096  # 記憶體 LRU 快取筆數，0 表示停用
+    embedding_cache_path: str = ""  # SQLite 磁碟快取路徑，留空表示僅用記憶體
+    embedding_cache_disk_max_entries: int = 200000  # 磁碟快取筆數上限（淘汰最早寫入者），0 表示不限
     
     # GCP
     gcs_bucket_name: str = "induspect-files"
     gcp_project_id: str = ""
     
+    # 自動回填
+    autofill_template_cache_size: int = 32  # 已解析模板快取項目數，0 表示停用
+    autofill_template_cache_mb: int = 64  # 已解析模板快取大小上限 (MB)
+    autofill_xlsx_fast_path: bool = True  # xlsx 直接修補工作表 XML，無法處理時改用 openpyxl
+    autofill_docx_fast_path: bool = True  # docx 直接修補主文件 XML，無法處理時改用 python-docx
+    
     # RAG 設定
     rag_top_k: int = 5
     rag_similarity_threshold: float = 0.7
+    rag_backend: str = "pgvector"  # "pgvector" or "local"（本機 NumPy 向量索引，免 Postgres）
+    rag_local_index_dir: str = "data/rag_index"  # local 後端的索引目錄
+    rag_bulk_chunk_size: int = 500  # 批次匯入每段筆數（每段一次交易、回報一次進度）
+    rag_search_mode: str = "vector"  # "vector" or "hybrid"（詞彙 BM25 + 向量，RRF 融合；詞彙索引為各 worker 各自維護）
+    rag_lexical_candidates: int = 200  # 詞彙預篩送入向量評分的候選數
+    rag_rrf_k: int = 60  # Reciprocal Rank Fusion 常數
+    rag_dedup_policy: str = "skip"  # 入庫去重："skip" / "replace" / "keep" / "off"
+    rag_dedup_similarity: float = 0.97  # 近重複相似度門檻，>= 1 表示僅比對內容雜湊
+    rag_stats_reconcile_seconds: float = 300.0  # 知識庫統計重新完整計數間隔，0 表示只在要求時
+    rag_query_cache_size: int = 1024  # 查詢結果快取筆數，0 表示停用
+    rag_query_cache_ttl_seconds: float = 300.0  # 查詢結果快取有效秒數
+    rag_import_job_db: str = "data/import_jobs.db"  # 文件匯入工作表 (SQLite)
+    rag_import_concurrency: int = 2  # 同時執行的文件匯入工作數
+    rag_import_max_attempts: int = 3  # 文件匯入失敗（尚未入庫任何知識時）的最多嘗試次數
+    rag_import_retry_backoff_seconds: float = 5.0  # 重試等待秒數（每次加倍）
+    rag_doc_chunk_chars: int = 12000  # 文件分段擷取每段字元上限
+    rag_doc_chunk_overlap_chars: int = 800  # 相鄰分段重疊字元上限
+    rag_doc_extract_concurrency: int = 4  # 同一文件同時送出的分段擷取請求數
+    
+    # 向量索引 (pgvector)
+    rag_index_type: str = "hnsw"  # "hnsw" or "ivfflat"
+    rag_hnsw_m: int = 16
+    rag_hnsw_ef_construction: int = 64
+    rag_hnsw_ef_search: int = 40  # balanced 等級的 ef_search
+    rag_ivfflat_probes: int = 0  # balanced 等級的 probes，0 表示 sqrt(lists)
+    rag_ivfflat_min_rows: int = 1000  # 資料少於此數不建 IVFFlat（改走精確搜尋）
+    rag_embedding_storage: str = "full"  # "full" / "halfvec"（pgvector >= 0.7）/ "int8"（僅本機後端）
+    rag_rerank_factor: int = 4  # 量化儲存時取 top_k 的倍數為候選，以全精度向量重排序
     
     class Config:
         env_file = ".env"
@@ -7,6 +7,7 @@ from app.db.database import (
     engine,
     async_session_maker,
     get_db,
+    session_scope,
     init_db,
     close_db,
 )
@@ -16,6 +17,7 @@ __all__ = [
     "engine", 
     "async_session_maker",
     "get_db",
+    "session_scope",
     "init_db",
     "close_db",
 ]
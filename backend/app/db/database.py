@@ -5,19 +5,27 @@
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 from sqlalchemy import text
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Optional
+import asyncio
 import logging
 
 from app.config import settings
+from app.db.pool import InstrumentedAsyncPool
 
 logger = logging.getLogger(__name__)
 
-# 建立非同步引擎
+# 建立非同步引擎（連線池大小由 settings 設定，取得連線的等待時間見 /health/db）
 engine = create_async_engine(
     settings.database_url,
     echo=settings.debug,
+    poolclass=InstrumentedAsyncPool,
     pool_pre_ping=True,
-    pool_size=5,
-    max_overflow=10,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_recycle=settings.db_pool_recycle,
 )
 
 # Session 工廠
@@ -31,15 +39,53 @@ async_session_maker = async_sessionmaker(
 Base = declarative_base()
 
 
+# 目前請求的共用 Session 與建立它的 task（由 get_db 設定）
+_request_session: ContextVar[Optional[tuple[AsyncSession, asyncio.Task]]] = ContextVar(
+    "request_session", default=None
+)
+
+
 async def get_db() -> AsyncSession:
-    """取得資料庫 Session (FastAPI Dependency)"""
+    """
+    取得資料庫 Session (FastAPI Dependency)
+
+    同一請求內的服務經由 session_scope() 共用此 Session。
+    """
     async with async_session_maker() as session:
+        _request_session.set((session, asyncio.current_task()))
         try:
             yield session
         finally:
+            # 依賴結束時仍在同一 context，直接清除（不用 reset(token)，避免 context 不同時出錯）
+            _request_session.set(None)
             await session.close()
 
 
+@asynccontextmanager
+async def session_scope() -> AsyncIterator[AsyncSession]:
+    """
+    取得一次資料存取操作使用的 Session
+
+    在請求內（get_db）且為同一 task 時共用請求的 Session，操作結束即提交，
+    連線歸還連線池，不在呼叫 AI API 等待期間佔用連線；
+    背景工作、SSE 串流與 asyncio.gather 分出的 task 不共用（AsyncSession 不可並行使用），
+    改為建立獨立的 Session。
+    """
+    shared = _request_session.get()
+    if shared is None or shared[1] is not asyncio.current_task():
+        async with async_session_maker() as session:
+            yield session
+        return
+
+    session = shared[0]
+    try:
+        yield session
+    except BaseException:
+        await session.rollback()
+        raise
+    await session.commit()
+
+
 async def init_db():
     """初始化資料庫 (建立表格和擴充功能)"""
     async with engine.begin() as conn:
@@ -48,6 +94,14 @@ async def init_db():
         
         # 建立所有表格
         await conn.run_sync(Base.metadata.create_all)
+        
+        # 既有資料表升級到目前結構（create_all 不會修改既有表格）
+        from app.db.migrations import upgrade_rag_items
+        await upgrade_rag_items(conn)
+        
+        # 建立向量索引（依設定與資料量，已存在則保留）
+        from app.db.vector_index import ensure_vector_index
+        await ensure_vector_index(conn)
     
     logger.info("Database initialized successfully")
 
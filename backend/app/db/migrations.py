@@ -0,0 +1,118 @@
+"""
+rag_items 結構升級 (PostgreSQL)
+
+create_all 只建立不存在的表格，不會修改既有表格；這裡以冪等的語句把舊版資料表
+升級到目前的 ORM 定義，於 init_db 時執行：
+
+1. content_hash 欄位與索引（入庫去重）
+2. (created_at, id) 複合索引（keyset 分頁）
+3. metadata 由 JSON 轉為 JSONB，建立 GIN (jsonb_path_ops) 索引供 @> 過濾
+4. 常用過濾鍵 vendor / location 提升為獨立欄位（B-tree 索引），並由 metadata 回填
+5. embedding 欄位依 settings.rag_embedding_storage 轉換 vector / halfvec；
+   轉為 halfvec 前把全精度向量複製到 rag_item_embeddings（重排序用），轉回時再寫回
+"""
+
+import logging
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.db.vector_index import INDEX_NAME, pgvector_version
+
+logger = logging.getLogger(__name__)
+
+# 由 metadata 提升為獨立欄位的過濾鍵（值為字串時寫入欄位）
+PROMOTED_METADATA_KEYS = ("vendor", "location")
+
+
+async def _column_type(conn, column: str):
+    return await conn.scalar(text(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = 'rag_items' AND column_name = :column"
+    ), {"column": column})
+
+
+async def upgrade_rag_items(conn) -> None:
+    """將既有 rag_items 升級到目前結構（可重複執行）"""
+    await conn.execute(text(
+        "ALTER TABLE rag_items ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)"
+    ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_rag_items_content_hash ON rag_items (content_hash)"
+    ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_rag_items_created_at_id ON rag_items (created_at, id)"
+    ))
+
+    if await _column_type(conn, "metadata") == "json":
+        logger.info("Converting rag_items.metadata from JSON to JSONB")
+        await conn.execute(text(
+            "ALTER TABLE rag_items ALTER COLUMN metadata TYPE JSONB USING metadata::jsonb"
+        ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_rag_items_metadata "
+        "ON rag_items USING gin (metadata jsonb_path_ops)"
+    ))
+
+    for key in PROMOTED_METADATA_KEYS:
+        if await _column_type(conn, key) is None:
+            await conn.execute(text(f"ALTER TABLE rag_items ADD COLUMN {key} VARCHAR(255)"))
+            result = await conn.execute(text(
+                f"UPDATE rag_items SET {key} = metadata->>'{key}' "
+                f"WHERE jsonb_typeof(metadata->'{key}') = 'string'"
+            ))
+            logger.info(f"Promoted metadata.{key} to a column ({result.rowcount} rows backfilled)")
+        await conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_rag_items_{key} ON rag_items ({key})"
+        ))
+
+    await upgrade_embedding_storage(conn)
+
+
+async def upgrade_embedding_storage(conn) -> None:
+    """依 settings.rag_embedding_storage 轉換 rag_items.embedding 欄位型別"""
+    current = await conn.scalar(text(
+        "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+        "WHERE attrelid = 'rag_items'::regclass AND attname = 'embedding'"
+    ))
+    is_half = current.startswith("halfvec")
+    want_half = settings.rag_embedding_storage == "halfvec"
+    if is_half == want_half:
+        return
+
+    dimension = int(settings.embedding_dimension)
+    if want_half:
+        if await pgvector_version(conn) < (0, 7):
+            raise RuntimeError("halfvec embedding storage requires pgvector >= 0.7")
+        logger.info("Converting rag_items.embedding to halfvec (full precision kept in rag_item_embeddings)")
+        await conn.execute(text(
+            "INSERT INTO rag_item_embeddings (item_id, embedding) "
+            "SELECT id, embedding FROM rag_items ON CONFLICT (item_id) DO NOTHING"
+        ))
+        # 索引的 operator class 隨欄位型別不同，先刪除，由 ensure_vector_index 重建
+        await conn.execute(text(f"DROP INDEX IF EXISTS {INDEX_NAME}"))
+        await conn.execute(text(
+            f"ALTER TABLE rag_items ALTER COLUMN embedding TYPE halfvec({dimension}) "
+            f"USING embedding::halfvec({dimension})"
+        ))
+        return
+
+    logger.info("Converting rag_items.embedding back to full-precision vector")
+    await conn.execute(text(f"DROP INDEX IF EXISTS {INDEX_NAME}"))
+    await conn.execute(text(
+        f"ALTER TABLE rag_items ALTER COLUMN embedding TYPE vector({dimension}) "
+        f"USING embedding::vector({dimension})"
+    ))
+    await conn.execute(text(
+        "UPDATE rag_items SET embedding = e.embedding FROM rag_item_embeddings e "
+        "WHERE e.item_id = rag_items.id"
+    ))
+    await conn.execute(text("DELETE FROM rag_item_embeddings"))
+
+
+def promoted_values(metadata: dict) -> dict:
+    """由 metadata 取出提升欄位的值"""
+    return {
+        key: metadata.get(key) if isinstance(metadata.get(key), str) else None
+        for key in PROMOTED_METADATA_KEYS
+    }
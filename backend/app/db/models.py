@@ -2,8 +2,8 @@
 SQLAlchemy ORM 模型定義
 """
 
-from sqlalchemy import Column, String, Text, DateTime, JSON, Index
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, Text, DateTime, JSON, Index, ForeignKey
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 from pgvector.sqlalchemy import Vector
 from datetime import datetime
 import uuid
@@ -12,32 +12,63 @@ from app.db.database import Base
 from app.config import settings
 
 
+class HalfVector(Vector):
+    """pgvector halfvec 欄位（半精度，pgvector >= 0.7），文字格式與運算子同 vector"""
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return "HALFVEC(%d)" % self.dim
+
+
+def _embedding_type():
+    """ANN 掃描欄位型別，依 settings.rag_embedding_storage（見 app.services.quantization）"""
+    if settings.rag_embedding_storage == "halfvec":
+        return HalfVector(settings.embedding_dimension)
+    return Vector(settings.embedding_dimension)
+
+
 class RAGItem(Base):
     """RAG 知識庫項目"""
     __tablename__ = "rag_items"
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     content = Column(Text, nullable=False)
+    content_hash = Column(String(64), nullable=True, index=True)  # 正規化內容 SHA-256（入庫去重）
     equipment_type = Column(String(255), nullable=False, index=True)
     source_type = Column(String(50), nullable=False, index=True)  # inspection/history/document
     source_id = Column(String(255), nullable=True)
-    embedding = Column(Vector(settings.embedding_dimension), nullable=False)
-    item_metadata = Column("metadata", JSON, nullable=True)
+    embedding = Column(_embedding_type(), nullable=False)
+    item_metadata = Column("metadata", JSONB, nullable=True)
+    # 常用過濾鍵由 metadata 提升為獨立欄位（見 app.db.migrations.PROMOTED_METADATA_KEYS）
+    vendor = Column(String(255), nullable=True, index=True)
+    location = Column(String(255), nullable=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     created_by = Column(String(255), nullable=True)
     
-    # 向量索引 (IVFFlat for approximate nearest neighbor search)
+    # 向量索引 (HNSW / IVFFlat) 不由 create_all 建立，
+    # 由 app.db.vector_index 依資料量建立與重建
+    
     __table_args__ = (
+        # 列表 keyset 分頁 (created_at, id) 由新到舊
+        Index("ix_rag_items_created_at_id", "created_at", "id"),
+        # metadata @> 過濾
         Index(
-            'ix_rag_items_embedding',
-            embedding,
-            postgresql_using='ivfflat',
-            postgresql_with={'lists': 100},
-            postgresql_ops={'embedding': 'vector_cosine_ops'}
+            "ix_rag_items_metadata", "metadata",
+            postgresql_using="gin", postgresql_ops={"metadata": "jsonb_path_ops"},
         ),
     )
 
 
+class RAGItemEmbedding(Base):
+    """rag_items 的全精度向量（量化儲存時供候選重排序，刪除項目時連帶刪除）"""
+    __tablename__ = "rag_item_embeddings"
+
+    item_id = Column(
+        UUID(as_uuid=True), ForeignKey("rag_items.id", ondelete="CASCADE"), primary_key=True,
+    )
+    embedding = Column(Vector(settings.embedding_dimension), nullable=False)
+
+
 class Template(Base):
     """廠商報告模板"""
     __tablename__ = "templates"
@@ -0,0 +1,117 @@
+"""
+資料庫連線池 - 取得連線等待時間的量測
+
+AsyncAdaptedQueuePool 的子類別，於每次向連線池取得連線時計時：
+- 連線池有閒置連線時等待時間接近 0
+- 連線都被借出且 overflow 已滿時，等待其他請求歸還（最多 settings.db_pool_timeout 秒，
+  逾時拋出 sqlalchemy.exc.TimeoutError 並計入 timeouts）
+
+量測結果與連線池目前使用量由 /health/db 回報，作為調整 db_pool_size / db_max_overflow 的依據。
+"""
+
+import threading
+import time
+from collections import deque
+
+from greenlet import getcurrent
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# 計算百分位數時保留的最近取得連線等待時間筆數
+_RECENT_WAITS = 1000
+
+
+class PoolMetrics:
+    """取得連線的次數、等待時間與逾時次數"""
+
+    def __init__(self, recent: int = _RECENT_WAITS):
+        self._lock = threading.Lock()
+        self._recent: deque = deque(maxlen=recent)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+            self._recent.append(seconds)
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        """累計統計與最近等待時間的百分位數（毫秒）"""
+        with self._lock:
+            recent = sorted(self._recent)
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_ms_avg": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "wait_ms_max": round(self.max_wait * 1000, 3),
+                "wait_ms_p50": _percentile_ms(recent, 0.50),
+                "wait_ms_p95": _percentile_ms(recent, 0.95),
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._recent.clear()
+            self.checkouts = 0
+            self.timeouts = 0
+            self.total_wait = 0.0
+            self.max_wait = 0.0
+
+
+def _percentile_ms(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 3)
+
+
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    """記錄取得連線等待時間的非同步連線池"""
+
+    # 由 create_async_engine 建立連線池，量測結果放在類別屬性，整個程序共用一份
+    metrics = PoolMetrics()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 正在取得連線的 greenlet；QueuePool._do_get 重試時會遞迴呼叫，只計最外層一次
+        self._waiting: set = set()
+
+    def _do_get(self):
+        current = getcurrent()
+        if current in self._waiting:
+            return super()._do_get()
+
+        self._waiting.add(current)
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record_timeout()
+            raise
+        finally:
+            self._waiting.discard(current)
+        self.metrics.record_wait(time.perf_counter() - start)
+        return connection
+
+
+def pool_status(pool) -> dict:
+    """連線池目前使用量與取得連線的等待時間統計"""
+    status = {"pool_class": type(pool).__name__}
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "max_overflow": pool._max_overflow,
+            "timeout": pool.timeout(),
+        })
+    if isinstance(pool, InstrumentedAsyncPool):
+        status["wait"] = pool.metrics.snapshot()
+    return status
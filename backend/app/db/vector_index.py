@@ -0,0 +1,241 @@
+"""
+rag_items 向量索引管理 (pgvector)
+
+- 支援 HNSW 與 IVFFlat 兩種索引，由 settings.rag_index_type 選擇
+- IVFFlat 的 lists 依資料量計算（pgvector 建議：100 萬筆以下 rows/1000，以上 sqrt(rows)），
+  資料太少時不建 IVFFlat（空表建出的 centroids 沒有意義，改走精確搜尋）
+- 查詢時依速度/召回率等級設定 ivfflat.probes / hnsw.ef_search（SET LOCAL，僅影響當次交易）
+- 大量匯入後可透過管理端點重建索引：以 CREATE INDEX CONCURRENTLY 於暫存名稱建立新索引，
+  完成後移除舊索引並改名，重建期間不阻擋查詢與寫入；完成後以 NOTIFY 通知所有 worker 更新索引狀態
+- 量化儲存（settings.rag_embedding_storage = halfvec）時索引建立在 halfvec 欄位
+  (halfvec_cosine_ops)，查詢取 top_k * rag_rerank_factor 個候選供全精度重排序
+- 帶 metadata 過濾的查詢：pgvector >= 0.8 啟用 iterative index scan（索引掃描持續到湊滿 top_k
+  個符合過濾條件的結果）；舊版則放大 ef_search / probes 以降低過濾後結果不足的機率
+"""
+
+import json
+import logging
+import math
+from typing import Optional
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.db.database import engine
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "ix_rag_items_embedding"
+# 重建時新索引的暫存名稱（建好後改名為 INDEX_NAME）
+REBUILD_INDEX_NAME = "ix_rag_items_embedding_rebuild"
+# 索引重建通知頻道（payload 為新的索引狀態 JSON）
+INDEX_CHANNEL = "rag_vector_index"
+INDEX_TYPES = ("hnsw", "ivfflat")
+
+# 速度/召回率等級 → 搜尋參數倍率
+RECALL_LEVELS = {
+    "fast": 0.5,
+    "balanced": 1.0,
+    "accurate": 4.0,
+}
+
+# 舊版 pgvector（無 iterative scan）過濾查詢的 ef_search / probes 倍率
+FILTERED_SEARCH_FACTOR = 4
+
+# 目前索引狀態（啟動、重建與收到重建通知時更新），供計算 probes 使用
+_index_state: dict = {"type": None, "lists": None, "iterative_scan": False}
+
+# 監聽重建通知的專用連線（start_index_listener 建立）
+_listener_conn = None
+
+
+def ivfflat_lists_for(row_count: int) -> int:
+    """依資料量計算 IVFFlat lists 數"""
+    if row_count <= 1_000_000:
+        return max(1, row_count // 1000)
+    return int(math.sqrt(row_count))
+
+
+def _ops_class() -> str:
+    return "halfvec_cosine_ops" if settings.rag_embedding_storage == "halfvec" else "vector_cosine_ops"
+
+
+def _build_index_sql(
+    index_type: str,
+    row_count: int,
+    name: str = INDEX_NAME,
+    concurrently: bool = False,
+) -> str:
+    create = f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {name} ON rag_items"
+    if index_type == "hnsw":
+        return (
+            f"{create} "
+            f"USING hnsw (embedding {_ops_class()}) "
+            f"WITH (m = {int(settings.rag_hnsw_m)}, "
+            f"ef_construction = {int(settings.rag_hnsw_ef_construction)})"
+        )
+    if index_type == "ivfflat":
+        return (
+            f"{create} "
+            f"USING ivfflat (embedding {_ops_class()}) "
+            f"WITH (lists = {ivfflat_lists_for(row_count)})"
+        )
+    raise ValueError(f"Unknown vector index type: {index_type}")
+
+
+async def _read_index_state(conn) -> dict:
+    """從 pg_indexes 讀取目前索引類型與 lists"""
+    row = (await conn.execute(
+        text("SELECT indexdef FROM pg_indexes WHERE tablename = 'rag_items' AND indexname = :name"),
+        {"name": INDEX_NAME},
+    )).first()
+
+    state = {"type": None, "lists": None}
+    state["iterative_scan"] = await pgvector_version(conn) >= (0, 8)
+    if row:
+        indexdef = row[0].lower()
+        if "using hnsw" in indexdef:
+            state["type"] = "hnsw"
+        elif "using ivfflat" in indexdef:
+            state["type"] = "ivfflat"
+            if "lists='" in indexdef:
+                state["lists"] = int(indexdef.split("lists='")[1].split("'")[0])
+    _index_state.update(state)
+    return state
+
+
+async def ensure_vector_index(conn) -> dict:
+    """啟動時確保索引存在（已存在則保留原設定）"""
+    state = await _read_index_state(conn)
+    if state["type"]:
+        return state
+
+    index_type = settings.rag_index_type
+    row_count = await conn.scalar(text("SELECT count(*) FROM rag_items"))
+    if index_type == "ivfflat" and row_count < settings.rag_ivfflat_min_rows:
+        logger.info(
+            f"rag_items has {row_count} rows (< {settings.rag_ivfflat_min_rows}), "
+            f"skip IVFFlat index until rebuild"
+        )
+        return state
+
+    await conn.execute(text(_build_index_sql(index_type, row_count)))
+    logger.info(f"Created {index_type} vector index on rag_items ({row_count} rows)")
+    return await _read_index_state(conn)
+
+
+async def rebuild_vector_index(index_type: Optional[str] = None) -> dict:
+    """
+    重建向量索引（大量匯入後使用）
+
+    CONCURRENTLY 不可在交易中執行，使用 autocommit 連線；新索引建好前查詢仍使用舊索引，
+    移除舊索引後立即改名，期間不會沒有索引可用。
+    """
+    index_type = index_type or settings.rag_index_type
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type: {index_type}")
+
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        row_count = await conn.scalar(text("SELECT count(*) FROM rag_items"))
+        # 上次重建中斷時留下的暫存索引（可能為 INVALID）
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {REBUILD_INDEX_NAME}"))
+        await conn.execute(text(
+            _build_index_sql(index_type, row_count, name=REBUILD_INDEX_NAME, concurrently=True)
+        ))
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}"))
+        await conn.execute(text(f"ALTER INDEX {REBUILD_INDEX_NAME} RENAME TO {INDEX_NAME}"))
+        await conn.execute(text("ANALYZE rag_items"))
+        state = await _read_index_state(conn)
+        await conn.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": INDEX_CHANNEL, "payload": json.dumps(state)},
+        )
+
+    logger.info(f"Rebuilt vector index: {state} ({row_count} rows)")
+    return {"index_type": state["type"], "lists": state["lists"], "rows": row_count}
+
+
+def _on_index_changed(connection, pid, channel, payload) -> None:
+    """收到重建通知（含本程序送出者）時更新索引狀態"""
+    try:
+        _index_state.update(json.loads(payload))
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Ignore invalid vector index notification: {e}")
+        return
+    logger.info(f"Vector index state updated by notification: {_index_state}")
+
+
+async def start_index_listener() -> None:
+    """以專用連線 LISTEN 索引重建通知，讓每個 worker 的索引狀態與資料庫一致"""
+    global _listener_conn
+    if _listener_conn is not None:
+        return
+    conn = await engine.connect()
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.add_listener(INDEX_CHANNEL, _on_index_changed)
+    _listener_conn = conn
+
+
+async def stop_index_listener() -> None:
+    global _listener_conn
+    if _listener_conn is None:
+        return
+    conn, _listener_conn = _listener_conn, None
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.remove_listener(INDEX_CHANNEL, _on_index_changed)
+    await conn.close()
+
+
+async def pgvector_version(conn) -> tuple:
+    """已安裝的 pgvector 擴充功能版本，例如 (0, 8, 0)"""
+    version = await conn.scalar(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'"))
+    return _version_tuple(version)
+
+
+def _version_tuple(version: Optional[str]) -> tuple:
+    if not version:
+        return ()
+    return tuple(int(part) for part in version.split(".") if part.isdigit())
+
+
+def search_settings(
+    top_k: int,
+    recall: Optional[str] = None,
+    filtered: bool = False,
+) -> list[str]:
+    """
+    產生當次查詢的 SET LOCAL 語句（依索引類型與速度/召回率等級）
+
+    :param filtered: 查詢帶有過濾條件（ANN 候選可能被過濾掉，需持續掃描或放大候選數）
+    """
+    factor = RECALL_LEVELS.get(recall or "balanced")
+    if factor is None:
+        raise ValueError(f"Unknown recall level: {recall}")
+
+    statements = []
+    index_type = _index_state["type"]
+    iterative = filtered and _index_state.get("iterative_scan", False)
+    if filtered and not iterative:
+        factor *= FILTERED_SEARCH_FACTOR
+
+    # 尚未建立索引時為精確搜尋，不需調整參數
+    if index_type == "hnsw":
+        ef_search = int(settings.rag_hnsw_ef_search * factor)
+        # ef_search 必須不小於 top_k 才能回傳足夠結果
+        ef_search = min(max(ef_search, top_k, 1), 1000)
+        statements.append(f"SET LOCAL hnsw.ef_search = {ef_search}")
+        if iterative:
+            statements.append("SET LOCAL hnsw.iterative_scan = relaxed_order")
+
+    if index_type == "ivfflat":
+        lists = _index_state["lists"]
+        base = settings.rag_ivfflat_probes or (int(math.sqrt(lists)) if lists else 10)
+        probes = max(1, int(base * factor))
+        if lists:
+            probes = min(probes, lists)
+        statements.append(f"SET LOCAL ivfflat.probes = {probes}")
+        if iterative:
+            statements.append("SET LOCAL ivfflat.iterative_scan = relaxed_order")
+
+    return statements
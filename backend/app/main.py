@@ -9,14 +9,30 @@ from app.config import settings
 from app.api import rag, templates, reports, auto_fill
 
 from contextlib import asynccontextmanager
-from app.db.database import init_db, close_db
+from app.db.database import init_db, close_db, engine
+from app.db.pool import pool_status
+from app.db.vector_index import start_index_listener, stop_index_listener
+from app.services.clients import init_provider_clients, close_provider_clients
+from app.services.import_jobs import get_import_queue, close_import_queue
+from app.services.rag import get_rag_service
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    await init_db()
+    if settings.rag_backend == "pgvector":
+        await init_db()
+        # 其他 worker 重建向量索引時更新本程序的索引狀態
+        await start_index_listener()
+    # 建立全程序共用的 AI 客戶端與服務（保持連線池）
+    await init_provider_clients()
+    get_rag_service()
+    # 續跑上次未完成的文件匯入工作
+    get_import_queue().resume()
     yield
     # Shutdown
+    await close_import_queue()
+    await close_provider_clients()
+    await stop_index_listener()
     await close_db()
 
 app = FastAPI(
@@ -59,3 +75,12 @@ async def root():
 async def health_check():
     """GCP Cloud Run 健康檢查"""
     return {"status": "ok"}
+
+
+@app.get("/health/db")
+async def health_db():
+    """資料庫連線池使用量與取得連線的等待時間（調整 DB_POOL_SIZE / DB_MAX_OVERFLOW 用）"""
+    return {
+        "backend": settings.rag_backend,
+        "pool": pool_status(engine.pool),
+    }
@@ -9,24 +9,43 @@
 
 import io
 import logging
+from typing import Optional
 
 import google.generativeai as genai
 from openpyxl import load_workbook
 from docx import Document
 
 from app.config import settings
-from app.autofill_core import ExcelAutoFillEngine, WordAutoFillEngine
+from app.autofill_core import ExcelAutoFillEngine, TemplateCache, WordAutoFillEngine
 
 logger = logging.getLogger(__name__)
 
+_template_cache: Optional[TemplateCache] = None
+
+
+def get_template_cache() -> TemplateCache:
+    """取得全程序共用的已解析模板快取（FormFillService 每個請求各自建立，快取需跨請求保留）"""
+    global _template_cache
+    if _template_cache is None:
+        _template_cache = TemplateCache(
+            max_entries=settings.autofill_template_cache_size,
+            max_bytes=settings.autofill_template_cache_mb * 1024 * 1024,
+        )
+    return _template_cache
+
 
 class AutoFillService:
     """自動回填服務 — 薄層包裝，將執行委派給 autofill_core。"""
 
     def __init__(self):
         genai.configure(api_key=settings.gemini_api_key)
-        self._excel_engine = ExcelAutoFillEngine()
-        self._word_engine = WordAutoFillEngine()
+        template_cache = get_template_cache()
+        self._excel_engine = ExcelAutoFillEngine(
+            template_cache, xml_patch=settings.autofill_xlsx_fast_path
+        )
+        self._word_engine = WordAutoFillEngine(
+            template_cache, xml_patch=settings.autofill_docx_fast_path
+        )
 
     # ================================================================
     # 自動回填引擎
@@ -0,0 +1,110 @@
+"""
+AI 供應商客戶端 - 全程序共用
+
+於 FastAPI lifespan 啟動時建立一次，之後所有請求共用，
+保持 HTTP 連線池，避免每個請求重新建立客戶端與 TLS 連線。
+"""
+
+import logging
+from typing import Any, Optional
+
+import google.generativeai as genai
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 尚未嘗試建立新版 google-genai 客戶端的標記
+_UNSET = object()
+
+
+class ProviderClients:
+    """Gemini / OpenAI 客戶端容器（延遲建立，建立後重複使用）"""
+
+    def __init__(self):
+        self._genai_client: Any = _UNSET
+        self._openai_client = None
+        self._generative_models: dict[str, genai.GenerativeModel] = {}
+        self._legacy_configured = False
+
+    def configure_legacy_genai(self) -> None:
+        """設定舊版 google-generativeai SDK（僅需一次）"""
+        if not self._legacy_configured:
+            genai.configure(api_key=settings.gemini_api_key)
+            self._legacy_configured = True
+
+    def gemini_client(self) -> Optional[Any]:
+        """新版 google-genai 客戶端；未安裝時回傳 None 並改用舊版 SDK"""
+        if self._genai_client is _UNSET:
+            try:
+                from google import genai as genai_new
+                self._genai_client = genai_new.Client(api_key=settings.gemini_api_key)
+                logger.info("Gemini client initialized")
+            except ImportError:
+                logger.warning("google-genai not installed, falling back to google-generativeai")
+                self.configure_legacy_genai()
+                self._genai_client = None
+        return self._genai_client
+
+    def openai_client(self):
+        """OpenAI 非同步客戶端"""
+        if self._openai_client is None:
+            import openai
+            self._openai_client = openai.AsyncOpenAI(
+                api_key=settings.openai_api_key,
+                timeout=settings.embedding_timeout_seconds,
+            )
+        return self._openai_client
+
+    def generative_model(self, model_name: str) -> genai.GenerativeModel:
+        """取得（並快取）指定名稱的 Gemini 生成模型"""
+        model = self._generative_models.get(model_name)
+        if model is None:
+            self.configure_legacy_genai()
+            model = genai.GenerativeModel(model_name)
+            self._generative_models[model_name] = model
+        return model
+
+    async def aclose(self) -> None:
+        """關閉持有連線池的客戶端"""
+        if self._openai_client is not None:
+            await self._openai_client.close()
+            self._openai_client = None
+
+        client = self._genai_client
+        if client not in (_UNSET, None):
+            aio = getattr(client, "aio", None)
+            if aio is not None and hasattr(aio, "aclose"):
+                await aio.aclose()
+            if hasattr(client, "close"):
+                client.close()
+        self._genai_client = _UNSET
+        self._generative_models.clear()
+
+
+_provider_clients: Optional[ProviderClients] = None
+
+
+def get_provider_clients() -> ProviderClients:
+    """取得全程序共用的供應商客戶端"""
+    global _provider_clients
+    if _provider_clients is None:
+        _provider_clients = ProviderClients()
+    return _provider_clients
+
+
+async def init_provider_clients() -> ProviderClients:
+    """於應用程式啟動時預先建立客戶端"""
+    clients = get_provider_clients()
+    if settings.embedding_provider == "openai":
+        clients.openai_client()
+    else:
+        clients.gemini_client()
+    clients.generative_model(settings.gemini_flash_model)
+    return clients
+
+
+async def close_provider_clients() -> None:
+    """於應用程式關閉時釋放客戶端連線（之後再使用會重新建立）"""
+    if _provider_clients is not None:
+        await _provider_clients.aclose()
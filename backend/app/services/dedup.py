@@ -0,0 +1,23 @@
+"""
+RAG 入庫去重 - 內容雜湊與近重複判定
+
+- 完全重複：正規化內容（NFKC、合併空白、小寫）的 SHA-256，存於 rag_items.content_hash
+- 近重複：與知識庫中最接近項目的餘弦相似度 >= settings.rag_dedup_similarity
+
+重複項目的處理方式由 settings.rag_dedup_policy 決定：
+- skip：不寫入，回傳既有項目 id（預設）
+- replace：寫入新項目並刪除既有項目（新內容 / metadata 取代舊版）
+- keep：照常寫入，於 metadata.duplicate_of 記錄既有項目 id
+- off：不檢查
+"""
+
+import hashlib
+
+from app.services.query_cache import normalize_text
+
+DEDUP_POLICIES = ("skip", "replace", "keep", "off")
+
+
+def content_hash(content: str) -> str:
+    """正規化內容的 SHA-256"""
+    return hashlib.sha256(normalize_text(content).encode("utf-8")).hexdigest()
@@ -0,0 +1,103 @@
+"""
+文件分段 - 大型維修手冊的本機文字擷取與分段
+
+- PDF：PyPDF2 逐頁擷取文字
+- DOCX：python-docx 依段落與表格擷取，標題段落另起一段
+- 分段：依 settings.rag_doc_chunk_chars 合併頁 / 段落，相鄰分段重疊最多
+  settings.rag_doc_chunk_overlap_chars 字元，避免跨段落的知識被切斷
+
+無法擷取文字（掃描版 PDF、其他格式）時回傳空列表，由呼叫端改用 Gemini File API 整份分析。
+"""
+
+import logging
+import os
+import re
+from typing import Optional
+
+from app.services.query_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[\s\W_]+")
+
+
+def extract_units(file_path: str) -> list[str]:
+    """擷取文件的文字單位（PDF 每頁、DOCX 每個段落 / 表格列）"""
+    ext = os.path.splitext(file_path)[1].lower()
+    try:
+        if ext == ".pdf":
+            return _extract_pdf(file_path)
+        if ext == ".docx":
+            return _extract_docx(file_path)
+    except Exception as e:
+        logger.warning(f"Text extraction failed for {file_path}: {e}")
+    return []
+
+
+def _extract_pdf(file_path: str) -> list[str]:
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(file_path)
+    pages = [(page.extract_text() or "").strip() for page in reader.pages]
+    return [page for page in pages if page]
+
+
+def _extract_docx(file_path: str) -> list[str]:
+    from docx import Document
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+
+    doc = Document(file_path)
+    units: list[str] = []
+    # 依文件順序走訪段落與表格，保留表格與其說明文字的相鄰關係
+    for element in doc.element.body.iterchildren():
+        tag = element.tag.rsplit("}", 1)[-1]
+        if tag == "p":
+            paragraph = Paragraph(element, doc)
+            text = paragraph.text.strip()
+            if not text:
+                continue
+            # 標題以前導換行標記，分段時作為優先切點
+            if paragraph.style is not None and paragraph.style.name.startswith("Heading"):
+                text = f"\n{text}"
+            units.append(text)
+        elif tag == "tbl":
+            for row in Table(element, doc).rows:
+                line = " | ".join(cell.text.strip() for cell in row.cells if cell.text.strip())
+                if line:
+                    units.append(line)
+    return units
+
+
+def chunk_units(units: list[str], max_chars: int, overlap_chars: int = 0) -> list[str]:
+    """
+    將文字單位合併為不超過 max_chars 的分段
+
+    分段滿時，若前一段結尾的單位不超過 overlap_chars，會重複放入下一段開頭；
+    單一單位超過 max_chars 時依長度硬切。標題單位（前導換行）在目前分段過半時另起新段。
+    """
+    max_chars = max(1, max_chars)
+    chunks: list[str] = []
+    current: list[str] = []
+    size = 0
+
+    for unit in units:
+        for start in range(0, len(unit), max_chars):
+            piece = unit[start:start + max_chars]
+            is_heading = piece.startswith("\n")
+            if current and (size + len(piece) > max_chars or (is_heading and size > max_chars // 2)):
+                chunks.append("\n".join(current).strip())
+                tail = current[-1]
+                current = [tail] if len(tail) <= overlap_chars and len(tail) + len(piece) <= max_chars else []
+                size = len(tail) if current else 0
+            current.append(piece)
+            size += len(piece)
+
+    if current:
+        chunks.append("\n".join(current).strip())
+    return chunks
+
+
+def dedup_key(equipment_type: Optional[str], content: str) -> str:
+    """去除空白與標點後的正規化內容，用於合併重疊分段擷取出的重複知識"""
+    return _NON_WORD.sub("", normalize_text(f"{equipment_type or ''}{content}"))
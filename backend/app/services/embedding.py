@@ -6,11 +6,16 @@ Embedding 服務 - 文字向量化
 解決方案：在中文內容前加入英文關鍵字來幫助模型正確理解。
 """
 
+import asyncio
+import functools
 import logging
 import re
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 from app.config import settings
+from app.services.clients import ProviderClients, get_provider_clients
+from app.services.embedding_cache import EmbeddingCache, get_embedding_cache
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +48,50 @@ EQUIPMENT_TRANSLATIONS = {
 }
 
 
+# 各供應商單次批次請求的上限（筆數 / 總字元數）
+# Gemini batchEmbedContents 每次最多 100 筆；OpenAI 每次最多 2048 筆且總 token 約 30 萬
+PROVIDER_BATCH_LIMITS = {
+    "gemini": {"max_items": 100, "max_chars": 200_000},
+    "openai": {"max_items": 2048, "max_chars": 250_000},
+}
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """同步 SDK 呼叫共用的執行緒池（大小由 settings.embedding_executor_workers 控制）"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=max(1, settings.embedding_executor_workers),
+            thread_name_prefix="embedding",
+        )
+    return _executor
+
+
+def _chunk_texts(texts: list[str], max_items: int, max_chars: int) -> list[tuple[int, int]]:
+    """
+    將文字列表依筆數與總字元數切成連續區段。
+
+    Returns:
+        [(start, end), ...] 切片索引，依原始順序排列
+    """
+    chunks = []
+    start = 0
+    chars = 0
+    for i, text in enumerate(texts):
+        size = len(text)
+        if i > start and (i - start >= max_items or chars + size > max_chars):
+            chunks.append((start, i))
+            start = i
+            chars = 0
+        chars += size
+    if start < len(texts):
+        chunks.append((start, len(texts)))
+    return chunks
+
+
 def _add_english_keywords(chinese_text: str) -> str:
     """
     為中文文字添加英文關鍵字前綴。
@@ -65,22 +114,17 @@ def _add_english_keywords(chinese_text: str) -> str:
 class EmbeddingService:
     """Embedding 服務，將文字轉換為向量"""
     
-    def __init__(self, provider: Optional[str] = None):
+    def __init__(
+        self,
+        provider: Optional[str] = None,
+        cache: Optional[EmbeddingCache] = None,
+        clients: Optional[ProviderClients] = None,
+    ):
         self.provider = provider or settings.embedding_provider
         self.model = settings.embedding_model
         self.dimension = settings.embedding_dimension
-        
-        # 初始化 Gemini 客戶端 (使用新版 SDK)
-        if self.provider == "gemini":
-            try:
-                from google import genai
-                self._genai_client = genai.Client(api_key=settings.gemini_api_key)
-                logger.info(f"Gemini client initialized with model: {self.model}")
-            except ImportError:
-                logger.warning("google-genai not installed, falling back to google-generativeai")
-                import google.generativeai as genai_old
-                genai_old.configure(api_key=settings.gemini_api_key)
-                self._genai_client = None
+        self._cache = cache if cache is not None else get_embedding_cache()
+        self._clients = clients or get_provider_clients()
     
     async def embed_text(self, text: str) -> list[float]:
         """
@@ -92,64 +136,196 @@ class EmbeddingService:
         Returns:
             向量 (list of floats)
         """
+        key = self._cache_key(text)
+        cached = (await self._cache_get_many([key])).get(key)
+        if cached is not None:
+            return cached
+
         if self.provider == "gemini":
-            return await self._embed_with_gemini(text)
+            embedding = await self._embed_with_gemini(text)
         elif self.provider == "openai":
-            return await self._embed_with_openai(text)
+            embedding = await self._embed_with_openai(text)
         else:
             raise ValueError(f"Unknown embedding provider: {self.provider}")
+
+        await self._cache_put([(key, embedding)])
+        return embedding
+
+    def _cache_key(self, text: str) -> str:
+        """以實際送往供應商的文字（Gemini 含英文關鍵字前綴）產生快取鍵"""
+        prepared = _add_english_keywords(text) if self.provider == "gemini" else text
+        return EmbeddingCache.make_key(self.provider, self.model, self.dimension, prepared)
+
+    async def _cache_get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        """批次查詢快取；SQLite 磁碟層為同步 I/O，於執行緒中以單一查詢讀取"""
+        if self._cache is None or not keys:
+            return {}
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._cache.get_many, keys)
+
+    async def _cache_put(self, items: list[tuple[str, list[float]]]) -> None:
+        """寫入快取；SQLite 磁碟層為同步 I/O，整批於執行緒中以單一交易寫入"""
+        if self._cache is None or not items:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._cache.put_many, items)
+
+    def cache_stats(self) -> Optional[dict]:
+        """Embedding 快取命中統計；未啟用快取時回傳 None"""
+        return self._cache.stats() if self._cache is not None else None
     
-    async def embed_batch(self, texts: list[str]) -> list[list[float]]:
-        """批次向量化多個文字"""
-        embeddings = []
-        for text in texts:
-            emb = await self.embed_text(text)
-            embeddings.append(emb)
+    async def embed_batch(
+        self,
+        texts: list[str],
+        batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+    ) -> list[list[float]]:
+        """
+        批次向量化多個文字
+
+        依供應商上限切成多個批次請求，並以有限並行數同時送出。
+
+        Args:
+            texts: 要向量化的文字列表
+            batch_size: 單次請求筆數上限（預設 settings.embedding_batch_size）
+            concurrency: 同時進行的請求數（預設 settings.embedding_batch_concurrency）
+
+        Returns:
+            向量列表，順序與輸入一致
+        """
+        if not texts:
+            return []
+
+        limits = PROVIDER_BATCH_LIMITS.get(self.provider)
+        if limits is None:
+            raise ValueError(f"Unknown embedding provider: {self.provider}")
+
+        # 先查快取，只送出未命中的文字（同批次重複文字只送一次）
+        keys = [self._cache_key(t) for t in texts]
+        found = await self._cache_get_many(keys)
+        pending: dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in pending:
+                pending[key] = text
+
+        if pending:
+            pending_keys = list(pending)
+            vectors = await self._embed_uncached(
+                [pending[k] for k in pending_keys], limits, batch_size, concurrency
+            )
+            found.update(zip(pending_keys, vectors))
+            await self._cache_put(list(zip(pending_keys, vectors)))
+
+        return [list(found[key]) for key in keys]
+
+    async def _embed_uncached(
+        self,
+        texts: list[str],
+        limits: dict,
+        batch_size: Optional[int],
+        concurrency: Optional[int],
+    ) -> list[list[float]]:
+        """將未命中快取的文字切批並行送出"""
+        max_items = max(1, min(batch_size or settings.embedding_batch_size, limits["max_items"]))
+        chunks = _chunk_texts(texts, max_items, limits["max_chars"])
+        semaphore = asyncio.Semaphore(max(1, concurrency or settings.embedding_batch_concurrency))
+
+        async def run_chunk(start: int, end: int) -> list[list[float]]:
+            async with semaphore:
+                return await self._embed_chunk(texts[start:end])
+
+        logger.info(f"Embedding {len(texts)} texts in {len(chunks)} batch request(s)")
+        results = await asyncio.gather(*(run_chunk(start, end) for start, end in chunks))
+
+        embeddings = [emb for chunk in results for emb in chunk]
+        if len(embeddings) != len(texts):
+            raise ValueError(
+                f"Embedding count mismatch: expected {len(texts)}, got {len(embeddings)}"
+            )
         return embeddings
-    
-    async def _embed_with_gemini(self, text: str) -> list[float]:
-        """使用 Google Gemini Embedding API (新版 SDK)"""
+
+    async def _embed_chunk(self, texts: list[str]) -> list[list[float]]:
+        """送出單一批次請求"""
+        if self.provider == "gemini":
+            return await self._embed_batch_with_gemini(texts)
+        elif self.provider == "openai":
+            return await self._embed_batch_with_openai(texts)
+        else:
+            raise ValueError(f"Unknown embedding provider: {self.provider}")
+
+    async def _with_timeout(self, awaitable):
+        """為單次供應商請求加上逾時限制"""
+        try:
+            return await asyncio.wait_for(awaitable, timeout=settings.embedding_timeout_seconds)
+        except asyncio.TimeoutError:
+            raise TimeoutError(
+                f"Embedding request timed out after {settings.embedding_timeout_seconds}s"
+            )
+
+    async def _run_blocking(self, func, *args, **kwargs):
+        """在有限大小的執行緒池中執行同步 SDK 呼叫，避免阻塞 event loop"""
+        loop = asyncio.get_running_loop()
+        return await self._with_timeout(
+            loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+        )
+
+    async def _embed_batch_with_gemini(self, texts: list[str]) -> list[list[float]]:
+        """使用 Gemini 一次向量化多筆文字"""
         try:
             # 為中文內容添加英文關鍵字以解決 Embedding 問題
-            enhanced_text = _add_english_keywords(text)
-            logger.debug(f"Enhanced text for embedding: {enhanced_text[:100]}...")
-            
-            if self._genai_client:
-                # 使用新版 google-genai SDK
-                result = self._genai_client.models.embed_content(
-                    model=self.model,
-                    contents=enhanced_text,
+            enhanced_texts = [_add_english_keywords(t) for t in texts]
+
+            # 每次呼叫時向共用客戶端取得（關閉後會重新建立，不可於建構時保存）
+            genai_client = self._clients.gemini_client()
+            if genai_client:
+                # 新版 google-genai SDK 提供原生 async 介面
+                result = await self._with_timeout(
+                    genai_client.aio.models.embed_content(
+                        model=self.model,
+                        contents=enhanced_texts,
+                    )
                 )
-                return list(result.embeddings[0].values)
+                return [list(e.values) for e in result.embeddings]
             else:
-                # 回退到舊版 SDK
+                # 回退到舊版 SDK（僅有同步介面，交由執行緒池執行）
                 import google.generativeai as genai_old
-                result = genai_old.embed_content(
+                result = await self._run_blocking(
+                    genai_old.embed_content,
                     model=f"models/{self.model}",
-                    content=enhanced_text,
-                    task_type="retrieval_document"
+                    content=enhanced_texts,
+                    task_type="retrieval_document",
                 )
                 return result['embedding']
-                
+
         except Exception as e:
-            logger.error(f"Gemini embedding failed: {e}")
+            logger.error(f"Gemini batch embedding failed ({len(texts)} texts): {e}")
             raise
-    
-    async def _embed_with_openai(self, text: str) -> list[float]:
-        """使用 OpenAI Embedding API"""
+
+    async def _embed_batch_with_openai(self, texts: list[str]) -> list[list[float]]:
+        """使用 OpenAI 一次向量化多筆文字"""
         try:
-            import openai
-            
-            client = openai.OpenAI(api_key=settings.openai_api_key)
-            response = client.embeddings.create(
-                model=self.model or "text-embedding-3-small",
-                input=text
+            client = self._clients.openai_client()
+            response = await self._with_timeout(
+                client.embeddings.create(
+                    model=self.model or "text-embedding-3-small",
+                    input=texts
+                )
             )
-            return response.data[0].embedding
+            # 回傳順序以 index 為準
+            return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
         except Exception as e:
-            logger.error(f"OpenAI embedding failed: {e}")
+            logger.error(f"OpenAI batch embedding failed ({len(texts)} texts): {e}")
             raise
-    
+
+    async def _embed_with_gemini(self, text: str) -> list[float]:
+        """使用 Google Gemini Embedding API"""
+        logger.debug(f"Enhanced text for embedding: {_add_english_keywords(text)[:100]}...")
+        return (await self._embed_batch_with_gemini([text]))[0]
+
+    async def _embed_with_openai(self, text: str) -> list[float]:
+        """使用 OpenAI Embedding API"""
+        return (await self._embed_batch_with_openai([text]))[0]
+
     def format_inspection_for_embedding(self, inspection_data: dict) -> str:
         """
         將巡檢資料格式化為適合 Embedding 的文字
@@ -182,3 +358,14 @@ class EmbeddingService:
         
         return "\n".join(parts)
 
+
+
+_embedding_service: Optional[EmbeddingService] = None
+
+
+def get_embedding_service() -> EmbeddingService:
+    """取得全程序共用的 EmbeddingService（FastAPI Dependency）"""
+    global _embedding_service
+    if _embedding_service is None:
+        _embedding_service = EmbeddingService()
+    return _embedding_service
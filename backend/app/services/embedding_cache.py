@@ -0,0 +1,259 @@
+"""
+Embedding 快取 - 以內容雜湊為鍵的向量快取
+
+- 記憶體層：LRU（OrderedDict），容量由 settings.embedding_cache_size 控制
+- 磁碟層（選用）：SQLite，重啟後仍保留；路徑由 settings.embedding_cache_path 指定，
+  筆數上限 settings.embedding_cache_disk_max_entries（超過時淘汰最早寫入者）。
+  put_many 以單一交易寫入整批向量，寫入使用獨立連線（WAL），不阻塞讀取；
+  get_many 以單一 IN 查詢讀取整批記憶體未命中的鍵，查詢期間不持有記憶體層的鎖
+
+快取鍵為 provider / model / dimension / 實際送出文字（含英文關鍵字前綴）的 SHA-256，
+任一設定變更都會自然失效，不需手動清除。
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 單次 IN 查詢的鍵數上限（低於舊版 SQLite 的 999 個參數限制）
+_SQLITE_IN_BATCH = 500
+
+
+class EmbeddingCache:
+    """兩層式 Embedding 快取（記憶體 LRU + 選用 SQLite）"""
+
+    def __init__(
+        self,
+        max_entries: int = 4096,
+        db_path: Optional[str] = None,
+        max_disk_entries: int = 0,
+    ):
+        """
+        Args:
+            max_entries: 記憶體 LRU 筆數，0 表示停用記憶體層
+            db_path: SQLite 磁碟快取路徑，None 表示僅用記憶體
+            max_disk_entries: 磁碟快取筆數上限，0 表示不限
+        """
+        self.max_entries = max_entries
+        self.db_path = db_path or None
+        self.max_disk_entries = max_disk_entries
+
+        self._memory: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # 讀取專用連線的鎖：磁碟查詢不佔用記憶體層的 _lock
+        self._read_lock = threading.Lock()
+        # 寫入專用連線與鎖：整批寫入期間，查詢仍可經由 _conn 讀取
+        self._write_conn: Optional[sqlite3.Connection] = None
+        self._write_lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.db_path:
+            self._init_db()
+
+    def _init_db(self):
+        """初始化磁碟快取資料庫"""
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                cache_key TEXT PRIMARY KEY,
+                dimension INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_embedding_cache_created_at
+            ON embedding_cache (created_at)
+        """)
+        self._conn.commit()
+        self._write_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._write_conn.execute("PRAGMA synchronous=NORMAL")
+
+    @staticmethod
+    def make_key(provider: str, model: str, dimension: int, text: str) -> str:
+        """產生內容定址的快取鍵"""
+        raw = f"{provider}\x1f{model}\x1f{dimension}\x1f{text}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[list[float]]:
+        """查詢快取，未命中回傳 None"""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, list[float]]:
+        """
+        批次查詢快取，回傳命中的 {key: vector}（未命中者不列入）
+
+        記憶體未命中的鍵以 IN 查詢一次向磁碟層讀取；
+        磁碟讀取為同步 I/O，於 async 程式中請以 run_in_executor 呼叫。
+        """
+        unique = list(dict.fromkeys(keys))
+        found: dict[str, list[float]] = {}
+        missing: list[str] = []
+        with self._lock:
+            for key in unique:
+                vector = self._memory.get(key)
+                if vector is None:
+                    missing.append(key)
+                else:
+                    self._memory.move_to_end(key)
+                    found[key] = list(vector)
+            self.hits += len(found)
+
+        disk_found = self._read_disk(missing) if missing else {}
+
+        with self._lock:
+            for key, vector in disk_found.items():
+                self._remember(key, vector)
+                found[key] = list(vector)
+            self.hits += len(disk_found)
+            self.disk_hits += len(disk_found)
+            self.misses += len(missing) - len(disk_found)
+        return found
+
+    def _read_disk(self, keys: list[str]) -> dict[str, list[float]]:
+        if self._conn is None:
+            return {}
+        result: dict[str, list[float]] = {}
+        with self._read_lock:
+            try:
+                for start in range(0, len(keys), _SQLITE_IN_BATCH):
+                    batch = keys[start:start + _SQLITE_IN_BATCH]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = self._conn.execute(
+                        f"SELECT cache_key, vector FROM embedding_cache WHERE cache_key IN ({placeholders})",
+                        batch,
+                    ).fetchall()
+                    for key, blob in rows:
+                        result[key] = array("f", blob).tolist()
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding disk cache read failed: {e}")
+        return result
+
+    def put(self, key: str, vector: list[float]) -> None:
+        """寫入單筆快取（記憶體與磁碟）"""
+        self.put_many([(key, vector)])
+
+    def put_many(self, items: list[tuple[str, list[float]]]) -> None:
+        """
+        寫入多筆快取；磁碟層以單一交易寫入並於超過上限時淘汰最早寫入者
+
+        磁碟寫入為同步 I/O，於 async 程式中請以 run_in_executor 呼叫。
+        """
+        if not items:
+            return
+        with self._lock:
+            for key, vector in items:
+                self._remember(key, list(vector))
+
+        if self._write_conn is None:
+            return
+        now = datetime.now().isoformat()
+        rows = [(key, len(vector), array("f", vector).tobytes(), now) for key, vector in items]
+        with self._write_lock:
+            try:
+                with self._write_conn:  # 單一交易：成功時 commit，失敗時 rollback
+                    self._write_conn.executemany(
+                        """INSERT OR REPLACE INTO embedding_cache
+                           (cache_key, dimension, vector, created_at)
+                           VALUES (?, ?, ?, ?)""",
+                        rows,
+                    )
+                    if self.max_disk_entries > 0:
+                        self._prune(self._write_conn)
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding disk cache write failed: {e}")
+
+    def _prune(self, conn: sqlite3.Connection) -> None:
+        excess = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0] - self.max_disk_entries
+        if excess > 0:
+            conn.execute(
+                """DELETE FROM embedding_cache WHERE cache_key IN (
+                       SELECT cache_key FROM embedding_cache ORDER BY created_at LIMIT ?
+                   )""",
+                (excess,),
+            )
+
+    def _remember(self, key: str, vector: list[float]) -> None:
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def clear(self) -> None:
+        """清除快取內容與計數"""
+        with self._lock:
+            self._memory.clear()
+            self.hits = self.disk_hits = self.misses = 0
+        with self._write_lock:
+            if self._write_conn is not None:
+                with self._write_conn:
+                    self._write_conn.execute("DELETE FROM embedding_cache")
+
+    def stats(self) -> dict:
+        """快取命中統計（供容量調校）"""
+        disk_entries = None
+        with self._read_lock:
+            if self._conn is not None:
+                disk_entries = self._conn.execute(
+                    "SELECT COUNT(*) FROM embedding_cache"
+                ).fetchone()[0]
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "disk_entries": disk_entries,
+                "max_disk_entries": self.max_disk_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def close(self) -> None:
+        with self._write_lock:
+            if self._write_conn is not None:
+                self._write_conn.close()
+                self._write_conn = None
+        with self._read_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """取得全程序共用的 Embedding 快取；容量設為 0 且未設定磁碟路徑時停用"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        if settings.embedding_cache_size <= 0 and not settings.embedding_cache_path:
+            return None
+        _embedding_cache = EmbeddingCache(
+            max_entries=settings.embedding_cache_size,
+            db_path=settings.embedding_cache_path or None,
+            max_disk_entries=settings.embedding_cache_disk_max_entries,
+        )
+    return _embedding_cache
@@ -0,0 +1,269 @@
+"""
+文件匯入工作佇列 - /api/rag/upload 的背景處理
+
+- 工作表：SQLite（settings.rag_import_job_db），與 RAG 儲存後端無關，重啟後仍可查詢
+- 同時執行數：settings.rag_import_concurrency（asyncio.Semaphore）
+- 重試：尚未寫入任何知識前失敗者，以指數退避重試至 settings.rag_import_max_attempts 次；
+  已寫入部分知識後失敗則不重試，避免重複入庫
+- 重啟時，狀態仍為 queued / running 且尚未入庫任何知識的工作會重新排入佇列
+
+狀態：queued → running → completed / failed（重試等待期間為 retrying）
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("queued", "running", "retrying")
+
+
+def _partially_imported(job: Optional[dict]) -> bool:
+    """是否已寫入部分知識（processed 於 importing 階段才是入庫筆數，analyzing 階段為已分析段數）"""
+    return bool(job) and job.get("stage") == "importing" and job.get("processed", 0) > 0
+
+
+class ImportJobStore:
+    """匯入工作表（SQLite）"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS import_jobs (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                processed INTEGER NOT NULL DEFAULT 0,
+                total INTEGER,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                result TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_import_jobs_created_at
+            ON import_jobs (created_at)
+        """)
+        self._conn.commit()
+
+    def create(self, filename: str, file_path: str) -> dict:
+        job_id = str(uuid.uuid4())
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO import_jobs
+                   (id, filename, file_path, status, created_at, updated_at)
+                   VALUES (?, ?, ?, 'queued', ?, ?)""",
+                (job_id, filename, file_path, now, now),
+            )
+            self._conn.commit()
+        return self.get(job_id)
+
+    def update(self, job_id: str, **fields) -> None:
+        if "result" in fields and fields["result"] is not None:
+            fields["result"] = json.dumps(fields["result"], ensure_ascii=False)
+        fields["updated_at"] = datetime.utcnow().isoformat()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE import_jobs SET {assignments} WHERE id = ?",
+                (*fields.values(), job_id),
+            )
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM import_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def recent(self, limit: int = 50) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM import_jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def active(self) -> list[dict]:
+        placeholders = ", ".join("?" for _ in ACTIVE_STATUSES)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM import_jobs WHERE status IN ({placeholders}) ORDER BY created_at",
+                ACTIVE_STATUSES,
+            ).fetchall()
+        return [self._to_dict(row, include_path=True) for row in rows]
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row, include_path: bool = False) -> dict:
+        job = dict(row)
+        if not include_path:
+            job.pop("file_path", None)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ImportJobQueue:
+    """以 asyncio 背景工作執行文件匯入，限制同時執行數並重試暫時性失敗"""
+
+    def __init__(
+        self,
+        store: ImportJobStore,
+        rag_service=None,
+        concurrency: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+        retry_backoff_seconds: Optional[float] = None,
+    ):
+        self.store = store
+        self._rag_service = rag_service
+        self.max_attempts = max(1, max_attempts or settings.rag_import_max_attempts)
+        self.retry_backoff_seconds = (
+            settings.rag_import_retry_backoff_seconds
+            if retry_backoff_seconds is None else retry_backoff_seconds
+        )
+        self._semaphore = asyncio.Semaphore(max(1, concurrency or settings.rag_import_concurrency))
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    @property
+    def rag_service(self):
+        if self._rag_service is None:
+            from app.services.rag import get_rag_service
+            self._rag_service = get_rag_service()
+        return self._rag_service
+
+    def submit(self, file_path: str, filename: str) -> dict:
+        """建立工作並排入佇列，立即回傳工作狀態"""
+        job = self.store.create(filename, file_path)
+        self._start(job["id"], file_path, filename)
+        return job
+
+    def resume(self) -> int:
+        """重新排入上次程序結束時未完成的工作（暫存檔已不存在或已部分入庫者標記為失敗）"""
+        resumed = 0
+        for job in self.store.active():
+            file_path = job["file_path"]
+            if not os.path.exists(file_path):
+                self.store.update(job["id"], status="failed", error="Upload file no longer exists")
+                continue
+            if _partially_imported(job):
+                self.store.update(job["id"], status="failed", error="Interrupted after partial import")
+                self._remove_file(file_path)
+                continue
+            self.store.update(job["id"], status="queued", stage=None)
+            self._start(job["id"], file_path, job["filename"])
+            resumed += 1
+        if resumed:
+            logger.info(f"Resumed {resumed} document import jobs")
+        return resumed
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self.store.get(job_id)
+
+    def recent(self, limit: int = 50) -> list[dict]:
+        return self.store.recent(limit)
+
+    def _start(self, job_id: str, file_path: str, filename: str) -> None:
+        task = asyncio.create_task(self._run(job_id, file_path, filename))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def _run(self, job_id: str, file_path: str, filename: str) -> None:
+        try:
+            await self._run_attempts(job_id, file_path, filename)
+        except asyncio.CancelledError:
+            # 程序關閉：保留狀態與暫存檔，下次啟動時由 resume() 重新排入
+            raise
+        except Exception as e:
+            logger.error(f"Import job {job_id} crashed: {e}")
+            self.store.update(job_id, status="failed", error=str(e))
+        self._remove_file(file_path)
+
+    async def _run_attempts(self, job_id: str, file_path: str, filename: str) -> None:
+        for attempt in range(1, self.max_attempts + 1):
+            async with self._semaphore:
+                self.store.update(
+                    job_id, status="running", attempts=attempt, error=None,
+                    stage=None, processed=0, total=None,
+                )
+
+                def on_progress(stage: str, processed: int = 0, total: Optional[int] = None):
+                    self.store.update(job_id, stage=stage, processed=processed, total=total)
+
+                result = await self.rag_service.import_from_document(
+                    file_path, filename, progress=on_progress
+                )
+
+            if result.get("success"):
+                self.store.update(job_id, status="completed", stage="done", result=result)
+                logger.info(f"Import job {job_id} completed: {result.get('count')} items")
+                return
+
+            error = result.get("error", "unknown error")
+            if _partially_imported(self.store.get(job_id)) or attempt >= self.max_attempts:
+                self.store.update(job_id, status="failed", error=error, result=result)
+                logger.error(f"Import job {job_id} failed after {attempt} attempt(s): {error}")
+                return
+
+            delay = self.retry_backoff_seconds * (2 ** (attempt - 1))
+            logger.warning(f"Import job {job_id} attempt {attempt} failed, retrying in {delay}s: {error}")
+            self.store.update(job_id, status="retrying", error=error)
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _remove_file(file_path: str) -> None:
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        except OSError as e:
+            logger.warning(f"Failed to remove upload {file_path}: {e}")
+
+    async def aclose(self) -> None:
+        """取消執行中的工作（未完成者於下次啟動時續跑）"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+_import_queue: Optional[ImportJobQueue] = None
+
+
+def get_import_queue() -> ImportJobQueue:
+    """取得全程序共用的匯入工作佇列（FastAPI Dependency）"""
+    global _import_queue
+    if _import_queue is None:
+        _import_queue = ImportJobQueue(ImportJobStore(settings.rag_import_job_db))
+    return _import_queue
+
+
+async def close_import_queue() -> None:
+    """於應用程式關閉時停止背景工作"""
+    global _import_queue
+    if _import_queue is not None:
+        await _import_queue.aclose()
+        _import_queue.store.close()
+        _import_queue = None
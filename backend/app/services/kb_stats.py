@@ -0,0 +1,77 @@
+"""
+知識庫統計 - 以增量計數提供 O(1) 的 /api/rag/stats
+
+第一次查詢時由儲存後端完整計數一次，之後新增 / 刪除時即時增減；
+超過 settings.rag_stats_reconcile_seconds 或呼叫端要求時重新完整計數，
+修正其他程序（多個後端實例、import 工具直連資料庫）寫入造成的偏差。
+"""
+
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, Optional
+
+
+class KnowledgeBaseStats:
+    """依來源與設備類型的增量計數"""
+
+    def __init__(self, reconcile_seconds: float = 300.0):
+        self.reconcile_seconds = reconcile_seconds
+        self._lock = threading.Lock()
+        self._by_source: Counter = Counter()
+        self._by_equipment: Counter = Counter()
+        self._total = 0
+        self._loaded_at: Optional[float] = None
+        self._reconciled_at: Optional[str] = None
+
+    def is_stale(self) -> bool:
+        """尚未載入或已超過重新計數間隔"""
+        if self._loaded_at is None:
+            return True
+        return self.reconcile_seconds > 0 and (
+            time.monotonic() - self._loaded_at >= self.reconcile_seconds
+        )
+
+    def load(self, stats: dict) -> None:
+        """以完整計數結果取代目前計數"""
+        with self._lock:
+            self._total = stats["total"] or 0
+            self._by_source = Counter(stats["by_source"])
+            self._by_equipment = Counter(stats["by_equipment"])
+            self._loaded_at = time.monotonic()
+            self._reconciled_at = datetime.utcnow().isoformat()
+
+    def record_added(self, items: Iterable[dict]) -> None:
+        """新增項目（需含 source_type / equipment_type）"""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            for item in items:
+                self._total += 1
+                self._by_source[item["source_type"]] += 1
+                self._by_equipment[item["equipment_type"]] += 1
+
+    def record_deleted(self, item: dict) -> None:
+        """刪除項目（需含 source_type / equipment_type）"""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._total -= 1
+            for counter, key in (
+                (self._by_source, item["source_type"]),
+                (self._by_equipment, item["equipment_type"]),
+            ):
+                counter[key] -= 1
+                if counter[key] <= 0:
+                    del counter[key]
+
+    def snapshot(self) -> dict:
+        """目前統計（與儲存後端 stats() 相同欄位，另附最後完整計數時間）"""
+        with self._lock:
+            return {
+                "total": self._total,
+                "by_source": dict(self._by_source),
+                "by_equipment": dict(self._by_equipment),
+                "reconciled_at": self._reconciled_at,
+            }
@@ -0,0 +1,603 @@
+"""
+本機向量索引 - 無 PostgreSQL 的邊緣部署用 RAG 儲存後端
+
+- 向量：float32 連續矩陣，以 np.memmap 映射磁碟檔 (vectors.f32)；寫入前先正規化，
+  查詢只需一次矩陣-向量乘積加上 argpartition
+- 項目資料：SQLite (items.db)；載入時展開為欄位陣列，供 metadata 過濾使用
+- 新增為增量附加；刪除為標記刪除（tombstone），不搬移向量
+- 矩陣掃描、memmap 擴充 / flush 與 SQLite I/O 皆於工作執行緒中執行（asyncio.to_thread），
+  不阻塞 event loop；各操作以同一把鎖序列化
+- metadata 過濾語意同 PgVectorStore 的 jsonb @>：缺少的鍵不符合任何條件，
+  純量比對須型別一致（true 不等於 1，null 只符合值為 null 的鍵）
+- 量化儲存（settings.rag_embedding_storage = halfvec / int8）：載入時由 float32 檔建立
+  float16 / int8 矩陣常駐記憶體供掃描，float32 檔只在重排序時讀取候選列
+
+與 PgVectorStore 提供相同介面，由 settings.rag_backend = "local" 選用。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+import numpy as np
+
+from app.services.pagination import decode_cursor
+from app.services.quantization import quantize, validate_storage
+
+logger = logging.getLogger(__name__)
+
+# metadata 欄位陣列中代表「缺少此鍵」的值（與 JSON null 區分）
+_MISSING = object()
+
+# 量化矩陣分塊轉 float32 計算內積，限制暫存記憶體
+_SCAN_BLOCK = 16384
+
+
+class LocalVectorStore:
+    """以記憶體映射 NumPy 矩陣實作的本機向量索引"""
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(
+        self,
+        index_dir: str,
+        dimension: int,
+        storage: str = "full",
+        rerank_factor: int = 4,
+    ):
+        self.index_dir = index_dir
+        self.dimension = dimension
+        self.storage = validate_storage(storage, "local")
+        self.rerank_factor = max(1, rerank_factor)
+        os.makedirs(index_dir, exist_ok=True)
+
+        self._vectors_path = os.path.join(index_dir, "vectors.f32")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(index_dir, "items.db"), check_same_thread=False
+        )
+        self._init_db()
+        self._load()
+
+    # ================================================================
+    # 初始化與載入
+    # ================================================================
+
+    def _init_db(self):
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS rag_items (
+                row_index INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                content TEXT NOT NULL,
+                content_hash TEXT,
+                equipment_type TEXT NOT NULL,
+                source_type TEXT NOT NULL,
+                source_id TEXT,
+                metadata TEXT,
+                created_at TEXT NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_rag_items_created_at
+            ON rag_items (created_at)
+        """)
+        # 舊版索引目錄補上 content_hash 欄位
+        columns = {r[1] for r in self._conn.execute("PRAGMA table_info(rag_items)")}
+        if "content_hash" not in columns:
+            self._conn.execute("ALTER TABLE rag_items ADD COLUMN content_hash TEXT")
+        self._conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_rag_items_content_hash
+            ON rag_items (content_hash)
+        """)
+        self._conn.commit()
+
+    def _load(self):
+        """從 SQLite 重建欄位陣列，並映射向量檔"""
+        rows = self._conn.execute(
+            """SELECT row_index, id, equipment_type, source_type, metadata, deleted
+               FROM rag_items ORDER BY row_index"""
+        ).fetchall()
+
+        self._count = len(rows)
+        self._ids: list[str] = [r[1] for r in rows]
+        self._equipment_types: list[str] = [r[2] for r in rows]
+        self._source_types: list[str] = [r[3] for r in rows]
+        self._metadata: list[dict] = [json.loads(r[4]) if r[4] else {} for r in rows]
+        self._row_of: dict[str, int] = {r[1]: r[0] for r in rows if not r[5]}
+
+        capacity = self.INITIAL_CAPACITY
+        while capacity < self._count:
+            capacity *= 2
+        if os.path.exists(self._vectors_path):
+            stored_rows = os.path.getsize(self._vectors_path) // (self.dimension * 4)
+            capacity = max(capacity, stored_rows)
+
+        self._alive = np.zeros(capacity, dtype=bool)
+        for r in rows:
+            self._alive[r[0]] = not r[5]
+        self._meta_columns: dict[str, np.ndarray] = {}
+        self._equipment_column: Optional[np.ndarray] = None
+        self._open_matrix(capacity)
+        self._build_quantized(capacity)
+
+        logger.info(
+            f"Local vector index loaded: {len(self._row_of)} items "
+            f"({self._count} rows, capacity {capacity}, {self.storage}) from {self.index_dir}"
+        )
+
+    def _build_quantized(self, capacity: int):
+        """由 float32 檔建立常駐記憶體的量化矩陣（full 儲存時不建立）"""
+        self._quantized: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        if self.storage == "full":
+            return
+
+        dtype = np.float16 if self.storage == "halfvec" else np.int8
+        self._quantized = np.zeros((capacity, self.dimension), dtype=dtype)
+        if self.storage == "int8":
+            self._scales = np.ones(capacity, dtype=np.float32)
+        for start in range(0, self._count, _SCAN_BLOCK):
+            end = min(self._count, start + _SCAN_BLOCK)
+            self._write_quantized(start, np.asarray(self._matrix[start:end]))
+
+    def _write_quantized(self, start: int, vectors: np.ndarray):
+        if self._quantized is None:
+            return
+        quantized, scales = quantize(vectors, self.storage)
+        self._quantized[start:start + len(vectors)] = quantized
+        if scales is not None:
+            self._scales[start:start + len(vectors)] = scales
+
+    def _open_matrix(self, capacity: int):
+        """以指定容量映射向量檔（檔案不足時延伸）"""
+        needed = capacity * self.dimension * 4
+        mode = "r+b" if os.path.exists(self._vectors_path) else "w+b"
+        with open(self._vectors_path, mode) as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < needed:
+                f.truncate(needed)
+        self._matrix = np.memmap(
+            self._vectors_path, dtype=np.float32, mode="r+",
+            shape=(capacity, self.dimension),
+        )
+        self._capacity = capacity
+
+    def _ensure_capacity(self, rows: int):
+        if rows <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < rows:
+            capacity *= 2
+        self._matrix.flush()
+        del self._matrix
+        self._open_matrix(capacity)
+
+        alive = np.zeros(capacity, dtype=bool)
+        alive[: self._count] = self._alive[: self._count]
+        self._alive = alive
+        if self._quantized is not None:
+            quantized = np.zeros((capacity, self.dimension), dtype=self._quantized.dtype)
+            quantized[: self._count] = self._quantized[: self._count]
+            self._quantized = quantized
+        if self._scales is not None:
+            scales = np.ones(capacity, dtype=np.float32)
+            scales[: self._count] = self._scales[: self._count]
+            self._scales = scales
+        for key, column in list(self._meta_columns.items()):
+            grown = np.empty(capacity, dtype=object)
+            grown[: self._count] = column[: self._count]
+            self._meta_columns[key] = grown
+
+    def _normalize(self, vector) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32)
+        if vec.shape != (self.dimension,):
+            raise ValueError(
+                f"Embedding dimension mismatch: expected {self.dimension}, got {vec.shape}"
+            )
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm > 0 else vec
+
+    def _scan_scores(self, n: int, query: np.ndarray) -> np.ndarray:
+        """前 n 列與查詢向量的內積（量化儲存時為近似值）"""
+        if self._quantized is None:
+            return self._matrix[:n] @ query
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, _SCAN_BLOCK):
+            end = min(n, start + _SCAN_BLOCK)
+            scores[start:end] = self._quantized[start:end].astype(np.float32) @ query
+        if self._scales is not None:
+            scores *= self._scales[:n]
+        return scores
+
+    # ================================================================
+    # 過濾
+    # ================================================================
+
+    def _meta_column(self, key: str) -> np.ndarray:
+        """取得（必要時建立）metadata 欄位陣列"""
+        column = self._meta_columns.get(key)
+        if column is None:
+            column = np.empty(self._capacity, dtype=object)
+            for row, meta in enumerate(self._metadata):
+                column[row] = meta.get(key, _MISSING)
+            self._meta_columns[key] = column
+        return column
+
+    def _filter_column(self, key: str, expected) -> np.ndarray:
+        """equipment_type 字串值比對項目欄位（同 PgVectorStore），其餘比對 metadata"""
+        if key == "equipment_type" and isinstance(expected, str):
+            if self._equipment_column is None:
+                self._equipment_column = np.asarray(self._equipment_types, dtype=object)
+            return self._equipment_column
+        return self._meta_column(key)
+
+    def _filter_mask(self, filters: dict, n: int) -> np.ndarray:
+        """metadata 鍵值過濾（語意同 jsonb @>）"""
+        mask = np.ones(n, dtype=bool)
+        for key, expected in filters.items():
+            column = self._filter_column(key, expected)[:n]
+            if isinstance(expected, str):
+                # 物件陣列逐元素 ==：只有字串會等於字串，可直接向量化
+                mask &= np.asarray(column == expected, dtype=bool)
+            else:
+                mask &= np.fromiter(
+                    (_contains(v, expected) for v in column), dtype=bool, count=n
+                )
+        return mask
+
+    async def _run(self, func, *args):
+        """於工作執行緒中執行同步操作，並以鎖序列化對矩陣與 SQLite 連線的存取"""
+        def call():
+            with self._lock:
+                return func(*args)
+        return await asyncio.to_thread(call)
+
+    # ================================================================
+    # Store API
+    # ================================================================
+
+    async def search(
+        self,
+        query_embedding: list[float],
+        top_k: int,
+        filters: Optional[dict] = None,
+        min_similarity: float = 0.0,
+        recall: Optional[str] = None,
+        ids: Optional[list[str]] = None,
+    ) -> list[dict]:
+        """
+        矩陣-向量乘積 + argpartition 取 top-k（recall 參數不影響結果）
+
+        量化儲存時以近似內積取 top_k * rerank_factor 個候選，再以 float32 向量重排序。
+
+        :param ids: 只在指定的候選項目中評分（混合檢索的詞彙預篩結果，直接以 float32 計算）
+        """
+        return await self._run(
+            self._search, query_embedding, top_k, filters, min_similarity, ids
+        )
+
+    def _search(
+        self,
+        query_embedding: list[float],
+        top_k: int,
+        filters: Optional[dict],
+        min_similarity: float,
+        ids: Optional[list[str]],
+    ) -> list[dict]:
+        n = self._count
+        if n == 0 or top_k <= 0:
+            return []
+
+        query = self._normalize(query_embedding)
+        approximate = self._quantized is not None and ids is None
+
+        if ids is not None:
+            # 只對候選列做乘積，不掃描整個矩陣
+            rows = np.array(
+                sorted(r for r in (self._row_of.get(i) for i in ids) if r is not None),
+                dtype=np.int64,
+            )
+            if rows.size == 0:
+                return []
+            scores = np.full(n, -np.inf, dtype=np.float32)
+            scores[rows] = self._matrix[rows] @ query
+            mask = np.zeros(n, dtype=bool)
+            mask[rows] = scores[rows] >= min_similarity
+        else:
+            scores = self._scan_scores(n, query)
+            mask = self._alive[:n].copy()
+            if not approximate:
+                # 近似分數不可直接套用門檻，重排序後再過濾
+                mask &= scores >= min_similarity
+
+        if filters:
+            mask &= self._filter_mask(filters, n)
+
+        candidates = np.flatnonzero(mask)
+        if candidates.size == 0:
+            return []
+
+        candidate_scores = scores[candidates]
+        k = min(top_k * self.rerank_factor if approximate else top_k, candidates.size)
+        if k < candidates.size:
+            top = np.argpartition(-candidate_scores, k - 1)[:k]
+        else:
+            top = np.arange(candidates.size)
+
+        if approximate:
+            top_rows = np.sort(candidates[top])
+            exact = self._matrix[top_rows] @ query
+            keep = exact >= min_similarity
+            top_rows, exact = top_rows[keep], exact[keep]
+            order = np.argsort(-exact, kind="stable")[:top_k]
+            rows = [int(r) for r in top_rows[order]]
+            similarities = exact[order]
+        else:
+            top = top[np.argsort(-candidate_scores[top], kind="stable")]
+            rows = [int(r) for r in candidates[top]]
+            similarities = candidate_scores[top]
+        if not rows:
+            return []
+        details = self._fetch_rows(rows)
+
+        return [{
+            "id": self._ids[row],
+            "similarity": round(float(similarity), 4),
+            "equipment_type": self._equipment_types[row],
+            "content": details[row]["content"],
+            "source_type": self._source_types[row],
+            "metadata": self._metadata[row],
+        } for row, similarity in zip(rows, similarities)]
+
+    async def nearest_ids(
+        self,
+        embeddings: list[list[float]],
+        min_similarity: float,
+    ) -> list[Optional[str]]:
+        """每個向量最接近的項目 id（相似度未達門檻時為 None），以全精度矩陣乘積整批計算"""
+        if not embeddings:
+            return []
+        return await self._run(self._nearest_ids, embeddings, min_similarity)
+
+    def _nearest_ids(self, embeddings: list[list[float]], min_similarity: float) -> list[Optional[str]]:
+        queries = np.stack([self._normalize(e) for e in embeddings])
+        best_scores = np.full(len(queries), -np.inf, dtype=np.float32)
+        best_rows = np.full(len(queries), -1, dtype=np.int64)
+        for start in range(0, self._count, _SCAN_BLOCK):
+            end = min(self._count, start + _SCAN_BLOCK)
+            scores = queries @ np.asarray(self._matrix[start:end]).T
+            scores[:, ~self._alive[start:end]] = -np.inf
+            block_best = np.argmax(scores, axis=1)
+            block_scores = scores[np.arange(len(queries)), block_best]
+            better = block_scores > best_scores
+            best_scores[better] = block_scores[better]
+            best_rows[better] = start + block_best[better]
+        return [
+            self._ids[row] if row >= 0 and score >= min_similarity else None
+            for row, score in zip(best_rows.tolist(), best_scores.tolist())
+        ]
+
+    def _fetch_rows(self, rows: list[int]) -> dict[int, dict]:
+        placeholders = ",".join("?" * len(rows))
+        result = self._conn.execute(
+            f"""SELECT row_index, content, source_id, created_at
+                FROM rag_items WHERE row_index IN ({placeholders})""",
+            rows,
+        ).fetchall()
+        return {
+            r[0]: {"content": r[1], "source_id": r[2], "created_at": r[3]}
+            for r in result
+        }
+
+    async def add(
+        self,
+        content: str,
+        equipment_type: str,
+        source_type: str,
+        embedding: list[float],
+        source_id: Optional[str] = None,
+        metadata: Optional[dict] = None,
+        content_hash: Optional[str] = None,
+    ) -> str:
+        """附加一筆項目"""
+        ids = await self.add_many([{
+            "content": content,
+            "content_hash": content_hash,
+            "equipment_type": equipment_type,
+            "source_type": source_type,
+            "source_id": source_id,
+            "embedding": embedding,
+            "metadata": metadata,
+        }])
+        return ids[0]
+
+    async def add_many(self, items: list[dict]) -> list[str]:
+        """附加多筆項目（向量一次寫入映射檔，資料以單一交易寫入 SQLite）"""
+        if not items:
+            return []
+        return await self._run(self._add_many, items)
+
+    def _add_many(self, items: list[dict]) -> list[str]:
+        vectors = np.stack([self._normalize(item["embedding"]) for item in items])
+        start = self._count
+        end = start + len(items)
+        created_at = datetime.utcnow().isoformat()
+        ids = [str(uuid.uuid4()) for _ in items]
+        metadatas = [item.get("metadata") or {} for item in items]
+
+        self._ensure_capacity(end)
+        self._matrix[start:end] = vectors
+        self._matrix.flush()
+        self._write_quantized(start, vectors)
+
+        with self._conn:
+            self._conn.executemany(
+                """INSERT INTO rag_items
+                   (row_index, id, content, content_hash, equipment_type, source_type,
+                    source_id, metadata, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                [(
+                    start + i, ids[i], item["content"], item.get("content_hash"),
+                    item["equipment_type"],
+                    item["source_type"], item.get("source_id"),
+                    json.dumps(metadatas[i], ensure_ascii=False), created_at,
+                ) for i, item in enumerate(items)],
+            )
+
+        for i, item in enumerate(items):
+            row = start + i
+            self._ids.append(ids[i])
+            self._equipment_types.append(item["equipment_type"])
+            self._source_types.append(item["source_type"])
+            self._metadata.append(metadatas[i])
+            self._row_of[ids[i]] = row
+            for key, column in self._meta_columns.items():
+                column[row] = metadatas[i].get(key, _MISSING)
+        self._alive[start:end] = True
+        self._count = end
+        self._equipment_column = None
+
+        return ids
+
+    async def delete(self, item_id: str) -> bool:
+        """標記刪除"""
+        return await self.delete_returning(item_id) is not None
+
+    async def delete_returning(self, item_id: str) -> Optional[dict]:
+        """標記刪除並回傳其 source_type / equipment_type，不存在時回傳 None"""
+        return await self._run(self._delete_returning, item_id)
+
+    def _delete_returning(self, item_id: str) -> Optional[dict]:
+        row = self._row_of.pop(item_id, None)
+        if row is None:
+            return None
+        self._conn.execute("UPDATE rag_items SET deleted = 1 WHERE row_index = ?", (row,))
+        self._conn.commit()
+        self._alive[row] = False
+        return {"source_type": self._source_types[row], "equipment_type": self._equipment_types[row]}
+
+    async def find_by_hashes(self, hashes: list[str]) -> dict[str, str]:
+        """依內容雜湊查詢既有項目，回傳 {content_hash: id}"""
+        return await self._run(self._find_by_hashes, hashes)
+
+    def _find_by_hashes(self, hashes: list[str]) -> dict[str, str]:
+        unique = list(set(hashes))
+        found: dict[str, str] = {}
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for content_hash, item_id in self._conn.execute(
+                f"""SELECT content_hash, id FROM rag_items
+                    WHERE deleted = 0 AND content_hash IN ({placeholders})
+                    ORDER BY row_index""",
+                batch,
+            ):
+                found.setdefault(content_hash, item_id)
+        return found
+
+    async def stats(self) -> dict:
+        """知識庫統計"""
+        return await self._run(self._stats)
+
+    def _stats(self) -> dict:
+        rows = self._row_of.values()
+        return {
+            "total": len(self._row_of),
+            "by_source": dict(Counter(self._source_types[r] for r in rows)),
+            "by_equipment": dict(Counter(self._equipment_types[r] for r in rows)),
+        }
+
+    async def rebuild_index(self, index_type: Optional[str] = None) -> dict:
+        """本機索引為精確搜尋，沒有 ANN 索引可重建"""
+        return {"index_type": None, "lists": None, "rows": self._count}
+
+    async def list_items(
+        self,
+        skip: int = 0,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+    ) -> list[dict]:
+        """
+        依建立時間新到舊列出項目
+
+        :param cursor: 上一頁最後一筆的游標；指定時以 keyset 分頁取代 OFFSET
+        """
+        return await self._run(self._list_items, skip, limit, cursor)
+
+    def _list_items(self, skip: int, limit: int, cursor: Optional[str]) -> list[dict]:
+        where = "deleted = 0"
+        params: list = []
+        if cursor:
+            created_at, item_id = decode_cursor(cursor)
+            where += """ AND (created_at < ? OR (created_at = ? AND row_index <
+                             (SELECT row_index FROM rag_items WHERE id = ?)))"""
+            params += [created_at, created_at, item_id]
+        result = self._conn.execute(
+            f"""SELECT id, equipment_type, content, source_type, source_id, metadata, created_at
+                FROM rag_items WHERE {where}
+                ORDER BY created_at DESC, row_index DESC LIMIT ? OFFSET ?""",
+            [*params, limit, 0 if cursor else skip],
+        ).fetchall()
+        return [{
+            "id": r[0],
+            "equipment_type": r[1],
+            "content": r[2],
+            "source_type": r[3],
+            "source_id": r[4],
+            "metadata": json.loads(r[5]) if r[5] else {},
+            "created_at": r[6],
+        } for r in result]
+
+    async def iter_contents(self, batch_size: int = 1000) -> AsyncIterator[tuple[str, str]]:
+        """逐批讀取所有項目的 (id, content)，供建立詞彙索引"""
+        after = -1
+        while True:
+            rows = await self._run(self._contents_after, after, batch_size)
+            if not rows:
+                return
+            after = rows[-1][0]
+            for _, item_id, content in rows:
+                yield item_id, content
+
+    def _contents_after(self, after: int, limit: int) -> list[tuple]:
+        # 以 row_index 分頁，批次之間不保留游標（其他操作可在批次間使用連線）
+        return self._conn.execute(
+            """SELECT row_index, id, content FROM rag_items
+               WHERE deleted = 0 AND row_index > ? ORDER BY row_index LIMIT ?""",
+            (after, limit),
+        ).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._matrix.flush()
+            self._conn.close()
+
+
+def _contains(value, expected) -> bool:
+    """JSON containment (value @> expected) 的簡化實作"""
+    if isinstance(expected, dict):
+        return isinstance(value, dict) and all(
+            k in value and _contains(value[k], v) for k, v in expected.items()
+        )
+    if isinstance(expected, list):
+        if not isinstance(value, list):
+            return False
+        return all(any(_contains(v, e) for v in value) for e in expected)
+    return _json_equal(value, expected)
+
+
+def _json_equal(value, expected) -> bool:
+    """JSON 純量比對：布林只等於布林，數值不分整數 / 浮點數，其餘型別須相同"""
+    if isinstance(value, bool) or isinstance(expected, bool):
+        return isinstance(value, bool) and isinstance(expected, bool) and value == expected
+    if isinstance(expected, (int, float)):
+        return isinstance(value, (int, float)) and value == expected
+    return type(value) is type(expected) and value == expected
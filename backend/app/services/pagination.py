@@ -0,0 +1,48 @@
+"""
+知識庫項目的 keyset 分頁
+
+排序鍵為 (created_at, id) 由新到舊；游標為最後一筆的排序鍵，編碼成不透明字串。
+深分頁不需 OFFSET 掃過前面的資料列，完整匯出也只需固定記憶體。
+"""
+
+import base64
+import json
+from typing import AsyncIterator, Optional
+
+
+def encode_cursor(created_at: Optional[str], item_id: str) -> str:
+    """將排序鍵編碼為游標"""
+    raw = json.dumps([created_at, item_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    """解碼游標，格式錯誤時拋出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not isinstance(created_at, str) or not isinstance(item_id, str):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return created_at, item_id
+
+
+def next_cursor(items: list[dict], limit: int) -> Optional[str]:
+    """下一頁游標；本頁未滿表示已到最後一頁"""
+    if len(items) < limit or not items:
+        return None
+    last = items[-1]
+    return encode_cursor(last["created_at"], last["id"])
+
+
+async def iter_all_items(store, batch_size: int = 1000) -> AsyncIterator[dict]:
+    """以 keyset 分頁逐批讀取所有項目（不含 embedding）"""
+    cursor = None
+    while True:
+        items = await store.list_items(limit=batch_size, cursor=cursor)
+        for item in items:
+            yield item
+        cursor = next_cursor(items, batch_size)
+        if cursor is None:
+            return
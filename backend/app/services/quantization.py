@@ -0,0 +1,55 @@
+"""
+Embedding 量化儲存
+
+settings.rag_embedding_storage 決定 ANN 掃描使用的向量精度：
+- full：float32（預設）
+- halfvec：float16，每列記憶體減半（pgvector >= 0.7 的 halfvec 欄位 / 本機 float16 矩陣）
+- int8：每列以最大絕對值縮放為 int8，記憶體為 1/4（僅本機後端；pgvector 沒有 int8 向量型別）
+
+量化儲存時先以量化向量取 top_k * settings.rag_rerank_factor 個候選，
+再以另外保存的全精度向量重新計算相似度排序，召回率可用 benchmark_recall.py 量測。
+"""
+
+from typing import Optional
+
+import numpy as np
+
+EMBEDDING_STORAGES = ("full", "halfvec", "int8")
+
+_INT8_MAX = 127
+
+
+def validate_storage(storage: str, backend: str) -> str:
+    """檢查儲存精度與後端的組合"""
+    if storage not in EMBEDDING_STORAGES:
+        raise ValueError(f"Unknown embedding storage: {storage}")
+    if storage == "int8" and backend != "local":
+        raise ValueError("int8 embedding storage requires the local backend; use halfvec with pgvector")
+    return storage
+
+
+def bytes_per_vector(storage: str, dimension: int) -> int:
+    """ANN 掃描每列向量佔用的位元組數（int8 含每列縮放係數）"""
+    if storage == "full":
+        return dimension * 4
+    if storage == "halfvec":
+        return dimension * 2
+    if storage == "int8":
+        return dimension + 4
+    raise ValueError(f"Unknown embedding storage: {storage}")
+
+
+def quantize(vectors: np.ndarray, storage: str) -> tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    量化 (n, dim) float32 向量，回傳 (量化矩陣, 每列縮放係數)
+
+    halfvec 不需縮放係數（回傳 None）；int8 的近似內積為 (q @ query) * scale。
+    """
+    if storage == "halfvec":
+        return vectors.astype(np.float16), None
+    if storage == "int8":
+        peak = np.abs(vectors).max(axis=1)
+        scales = np.where(peak > 0, peak / _INT8_MAX, 1.0).astype(np.float32)
+        quantized = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return quantized, scales
+    raise ValueError(f"Storage {storage} is not quantized")
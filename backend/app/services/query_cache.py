@@ -0,0 +1,128 @@
+"""
+RAG 查詢結果快取 - /api/rag/query 的回應快取
+
+- 快取鍵：正規化後的查詢欄位（NFKC、去除多餘空白、小寫）+ filters + top_k + recall + search_mode
+- 有效期限：settings.rag_query_cache_ttl_seconds
+- 失效：知識庫每次寫入（新增、批次匯入、刪除）遞增世代計數，舊世代的項目一律視為未命中
+
+世代計數僅在本程序內有效；多個後端實例共用資料庫時，其他實例的寫入只能靠 TTL 過期。
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Optional
+
+from app.config import settings
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """全半形統一、合併空白、轉小寫"""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text)
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+class QueryResultCache:
+    """以世代計數失效的 TTL + LRU 查詢結果快取"""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        # key -> (世代, 到期時間, 值)
+        self._entries: OrderedDict[str, tuple[int, float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(
+        fields: list[Optional[str]],
+        filters: Optional[dict] = None,
+        **params,
+    ) -> str:
+        """產生快取鍵：文字欄位正規化，filters 與其他參數以排序後的 JSON 表示"""
+        raw = json.dumps(
+            {
+                "fields": [normalize_text(f) for f in fields],
+                "filters": filters or {},
+                "params": params,
+            },
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """查詢快取，未命中、過期或世代不符時回傳 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                generation, expires_at, value = entry
+                if generation == self.generation and expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Any, generation: Optional[int] = None) -> None:
+        """
+        寫入快取
+
+        :param generation: 查詢開始時的世代；查詢期間若有寫入，結果可能已過時，不寫入
+        """
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (self.generation, time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """知識庫異動：遞增世代並清除現有項目"""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """快取命中統計"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "generation": self.generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_query_cache: Optional[QueryResultCache] = None
+
+
+def get_query_cache() -> QueryResultCache:
+    """取得全程序共用的查詢結果快取（容量設為 0 時不寫入任何項目）"""
+    global _query_cache
+    if _query_cache is None:
+        _query_cache = QueryResultCache(
+            max_entries=settings.rag_query_cache_size,
+            ttl_seconds=settings.rag_query_cache_ttl_seconds,
+        )
+    return _query_cache
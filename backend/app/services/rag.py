@@ -2,21 +2,25 @@
 RAG 服務 - 向量檢索與相似案例查詢
 """
 
+import asyncio
 import logging
-import uuid
 import json
 import os
-import time
-from typing import Optional
+from typing import AsyncIterator, Callable, Optional
 from datetime import datetime
 
 import google.generativeai as genai
-from sqlalchemy import select, func
-
+import numpy as np
 from app.config import settings
-from app.services.embedding import EmbeddingService
-from app.db.database import async_session_maker
-from app.db.models import RAGItem
+from app.services.clients import ProviderClients, get_provider_clients
+from app.services.dedup import DEDUP_POLICIES, content_hash
+from app.services.document_chunker import chunk_units, dedup_key, extract_units
+from app.services.embedding import EmbeddingService, get_embedding_service
+from app.services.kb_stats import KnowledgeBaseStats
+from app.services.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from app.services.pagination import iter_all_items
+from app.services.query_cache import QueryResultCache, get_query_cache
+from app.services.vector_store import create_vector_store
 
 logger = logging.getLogger(__name__)
 
@@ -25,20 +29,78 @@ UPLOAD_DIR = "uploads"
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
 
+# 建議生成失敗時的回覆（不寫入查詢快取）
+SUGGESTIONS_UNAVAILABLE = "暫時無法生成建議，請稍後再試。"
+NO_SIMILAR_CASES = "暫無相似歷史案例，建議依照標準維修程序處理。"
+MAX_SUGGESTIONS = 5
+
+
+def _near_duplicates_within(embeddings: list[list[float]], threshold: float) -> dict[int, int]:
+    """
+    同批向量兩兩比對餘弦相似度，回傳 {索引: 併入的較早索引}
+
+    依輸入順序處理，只併入本身未被併入的項目（不形成鏈狀合併）。
+    """
+    if len(embeddings) < 2:
+        return {}
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms > 0, norms, 1)
+    similar = (vectors @ vectors.T) >= threshold
+
+    merged: dict[int, int] = {}
+    kept = np.zeros(len(vectors), dtype=bool)
+    for j in range(len(vectors)):
+        earlier = np.flatnonzero(similar[j, :j] & kept[:j])
+        if earlier.size:
+            merged[j] = int(earlier[0])
+        else:
+            kept[j] = True
+    return merged
+
+
+def _clean_suggestion(line: str) -> str:
+    """去除項目符號與編號；過短的行（標題、空行）回傳空字串"""
+    line = line.strip()
+    if len(line) <= 5:
+        return ""
+    return line.lstrip("•-123456789.、）)").strip()
+
 
 class RAGService:
-    """RAG 檢索服務 (PostgreSQL + pgvector)"""
+    """RAG 檢索服務（儲存後端：PostgreSQL + pgvector 或本機向量索引）"""
     
-    def __init__(self):
-        self.embedding_service = EmbeddingService()
+    def __init__(
+        self,
+        embedding_service: Optional[EmbeddingService] = None,
+        clients: Optional[ProviderClients] = None,
+        store=None,
+        query_cache: Optional[QueryResultCache] = None,
+    ):
+        self.embedding_service = embedding_service or get_embedding_service()
+        self.store = store or create_vector_store()
+        self._clients = clients or get_provider_clients()
+        # 查詢結果快取：知識庫任何寫入都會使其失效
+        self.query_cache = query_cache or get_query_cache()
+        # 知識庫統計：新增/刪除時增量維護，定期由儲存後端重新計數
+        self.stats = KnowledgeBaseStats(settings.rag_stats_reconcile_seconds)
+        self._stats_lock = asyncio.Lock()
         self.top_k = settings.rag_top_k
         self.similarity_threshold = settings.rag_similarity_threshold
+        
+        # 詞彙索引：新增/刪除時增量維護，第一次混合查詢時從儲存後端完整載入
+        self.lexical_index = LexicalIndex()
+        self._lexical_ready = False
+        self._lexical_lock = asyncio.Lock()
     
     async def search_similar(
         self, 
         query_text: str, 
         top_k: Optional[int] = None,
-        filters: Optional[dict] = None
+        filters: Optional[dict] = None,
+        recall: Optional[str] = None,
+        mode: Optional[str] = None,
+        lexical_text: Optional[str] = None,
     ) -> list[dict]:
         """
         搜尋相似案例
@@ -46,56 +108,100 @@ class RAGService:
         :param query_text: 查詢文字
         :param top_k: 回傳數量
         :param filters: Metadata 過濾條件 (例如 {"vendor": "Delta"})
+        :param recall: 速度/召回率等級 ("fast" / "balanced" / "accurate")
+        :param mode: "hybrid"（詞彙 + 向量）或 "vector"，預設 settings.rag_search_mode
+        :param lexical_text: 詞彙檢索用文字（預設同 query_text；可排除「設備類型:」等欄位標籤）
         """
         k = top_k or self.top_k
+        mode = mode or settings.rag_search_mode
+        if mode not in ("hybrid", "vector"):
+            raise ValueError(f"Unknown search mode: {mode}")
         
         # 1. 將查詢文字向量化
         query_embedding = await self.embedding_service.embed_text(query_text)
         
+        if mode == "hybrid":
+            return await self._search_hybrid(
+                lexical_text or query_text, query_embedding, k, filters, recall
+            )
+        
         # 2. 在向量資料庫中查詢
-        async with async_session_maker() as session:
-            # 使用 pgvector 的餘弦距離運算子 (<=>) 排序
-            stmt = select(RAGItem)
-            
-            # 套用過濾條件 (如果有的話)
-            if filters:
-                # 這裡假設 filters 是簡單的鍵值對匹配
-                # 若 item_metadata 是 JSONB，可使用 contains
-                stmt = stmt.where(RAGItem.item_metadata.contains(filters))
-            
-            stmt = stmt.order_by(
-                RAGItem.embedding.cosine_distance(query_embedding)
-            ).limit(k)
-            
-            result = await session.execute(stmt)
-            items = result.scalars().all()
-            
-            # 轉換為回傳格式
-            results = []
-            for item in items:
-                # 計算相似度 (1 - distance)
-                sim = self._cosine_similarity(query_embedding, item.embedding)
-                
-                if sim >= self.similarity_threshold:
-                    results.append({
-                        "id": str(item.id),
-                        "similarity": round(sim, 4),
-                        "equipment_type": item.equipment_type,
-                        "content": item.content,
-                        "source_type": item.source_type,
-                        "metadata": item.item_metadata,
-                    })
-            
-            return results
+        return await self.store.search(
+            query_embedding,
+            top_k=k,
+            filters=filters,
+            min_similarity=self.similarity_threshold,
+            recall=recall,
+        )
     
-    def _cosine_similarity(self, a: list[float], b: list[float]) -> float:
-        """計算餘弦相似度 (輔助用)"""
-        import math
-        dot_product = sum(x * y for x, y in zip(a, b))
-        norm_a = math.sqrt(sum(x * x for x in a))
-        norm_b = math.sqrt(sum(x * x for x in b))
-        if norm_a == 0 or norm_b == 0: return 0.0
-        return dot_product / (norm_a * norm_b)
+    async def _search_hybrid(
+        self,
+        query_text: str,
+        query_embedding: list[float],
+        k: int,
+        filters: Optional[dict],
+        recall: Optional[str],
+    ) -> list[dict]:
+        """
+        混合檢索：BM25 詞彙預篩候選 → 候選集向量評分 + 全域 ANN 查詢 → RRF 融合
+        
+        詞彙命中的候選同樣須通過相似度門檻，詞彙分數只影響排序，與 vector 模式的結果集合語意一致。
+        詞彙索引僅存在本程序記憶體（第一次查詢時完整載入），多個 worker 之間不同步其他
+        worker 的新增 / 刪除，故預設仍為 vector 模式。
+        """
+        await self._ensure_lexical_index()
+        lexical = self.lexical_index.search(query_text, settings.rag_lexical_candidates)
+        
+        if not lexical:
+            return await self.store.search(
+                query_embedding,
+                top_k=k,
+                filters=filters,
+                min_similarity=self.similarity_threshold,
+                recall=recall,
+            )
+        
+        candidate_ids = [doc_id for doc_id, _ in lexical]
+        scored, nearest = await asyncio.gather(
+            self.store.search(
+                query_embedding,
+                top_k=len(candidate_ids),
+                filters=filters,
+                min_similarity=self.similarity_threshold,
+                ids=candidate_ids,
+            ),
+            self.store.search(
+                query_embedding,
+                top_k=k,
+                filters=filters,
+                min_similarity=self.similarity_threshold,
+                recall=recall,
+            ),
+        )
+        
+        results = {item["id"]: item for item in nearest}
+        results.update((item["id"], item) for item in scored)
+        
+        lexical_ranking = [doc_id for doc_id in candidate_ids if doc_id in results]
+        vector_ranking = sorted(results, key=lambda i: results[i]["similarity"], reverse=True)
+        fused = reciprocal_rank_fusion(
+            [lexical_ranking, vector_ranking], k=settings.rag_rrf_k
+        )
+        
+        ranked = sorted(fused, key=fused.get, reverse=True)[:k]
+        return [results[doc_id] for doc_id in ranked]
+    
+    async def _ensure_lexical_index(self):
+        """第一次使用時從儲存後端串流載入所有項目內容"""
+        if self._lexical_ready:
+            return
+        async with self._lexical_lock:
+            if self._lexical_ready:
+                return
+            async for item_id, content in self.store.iter_contents():
+                self.lexical_index.add(item_id, content)
+            self._lexical_ready = True
+            logger.info(f"Lexical index built: {len(self.lexical_index)} items")
     
     async def add_item(
         self,
@@ -105,25 +211,172 @@ class RAGService:
         source_id: Optional[str] = None,
         metadata: Optional[dict] = None
     ) -> str:
-        """新增項目到知識庫"""
+        """
+        新增項目到知識庫
+        
+        重複項目依 settings.rag_dedup_policy 處理；skip 時回傳既有項目 id。
+        """
         # 向量化
         embedding = await self.embedding_service.embed_text(content)
         
-        async with async_session_maker() as session:
-            new_item = RAGItem(
-                content=content,
-                equipment_type=equipment_type,
-                source_type=source_type,
-                source_id=source_id,
-                embedding=embedding,
-                item_metadata=metadata or {},
+        ids, duplicates = await self._insert_deduplicated([{
+            "content": content,
+            "equipment_type": equipment_type,
+            "source_type": source_type,
+            "source_id": source_id,
+            "metadata": metadata,
+            "embedding": embedding,
+        }])
+        
+        if duplicates:
+            logger.info(f"Duplicate RAG item ({settings.rag_dedup_policy}): {ids[0]}")
+        else:
+            logger.info(f"Added RAG item: {ids[0]}")
+        return ids[0]
+    
+    async def add_items(
+        self,
+        items: list[dict],
+        chunk_size: Optional[int] = None,
+    ) -> list[str]:
+        """
+        批次新增項目到知識庫
+        
+        :param items: [{"content", "equipment_type", "source_type", "source_id"?, "metadata"?}, ...]
+        :return: 新增項目的 id（與輸入順序一致；skip 去重時為既有項目 id）
+        """
+        ids: list[str] = []
+        async for progress in self.add_items_iter(items, chunk_size=chunk_size):
+            ids.extend(progress["ids"])
+        return ids
+    
+    async def add_items_iter(
+        self,
+        items: list[dict],
+        chunk_size: Optional[int] = None,
+    ) -> AsyncIterator[dict]:
+        """
+        批次新增，每完成一段即回報進度
+        
+        每段 (chunk_size 筆) 以批次 Embedding 向量化、去重後以單一交易、多列 INSERT 寫入。
+        
+        Yields:
+            {"processed": 已處理筆數, "total": 總筆數, "ids": 本段項目的 id, "duplicates": 本段重複筆數}
+        """
+        size = max(1, chunk_size or settings.rag_bulk_chunk_size)
+        total = len(items)
+        
+        for start in range(0, total, size):
+            chunk = items[start:start + size]
+            embeddings = await self.embedding_service.embed_batch(
+                [item["content"] for item in chunk]
+            )
+            ids, duplicates = await self._insert_deduplicated([
+                {**item, "embedding": embedding}
+                for item, embedding in zip(chunk, embeddings)
+            ])
+            
+            processed = start + len(chunk)
+            logger.info(f"Bulk added RAG items: {processed}/{total} ({duplicates} duplicates)")
+            yield {"processed": processed, "total": total, "ids": ids, "duplicates": duplicates}
+    
+    async def _insert_deduplicated(self, items: list[dict]) -> tuple[list[str], int]:
+        """
+        去重後寫入已向量化的項目
+        
+        同一批內內容雜湊相同或近重複者一律併入第一筆；與知識庫既有項目重複者依 rag_dedup_policy 處理。
+        
+        :return: (與輸入順序一致的 id, 重複筆數)
+        """
+        policy = settings.rag_dedup_policy
+        if policy not in DEDUP_POLICIES:
+            raise ValueError(f"Unknown dedup policy: {policy}")
+        
+        hashes = [content_hash(item["content"]) for item in items]
+        if policy == "off":
+            matches: list[Optional[str]] = [None] * len(items)
+            first_of = list(range(len(items)))
+        else:
+            matches, first_of = await self._find_duplicates(items, hashes)
+        
+        ids: list[Optional[str]] = [None] * len(items)
+        inserts: list[int] = []
+        replaced: list[str] = []
+        duplicates = 0
+        for i, item in enumerate(items):
+            if first_of[i] != i:
+                duplicates += 1  # 同批重複，稍後沿用第一筆的 id
+                continue
+            match = matches[i]
+            if match is not None:
+                duplicates += 1
+                if policy == "skip":
+                    ids[i] = match
+                    continue
+                if policy == "replace":
+                    replaced.append(match)
+                else:  # keep
+                    items[i] = {**item, "metadata": {**(item.get("metadata") or {}), "duplicate_of": match}}
+            inserts.append(i)
+        
+        new_ids = await self.store.add_many([
+            {**items[i], "content_hash": hashes[i]} for i in inserts
+        ])
+        for i, item_id in zip(inserts, new_ids):
+            ids[i] = item_id
+        for i in range(len(items)):
+            if ids[i] is None:
+                ids[i] = ids[first_of[i]]
+        
+        for item_id in dict.fromkeys(replaced):
+            removed = await self.store.delete_returning(item_id)
+            if removed:
+                self.stats.record_deleted(removed)
+            self.lexical_index.remove(item_id)
+        self.lexical_index.add_many((ids[i], items[i]["content"]) for i in inserts)
+        self.stats.record_added(items[i] for i in inserts)
+        if inserts or replaced:
+            self.query_cache.invalidate()
+        
+        return ids, duplicates
+    
+    async def _find_duplicates(
+        self,
+        items: list[dict],
+        hashes: list[str],
+    ) -> tuple[list[Optional[str]], list[int]]:
+        """
+        找出每筆項目在知識庫與同批中的重複對象
+        
+        先比對內容雜湊；未命中者以單一批次查詢取知識庫最近鄰（相似度 >= settings.rag_dedup_similarity），
+        仍未命中者再於同批內以向量內積比對，併入較早出現的近重複項目。
+        
+        :return: (每筆的既有項目 id 或 None, 每筆沿用 id 的同批項目索引（本身為第一筆時為自己）)
+        """
+        first_by_hash: dict[str, int] = {}
+        first_of = [first_by_hash.setdefault(item_hash, i) for i, item_hash in enumerate(hashes)]
+        
+        existing = await self.store.find_by_hashes(list(first_by_hash))
+        matches: list[Optional[str]] = [existing.get(h) for h in hashes]
+        
+        threshold = settings.rag_dedup_similarity
+        if threshold < 1:
+            pending = [i for i in first_by_hash.values() if matches[i] is None]
+            found = await self.store.nearest_ids(
+                [items[i]["embedding"] for i in pending], min_similarity=threshold
             )
-            session.add(new_item)
-            await session.commit()
-            await session.refresh(new_item)
+            for i, item_id in zip(pending, found):
+                matches[i] = item_id
             
-            logger.info(f"Added RAG item: {new_item.id}")
-            return str(new_item.id)
+            unmatched = [i for i, item_id in zip(pending, found) if item_id is None]
+            for i, first in _near_duplicates_within(
+                [items[i]["embedding"] for i in unmatched], threshold
+            ).items():
+                first_of[unmatched[i]] = unmatched[first]
+            for i, item_hash in enumerate(hashes):
+                first_of[i] = first_of[first_by_hash[item_hash]]
+        
+        return matches, first_of
     
     async def generate_suggestions(
         self,
@@ -132,18 +385,75 @@ class RAGService:
     ) -> list[str]:
         """根據相似案例生成維修建議 (Gemini)"""
         if not similar_cases:
-            return ["暫無相似歷史案例，建議依照標準維修程序處理。"]
+            return [NO_SIMILAR_CASES]
         
         try:
-            genai.configure(api_key=settings.gemini_api_key)
-            model = genai.GenerativeModel(settings.gemini_flash_model)
+            model = self._clients.generative_model(settings.gemini_flash_model)
+            response = await model.generate_content_async(self._suggestion_prompt(query, similar_cases))
             
-            cases_text = "\n\n".join([
-                f"案例 {i+1} (相似度: {c['similarity']}):\n{c['content']}"
-                for i, c in enumerate(similar_cases[:3])
-            ])
+            suggestions = [
+                _clean_suggestion(line) for line in response.text.strip().split("\n")
+            ]
+            return [s for s in suggestions if s][:MAX_SUGGESTIONS]
             
-            prompt = f"""
+        except Exception as e:
+            logger.error(f"Generate suggestions failed: {e}")
+            return [SUGGESTIONS_UNAVAILABLE]
+    
+    async def stream_suggestions(
+        self,
+        query: dict,
+        similar_cases: list[dict]
+    ) -> AsyncIterator[str]:
+        """
+        串流生成維修建議：模型每產生完整一行即回傳一條建議
+        
+        與 generate_suggestions 使用相同提示詞與清理規則。
+        尚未產生任何建議即失敗時回傳 SUGGESTIONS_UNAVAILABLE；已送出部分建議後才失敗則重新拋出例外，
+        由呼叫端標示串流失敗（部分結果不可視為完整回答快取）。
+        """
+        if not similar_cases:
+            yield NO_SIMILAR_CASES
+            return
+        
+        count = 0
+        try:
+            model = self._clients.generative_model(settings.gemini_flash_model)
+            response = await model.generate_content_async(
+                self._suggestion_prompt(query, similar_cases), stream=True
+            )
+            
+            buffer = ""
+            async for chunk in response:
+                buffer += chunk.text
+                *lines, buffer = buffer.split("\n")
+                for line in lines:
+                    suggestion = _clean_suggestion(line)
+                    if suggestion:
+                        yield suggestion
+                        count += 1
+                        if count >= MAX_SUGGESTIONS:
+                            return
+            
+            suggestion = _clean_suggestion(buffer)
+            if suggestion:
+                yield suggestion
+                
+        except Exception as e:
+            logger.error(f"Stream suggestions failed after {count} suggestion(s): {e}")
+            if count:
+                raise
+            yield SUGGESTIONS_UNAVAILABLE
+    
+    @staticmethod
+    def _suggestion_prompt(query: dict, similar_cases: list[dict]) -> str:
+        """維修建議提示詞"""
+        cases_text = "\n\n".join([
+            f"案例 {i+1} (相似度: {c['similarity']}):\n{c['content']}"
+            for i, c in enumerate(similar_cases[:3])
+        ])
+        
+        return f"""
 你是一位專業的工業設備維修顧問。根據以下巡檢結果和歷史相似案例，提供具體的維修建議。
 
 【目前巡檢結果】
@@ -156,160 +466,244 @@ class RAGService:
 
 請提供 3-5 條具體、可操作的維修建議，每條一行，使用繁體中文。
 """
-            response = model.generate_content(prompt)
-            
-            return [
-                line.strip().lstrip("•-123456789.、）)")
-                for line in response.text.strip().split("\n")
-                if line.strip() and len(line.strip()) > 5
-            ][:5]
-            
-        except Exception as e:
-            logger.error(f"Generate suggestions failed: {e}")
-            return ["暫時無法生成建議，請稍後再試。"]
     
-    async def get_stats(self) -> dict:
-        """取得知識庫統計"""
-        async with async_session_maker() as session:
-            # 總數
-            total = await session.scalar(select(func.count()).select_from(RAGItem))
-            
-            # 來源統計
-            src_result = await session.execute(
-                select(RAGItem.source_type, func.count(RAGItem.id))
-                .group_by(RAGItem.source_type)
-            )
-            by_source = dict(src_result.all())
-            
-            # 設備統計
-            eq_result = await session.execute(
-                select(RAGItem.equipment_type, func.count(RAGItem.id))
-                .group_by(RAGItem.equipment_type)
-            )
-            by_equipment = dict(eq_result.all())
-            
-            return {
-                "total": total,
-                "by_source": by_source,
-                "by_equipment": by_equipment,
-            }
+    async def get_stats(self, refresh: bool = False) -> dict:
+        """
+        取得知識庫統計
+        
+        回傳增量維護的計數；第一次呼叫、超過 settings.rag_stats_reconcile_seconds
+        或 refresh=True 時才由儲存後端重新完整計數。
+        """
+        if refresh or self.stats.is_stale():
+            async with self._stats_lock:
+                if refresh or self.stats.is_stale():
+                    self.stats.load(await self.store.stats())
+        return self.stats.snapshot()
 
-    async def get_all_items(self, skip: int = 0, limit: int = 100) -> list[dict]:
-        """取得所有知識庫項目"""
-        async with async_session_maker() as session:
-            stmt = select(RAGItem).order_by(RAGItem.created_at.desc()).offset(skip).limit(limit)
-            result = await session.execute(stmt)
-            items = result.scalars().all()
-            
-            return [{
-                "id": str(item.id),
-                "equipment_type": item.equipment_type,
-                "content": item.content,
-                "source_type": item.source_type,
-                "source_id": item.source_id,
-                "metadata": item.item_metadata,
-                "created_at": item.created_at.isoformat() if item.created_at else None,
-            } for item in items]
+    async def get_all_items(
+        self,
+        skip: int = 0,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+    ) -> list[dict]:
+        """取得知識庫項目（cursor 為 keyset 分頁游標，見 app.services.pagination）"""
+        return await self.store.list_items(skip=skip, limit=limit, cursor=cursor)
+
+    def iter_all_items(self, batch_size: int = 1000) -> AsyncIterator[dict]:
+        """以 keyset 分頁串流讀取所有項目（固定記憶體，供完整匯出）"""
+        return iter_all_items(self.store, batch_size=batch_size)
 
     async def delete_item(self, item_id: str) -> bool:
         """刪除知識庫項目"""
-        async with async_session_maker() as session:
-            stmt = select(RAGItem).where(RAGItem.id == uuid.UUID(item_id))
-            result = await session.execute(stmt)
-            item = result.scalar_one_or_none()
-            
-            if item:
-                await session.delete(item)
-                await session.commit()
-                return True
+        removed = await self.store.delete_returning(item_id)
+        self.lexical_index.remove(item_id)
+        if removed is None:
             return False
+        self.stats.record_deleted(removed)
+        self.query_cache.invalidate()
+        return True
 
-    async def import_from_document(self, file_path: str, source_filename: str) -> dict:
-        """從文件導入知識 (使用 Gemini File API)"""
+    async def rebuild_index(self, index_type: Optional[str] = None) -> dict:
+        """重建向量索引"""
+        return await self.store.rebuild_index(index_type)
+
+    async def import_from_document(
+        self,
+        file_path: str,
+        source_filename: str,
+        progress: Optional[Callable[..., None]] = None,
+    ) -> dict:
+        """
+        從文件導入知識
+        
+        PDF / DOCX 先於本機擷取文字並分段，各段以有限並行數分別交由 Gemini 擷取知識，
+        合併重疊分段產生的重複項目後批次向量化入庫；無法擷取文字的文件（掃描檔、其他格式）
+        改以 Gemini File API 整份分析。
+        Gemini SDK 的同步呼叫皆於執行緒中執行，等待檔案處理時不阻塞 event loop。
+        
+        :param progress: 進度回呼 progress(stage, processed=0, total=None)，
+                         stage 依序為 "uploading"（僅 File API）/ "analyzing" / "importing"
+        """
+        report = progress or (lambda *args, **kwargs: None)
         try:
             logger.info(f"Processing document: {source_filename}")
-            genai.configure(api_key=settings.gemini_api_key)
-            # 使用 Flash 模型進行文件分析（速度快）
-            model = genai.GenerativeModel(settings.gemini_doc_model)
+            
+            # 1. 擷取知識
+            units = await asyncio.to_thread(extract_units, file_path)
+            if units:
+                items, stats = await self._extract_from_sections(units, report)
+            else:
+                items, stats = await self._extract_from_file(file_path, source_filename, report)
 
-            # 1. 上傳檔案到 Gemini
-            logger.info(f"Uploading to Gemini...")
-            uploaded_file = genai.upload_file(path=file_path, display_name=source_filename)
+            # 2. 合併重複項目（相鄰分段重疊處可能重複擷取）
+            imported_at = datetime.utcnow().isoformat()
+            records = []
+            seen: set[str] = set()
+            duplicates = 0
+            for item in items:
+                if not isinstance(item, dict) or not item.get("content"):
+                    continue  # 簡單檢查必要欄位
+                equipment_type = item.get("equipment_type") or "General"
+                key = dedup_key(equipment_type, item["content"])
+                if key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+                records.append({
+                    "content": item["content"],
+                    "equipment_type": equipment_type,
+                    "source_type": "document",
+                    "source_id": source_filename,
+                    "metadata": {"category": item.get("category"), "filename": source_filename, "imported_at": imported_at},
+                })
             
+            # 3. 批次入庫
+            report("importing", 0, len(records))
+            count = 0
+            async for chunk in self.add_items_iter(records):
+                count = chunk["processed"]
+                duplicates += chunk["duplicates"]
+                report("importing", count, chunk["total"])
+
+            return {
+                "success": True,
+                "count": count,
+                "duplicates": duplicates,
+                **stats,
+                "message": f"成功導入 {count} 筆知識",
+            }
+
+        except Exception as e:
+            logger.error(f"Document import failed: {e}")
+            return {"success": False, "error": str(e)}
+
+    async def _extract_from_sections(
+        self,
+        units: list[str],
+        report: Callable[..., None],
+    ) -> tuple[list[dict], dict]:
+        """分段並行擷取（並行數 settings.rag_doc_extract_concurrency）"""
+        sections = chunk_units(
+            units, settings.rag_doc_chunk_chars, settings.rag_doc_chunk_overlap_chars
+        )
+        model = self._clients.generative_model(settings.gemini_doc_model)
+        semaphore = asyncio.Semaphore(max(1, settings.rag_doc_extract_concurrency))
+        done = 0
+        report("analyzing", 0, len(sections))
+        logger.info(f"Analyzing document in {len(sections)} sections...")
+        
+        async def extract(index: int, section: str) -> Optional[list]:
+            nonlocal done
+            async with semaphore:
+                try:
+                    prompt = (
+                        f"{_DOC_EXTRACTION_PROMPT}\n"
+                        f"【文件內容（第 {index + 1}/{len(sections)} 段）】\n{section}"
+                    )
+                    response = await asyncio.to_thread(model.generate_content, prompt)
+                    return _parse_json_list(response.text)
+                except Exception as e:
+                    logger.warning(f"Section {index + 1}/{len(sections)} extraction failed: {e}")
+                    return None
+                finally:
+                    done += 1
+                    report("analyzing", done, len(sections))
+        
+        results = await asyncio.gather(*(extract(i, s) for i, s in enumerate(sections)))
+        failed = sum(1 for r in results if r is None)
+        if failed == len(sections):
+            raise ValueError("AI extraction failed for every document section")
+        
+        items = [item for r in results if r for item in r]
+        return items, {"sections": len(sections), "failed_sections": failed}
+
+    async def _extract_from_file(
+        self,
+        file_path: str,
+        source_filename: str,
+        report: Callable[..., None],
+    ) -> tuple[list[dict], dict]:
+        """以 Gemini File API 整份分析（無法於本機擷取文字時）"""
+        # 使用 Flash 模型進行文件分析（速度快）
+        model = self._clients.generative_model(settings.gemini_doc_model)
+
+        # 上傳檔案到 Gemini
+        logger.info(f"Uploading to Gemini...")
+        report("uploading")
+        uploaded_file = await asyncio.to_thread(
+            genai.upload_file, path=file_path, display_name=source_filename
+        )
+        
+        try:
             # 等待檔案處理 (通常很快，但安全起見)
             while uploaded_file.state.name == "PROCESSING":
-                time.sleep(1)
-                uploaded_file = genai.get_file(uploaded_file.name)
+                await asyncio.sleep(1)
+                uploaded_file = await asyncio.to_thread(genai.get_file, uploaded_file.name)
             
             if uploaded_file.state.name == "FAILED":
                 raise ValueError("Gemini file processing failed")
 
-            # 2. 發送 Prompt 進行提取
+            # 發送 Prompt 進行提取
             logger.info("Analyzing document...")
-            prompt = """
-            請分析這份維修手冊或文件。
-            你的任務是提取其中所有具體的「設備維修建議」、「故障排除指南」或「設備知識」。
-
-            請將提取的內容整理成一個 JSON 列表，格式如下：
-            [
-              {
-                "equipment_type": "設備名稱 (例如: 風力發電機葉片)",
-                "content": "詳細的維修建議或故障排除步驟 (包含具體數值或判斷標準)",
-                "category": "維修/故障/保養 (自行分類)"
-              }
-            ]
-
-            注意事項：
-            1. 忽略目錄、版權聲明、前言等無關內容。
-            2. 內容(content)應該包含足夠的上下文。
-            3. 如果文件很長，請優先提取最重要的維修知識。
-            4. 僅回傳純 JSON 陣列，不要有 Markdown 標記。
-            """
-
-            response = model.generate_content([prompt, uploaded_file])
-            
-            # 3. 解析回應
-            text = response.text.strip()
-            # 清理 Markdown
-            if text.startswith("```json"):
-                text = text[7:]
-            if text.startswith("```"):
-                text = text[3:]
-            if text.endswith("```"):
-                text = text[:-3]
-            text = text.strip()
-            
-            items = json.loads(text)
-            
-            if not isinstance(items, list):
-                raise ValueError("AI response format error: not a list")
-
-            # 4. 入庫
-            count = 0
-            for item in items:
-                # 簡單檢查必要欄位
-                if "content" not in item:
-                    continue
-                    
-                await self.add_item(
-                    content=item.get("content", ""),
-                    equipment_type=item.get("equipment_type", "General"),
-                    source_type="document",
-                    source_id=source_filename,
-                    metadata={"category": item.get("category"), "filename": source_filename, "imported_at": datetime.utcnow().isoformat()}
-                )
-                count += 1
-            
+            report("analyzing", 0, 1)
+            response = await asyncio.to_thread(
+                model.generate_content,
+                [f"{_DOC_EXTRACTION_PROMPT}\n如果文件很長，請優先提取最重要的維修知識。", uploaded_file],
+            )
+            report("analyzing", 1, 1)
+            return _parse_json_list(response.text), {"sections": 1, "failed_sections": 0}
+        finally:
             # 清理：雖然 Gemini 會自動過期，但我們可以嘗試刪除(如果 library 支援)，或不理會
             try:
-                genai.delete_file(uploaded_file.name)
-            except:
+                await asyncio.to_thread(genai.delete_file, uploaded_file.name)
+            except Exception:
                 pass
 
-            return {"success": True, "count": count, "message": f"成功導入 {count} 筆知識"}
 
-        except Exception as e:
-            logger.error(f"Document import failed: {e}")
-            return {"success": False, "error": str(e)}
+_DOC_EXTRACTION_PROMPT = """
+請分析這份維修手冊或文件。
+你的任務是提取其中所有具體的「設備維修建議」、「故障排除指南」或「設備知識」。
+
+請將提取的內容整理成一個 JSON 列表，格式如下：
+[
+  {
+    "equipment_type": "設備名稱 (例如: 風力發電機葉片)",
+    "content": "詳細的維修建議或故障排除步驟 (包含具體數值或判斷標準)",
+    "category": "維修/故障/保養 (自行分類)"
+  }
+]
+
+注意事項：
+1. 忽略目錄、版權聲明、前言等無關內容。
+2. 內容(content)應該包含足夠的上下文。
+3. 沒有可提取的知識時回傳空陣列 []。
+4. 僅回傳純 JSON 陣列，不要有 Markdown 標記。
+"""
+
+
+def _parse_json_list(text: str) -> list:
+    """解析 AI 回傳的 JSON 陣列（容忍 Markdown 程式碼區塊標記）"""
+    text = text.strip()
+    # 清理 Markdown
+    if text.startswith("```json"):
+        text = text[7:]
+    if text.startswith("```"):
+        text = text[3:]
+    if text.endswith("```"):
+        text = text[:-3]
+    items = json.loads(text.strip())
+    
+    if not isinstance(items, list):
+        raise ValueError("AI response format error: not a list")
+    return items
+
+
+_rag_service: Optional[RAGService] = None
 
 
+def get_rag_service() -> RAGService:
+    """取得全程序共用的 RAGService（FastAPI Dependency）"""
+    global _rag_service
+    if _rag_service is None:
+        _rag_service = RAGService()
+    return _rag_service
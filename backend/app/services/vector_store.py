@@ -0,0 +1,375 @@
+"""
+向量儲存後端 - PostgreSQL + pgvector
+
+RAGService 負責向量化與建議生成，資料存取委派給儲存後端：
+- PgVectorStore: PostgreSQL + pgvector（預設）
+- LocalVectorStore: 本機 NumPy 向量索引（無 Postgres 的邊緣部署，見 local_vector_store.py）
+
+兩者提供相同介面：search / nearest_ids / add / add_many / delete / delete_returning /
+find_by_hashes / stats / list_items / iter_contents / rebuild_index。
+後端由 settings.rag_backend 選擇；掃描用向量的精度由 settings.rag_embedding_storage 選擇
+（見 app.services.quantization）。
+"""
+
+import logging
+import uuid
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import select, func, text, insert, delete, tuple_
+
+from app.config import settings
+from app.db.database import session_scope
+from app.db.migrations import PROMOTED_METADATA_KEYS, promoted_values
+from app.db.models import RAGItem, RAGItemEmbedding
+from app.db.vector_index import rebuild_vector_index, search_settings
+from app.services.pagination import decode_cursor
+from app.services.quantization import validate_storage
+
+logger = logging.getLogger(__name__)
+
+
+def _filter_clauses(filters: dict) -> list:
+    """
+    將過濾條件轉為 WHERE 子句
+
+    equipment_type 與提升欄位（vendor / location）的字串值比對獨立欄位（B-tree 索引），
+    其餘鍵以 metadata @> 比對（GIN 索引）。
+    """
+    clauses = []
+    remaining = {}
+    for key, value in filters.items():
+        if key == "equipment_type" and isinstance(value, str):
+            clauses.append(RAGItem.equipment_type == value)
+        elif key in PROMOTED_METADATA_KEYS and isinstance(value, str):
+            clauses.append(getattr(RAGItem, key) == value)
+        else:
+            remaining[key] = value
+    if remaining:
+        clauses.append(RAGItem.item_metadata.contains(remaining))
+    return clauses
+
+
+def _quantized() -> bool:
+    """embedding 欄位為 halfvec，全精度向量另存於 rag_item_embeddings"""
+    return settings.rag_embedding_storage != "full"
+
+
+class PgVectorStore:
+    """PostgreSQL + pgvector 儲存後端"""
+
+    async def search(
+        self,
+        query_embedding: list[float],
+        top_k: int,
+        filters: Optional[dict] = None,
+        min_similarity: float = 0.0,
+        recall: Optional[str] = None,
+        ids: Optional[list[str]] = None,
+    ) -> list[dict]:
+        """
+        依餘弦相似度搜尋最接近的項目
+
+        :param recall: 速度/召回率等級 ("fast" / "balanced" / "accurate")，
+                       決定當次查詢的 hnsw.ef_search 或 ivfflat.probes
+        :param ids: 只在指定的候選項目中評分（混合檢索的詞彙預篩結果）
+
+        量化儲存時先以 halfvec 欄位（ANN 索引）取 top_k * rag_rerank_factor 個候選，
+        再以 rag_item_embeddings 的全精度向量計算距離、套用門檻並排序。
+        """
+        if ids is not None and not ids:
+            return []
+
+        quantized = _quantized()
+        candidates_k = top_k * max(1, settings.rag_rerank_factor) if quantized else top_k
+
+        async with session_scope() as session:
+            for statement in search_settings(candidates_k, recall, filtered=bool(filters)):
+                await session.execute(text(statement))
+
+            # 套用過濾條件 (如果有的話)，與 ANN 掃描同一查詢（索引掃描中過濾，非取回後再過濾）
+            clauses = _filter_clauses(filters) if filters else []
+            if ids is not None:
+                clauses.append(RAGItem.id.in_([uuid.UUID(i) for i in ids]))
+
+            # 使用 pgvector 的餘弦距離運算子 (<=>)，距離由資料庫計算並直接回傳，
+            # 不取回 embedding 欄位
+            distance = RAGItem.embedding.cosine_distance(query_embedding)
+            if quantized:
+                candidates = (
+                    select(RAGItem.id).where(*clauses).order_by(distance).limit(candidates_k)
+                )
+                distance = RAGItemEmbedding.embedding.cosine_distance(query_embedding)
+                clauses = [RAGItem.id.in_(candidates)]
+
+            stmt = select(
+                RAGItem.id,
+                RAGItem.equipment_type,
+                RAGItem.content,
+                RAGItem.source_type,
+                RAGItem.item_metadata,
+                distance.label("distance"),
+            ).where(*clauses)
+            if quantized:
+                stmt = stmt.join(RAGItemEmbedding, RAGItemEmbedding.item_id == RAGItem.id)
+
+            # 相似度門檻在 SQL 端過濾 (similarity = 1 - distance)
+            stmt = stmt.where(distance <= 1 - min_similarity)
+            stmt = stmt.order_by(distance).limit(top_k)
+
+            result = await session.execute(stmt)
+            # iterative scan (relaxed_order) 不保證嚴格依距離排序，取回後重新排序
+            rows = sorted(result, key=lambda row: row.distance)
+
+            return [{
+                "id": str(row.id),
+                "similarity": round(1 - float(row.distance), 4),
+                "equipment_type": row.equipment_type,
+                "content": row.content,
+                "source_type": row.source_type,
+                "metadata": row.item_metadata,
+            } for row in rows]
+
+    async def nearest_ids(
+        self,
+        embeddings: list[list[float]],
+        min_similarity: float,
+    ) -> list[Optional[str]]:
+        """
+        每個向量在知識庫中最接近的項目 id（相似度未達門檻時為 None），供入庫去重
+
+        整批以單一查詢完成：unnest 展開查詢向量，LATERAL 子查詢逐一走 ANN 索引取最近鄰。
+        量化儲存時先以 halfvec 欄位取 rag_rerank_factor 個候選，再以全精度向量判定。
+        """
+        if not embeddings:
+            return []
+
+        if _quantized():
+            nearest = """
+                SELECT e.item_id AS id, e.embedding <=> CAST(q.v AS vector) AS distance
+                FROM (
+                    SELECT r.id FROM rag_items r
+                    ORDER BY r.embedding <=> CAST(q.v AS halfvec)
+                    LIMIT :candidates
+                ) c
+                JOIN rag_item_embeddings e ON e.item_id = c.id
+                ORDER BY e.embedding <=> CAST(q.v AS vector)
+                LIMIT 1
+            """
+        else:
+            nearest = """
+                SELECT r.id, r.embedding <=> CAST(q.v AS vector) AS distance
+                FROM rag_items r
+                ORDER BY r.embedding <=> CAST(q.v AS vector)
+                LIMIT 1
+            """
+        stmt = text(f"""
+            SELECT q.ord, n.id
+            FROM unnest(CAST(:vectors AS text[])) WITH ORDINALITY AS q(v, ord)
+            CROSS JOIN LATERAL ({nearest}) n
+            WHERE n.distance <= :max_distance
+        """)
+        params = {
+            "vectors": ["[" + ",".join(map(str, e)) + "]" for e in embeddings],
+            "max_distance": 1 - min_similarity,
+            "candidates": max(1, settings.rag_rerank_factor),
+        }
+
+        matches: list[Optional[str]] = [None] * len(embeddings)
+        async with session_scope() as session:
+            for statement in search_settings(1, "fast", filtered=False):
+                await session.execute(text(statement))
+            for row in await session.execute(stmt, params):
+                matches[row.ord - 1] = str(row.id)
+        return matches
+
+    async def add(
+        self,
+        content: str,
+        equipment_type: str,
+        source_type: str,
+        embedding: list[float],
+        source_id: Optional[str] = None,
+        metadata: Optional[dict] = None,
+        content_hash: Optional[str] = None,
+    ) -> str:
+        """新增一筆項目，回傳 id"""
+        async with session_scope() as session:
+            new_item = RAGItem(
+                id=uuid.uuid4(),
+                content=content,
+                content_hash=content_hash,
+                equipment_type=equipment_type,
+                source_type=source_type,
+                source_id=source_id,
+                embedding=embedding,
+                item_metadata=metadata or {},
+                **promoted_values(metadata or {}),
+            )
+            session.add(new_item)
+            if _quantized():
+                await session.flush()
+                session.add(RAGItemEmbedding(item_id=new_item.id, embedding=embedding))
+            await session.commit()
+            return str(new_item.id)
+
+    async def add_many(self, items: list[dict]) -> list[str]:
+        """以單一交易、多列 INSERT 新增多筆項目，回傳 id（與輸入順序一致）"""
+        if not items:
+            return []
+
+        rows = [{
+            "id": uuid.uuid4(),
+            "content": item["content"],
+            "content_hash": item.get("content_hash"),
+            "equipment_type": item["equipment_type"],
+            "source_type": item["source_type"],
+            "source_id": item.get("source_id"),
+            "embedding": item["embedding"],
+            "item_metadata": item.get("metadata") or {},
+            **promoted_values(item.get("metadata") or {}),
+            "created_at": datetime.utcnow(),
+        } for item in items]
+
+        async with session_scope() as session:
+            await session.execute(insert(RAGItem), rows)
+            if _quantized():
+                await session.execute(insert(RAGItemEmbedding), [
+                    {"item_id": row["id"], "embedding": row["embedding"]} for row in rows
+                ])
+            await session.commit()
+
+        return [str(row["id"]) for row in rows]
+
+    async def delete(self, item_id: str) -> bool:
+        """刪除項目，不存在時回傳 False"""
+        return await self.delete_returning(item_id) is not None
+
+    async def delete_returning(self, item_id: str) -> Optional[dict]:
+        """刪除項目並回傳其 source_type / equipment_type（供統計增減），不存在時回傳 None"""
+        async with session_scope() as session:
+            result = await session.execute(
+                delete(RAGItem)
+                .where(RAGItem.id == uuid.UUID(item_id))
+                .returning(RAGItem.source_type, RAGItem.equipment_type)
+            )
+            row = result.first()
+            await session.commit()
+            if row is None:
+                return None
+            return {"source_type": row.source_type, "equipment_type": row.equipment_type}
+
+    async def find_by_hashes(self, hashes: list[str]) -> dict[str, str]:
+        """依內容雜湊查詢既有項目，回傳 {content_hash: id}"""
+        if not hashes:
+            return {}
+        async with session_scope() as session:
+            result = await session.execute(
+                select(RAGItem.content_hash, RAGItem.id)
+                .where(RAGItem.content_hash.in_(set(hashes)))
+                .order_by(RAGItem.created_at)
+            )
+            found: dict[str, str] = {}
+            for row in result:
+                found.setdefault(row.content_hash, str(row.id))
+            return found
+
+    async def stats(self) -> dict:
+        """知識庫統計"""
+        async with session_scope() as session:
+            # 總數
+            total = await session.scalar(select(func.count()).select_from(RAGItem))
+
+            # 來源統計
+            src_result = await session.execute(
+                select(RAGItem.source_type, func.count(RAGItem.id))
+                .group_by(RAGItem.source_type)
+            )
+            by_source = dict(src_result.all())
+
+            # 設備統計
+            eq_result = await session.execute(
+                select(RAGItem.equipment_type, func.count(RAGItem.id))
+                .group_by(RAGItem.equipment_type)
+            )
+            by_equipment = dict(eq_result.all())
+
+            return {
+                "total": total,
+                "by_source": by_source,
+                "by_equipment": by_equipment,
+            }
+
+    async def rebuild_index(self, index_type: Optional[str] = None) -> dict:
+        """重建 ANN 索引（大量匯入後使用）"""
+        return await rebuild_vector_index(index_type)
+
+    async def list_items(
+        self,
+        skip: int = 0,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+    ) -> list[dict]:
+        """
+        依建立時間新到舊列出項目（只取回列表欄位，不含 embedding）
+
+        :param cursor: 上一頁最後一筆的游標（見 app.services.pagination）；
+                       指定時以 keyset 分頁取代 OFFSET
+        """
+        async with session_scope() as session:
+            stmt = select(
+                RAGItem.id,
+                RAGItem.equipment_type,
+                RAGItem.content,
+                RAGItem.source_type,
+                RAGItem.source_id,
+                RAGItem.item_metadata,
+                RAGItem.created_at,
+            ).order_by(RAGItem.created_at.desc(), RAGItem.id.desc())
+
+            if cursor:
+                created_at, item_id = decode_cursor(cursor)
+                stmt = stmt.where(
+                    tuple_(RAGItem.created_at, RAGItem.id)
+                    < tuple_(datetime.fromisoformat(created_at), uuid.UUID(item_id))
+                )
+            elif skip:
+                stmt = stmt.offset(skip)
+
+            result = await session.execute(stmt.limit(limit))
+
+            return [{
+                "id": str(row.id),
+                "equipment_type": row.equipment_type,
+                "content": row.content,
+                "source_type": row.source_type,
+                "source_id": row.source_id,
+                "metadata": row.item_metadata,
+                "created_at": row.created_at.isoformat() if row.created_at else None,
+            } for row in result]
+
+    async def iter_contents(self, batch_size: int = 1000) -> AsyncIterator[tuple[str, str]]:
+        """串流讀取所有項目的 (id, content)，供建立詞彙索引"""
+        async with session_scope() as session:
+            result = await session.stream(
+                select(RAGItem.id, RAGItem.content).execution_options(yield_per=batch_size)
+            )
+            async for row in result:
+                yield str(row.id), row.content
+
+
+def create_vector_store(backend: Optional[str] = None):
+    """依 settings.rag_backend 建立儲存後端（"pgvector" 或 "local"）"""
+    backend = backend or settings.rag_backend
+    if backend == "pgvector":
+        validate_storage(settings.rag_embedding_storage, backend)
+        return PgVectorStore()
+    if backend == "local":
+        from app.services.local_vector_store import LocalVectorStore
+        return LocalVectorStore(
+            index_dir=settings.rag_local_index_dir,
+            dimension=settings.embedding_dimension,
+            storage=settings.rag_embedding_storage,
+            rerank_factor=settings.rag_rerank_factor,
+        )
+    raise ValueError(f"Unknown RAG backend: {backend}")
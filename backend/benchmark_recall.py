@@ -0,0 +1,112 @@
+"""
+量化儲存召回率量測
+
+以 LocalVectorStore 比較 full / halfvec / int8 三種儲存精度：以 float32 精確搜尋為基準，
+計算 recall@k（不重排序，以及重排序 top_k * rerank_factor 個候選）、每列掃描用向量的
+記憶體與平均查詢延遲。halfvec 的量化誤差與 pgvector halfvec 欄位相同，可作為調整
+RAG_EMBEDDING_STORAGE / RAG_RERANK_FACTOR 的依據。
+
+向量預設為模擬 embedding 分佈的合成資料（群聚 + 雜訊）；也可用 --vectors 指定實際
+embedding 的 .npy 檔（n × dim float32），查詢取自資料集中的向量加上擾動。
+
+用法:
+    python benchmark_recall.py
+    python benchmark_recall.py --rows 200000 --queries 500 --top-k 10
+    python benchmark_recall.py --vectors data/embeddings.npy --rerank-factor 2 4 8
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+
+import numpy as np
+
+from app.services.local_vector_store import LocalVectorStore
+from app.services.quantization import EMBEDDING_STORAGES, bytes_per_vector
+
+
+def synthetic_vectors(rows: int, dimension: int, clusters: int, seed: int) -> np.ndarray:
+    """群聚分佈的合成向量（embedding 通常集中在少數語意方向）"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    labels = rng.integers(0, clusters, rows)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((rows, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_queries(vectors: np.ndarray, count: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed + 1)
+    picks = vectors[rng.integers(0, len(vectors), count)]
+    queries = picks + 0.3 * rng.standard_normal(picks.shape).astype(np.float32) / np.sqrt(vectors.shape[1])
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+async def build_store(index_dir: str, vectors: np.ndarray, storage: str, rerank_factor: int) -> LocalVectorStore:
+    store = LocalVectorStore(index_dir, vectors.shape[1], storage=storage, rerank_factor=rerank_factor)
+    if (await store.stats())["total"] == 0:
+        for start in range(0, len(vectors), 5000):
+            batch = vectors[start:start + 5000]
+            await store.add_many([{
+                "content": f"item {start + i}",
+                "equipment_type": "benchmark",
+                "source_type": "benchmark",
+                "embedding": vector,
+            } for i, vector in enumerate(batch)])
+    return store
+
+
+async def run(args):
+    if args.vectors:
+        vectors = np.load(args.vectors).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    else:
+        vectors = synthetic_vectors(args.rows, args.dimension, args.clusters, args.seed)
+    queries = make_queries(vectors, args.queries, args.seed)
+    dimension = vectors.shape[1]
+    print(f"{len(vectors)} vectors × {dimension} dims, {len(queries)} queries, top_k={args.top_k}")
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        # 基準：float32 精確搜尋（同一索引目錄，之後各設定重新開啟時由 float32 檔建立量化矩陣）
+        baseline = await build_store(index_dir, vectors, "full", 1)
+        truth = []
+        for query in queries:
+            results = await baseline.search(query.tolist(), args.top_k)
+            truth.append({r["id"] for r in results})
+        baseline.close()
+
+        print(f"{'storage':<8} {'rerank':>6} {'recall@k':>9} {'bytes/row':>10} {'ms/query':>9}")
+        for storage in EMBEDDING_STORAGES:
+            factors = [1] if storage == "full" else [1, *args.rerank_factor]
+            for factor in factors:
+                store = await build_store(index_dir, vectors, storage, factor)
+                hits = 0
+                start = time.perf_counter()
+                for query, expected in zip(queries, truth):
+                    results = await store.search(query.tolist(), args.top_k)
+                    hits += len(expected & {r["id"] for r in results})
+                elapsed = (time.perf_counter() - start) / len(queries) * 1000
+                recall = hits / (len(queries) * args.top_k)
+                print(
+                    f"{storage:<8} {factor:>6} {recall:>9.4f} "
+                    f"{bytes_per_vector(storage, dimension):>10} {elapsed:>9.2f}"
+                )
+                store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量化儲存召回率量測")
+    parser.add_argument("--vectors", help="實際 embedding 的 .npy 檔 (n × dim float32)")
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--rerank-factor", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
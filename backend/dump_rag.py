@@ -1,20 +1,21 @@
 
 import asyncio
-from sqlalchemy import select
-from app.db.database import async_session_maker
-from app.db.models import RAGItem
+from app.services.pagination import iter_all_items
+from app.services.vector_store import create_vector_store
 
 async def dump_rag_items():
-    async with async_session_maker() as session:
-        result = await session.execute(select(RAGItem))
-        items = result.scalars().all()
-        print(f"\n\n=== TOTAL ITEMS: {len(items)} ===")
-        for i, item in enumerate(items):
-            print(f"Item #{i+1}")
-            print(f"Type: {item.equipment_type}")
-            print(f"Content Start: {item.content[:50]}...")
-            print("-" * 20)
-        print("=== END DUMP ===\n\n")
+    # keyset 分頁逐批讀取，只取回列表欄位（不含 embedding）
+    store = create_vector_store()
+    total = 0
+    print("\n\n=== RAG ITEMS ===")
+    async for item in iter_all_items(store):
+        total += 1
+        print(f"Item #{total}")
+        print(f"Type: {item['equipment_type']}")
+        print(f"Content Start: {item['content'][:50]}...")
+        print("-" * 20)
+    print(f"=== TOTAL ITEMS: {total} ===")
+    print("=== END DUMP ===\n\n")
 
 if __name__ == "__main__":
     import logging
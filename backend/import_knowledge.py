@@ -1,72 +1,306 @@
+"""
+知識庫批次匯入工具
 
+從 JSON 陣列或 NDJSON (每行一筆) 檔案串流讀取知識項目，分批並行送到
+/api/rag/bulk-add。支援中斷續傳：每完成一段連續批次即寫入 checkpoint，
+重新執行時自動從上次完成的位置繼續。checkpoint 記錄來源檔案路徑、大小與修改時間，
+來源檔案已變更時拒絕續傳（避免以舊位置跳過新內容），需刪除 checkpoint 或指定 --resume-from。
+
+用法:
+    python import_knowledge.py data/knowledge_template.json
+    python import_knowledge.py manual.ndjson --batch-size 200 --workers 4
+    python import_knowledge.py manual.ndjson --resume-from 12000
+"""
+
+import argparse
 import json
-import requests
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from itertools import islice
+
+import requests
 
 # API URL (預設為本地後端)
-API_URL = "http://localhost:8000/api/rag/add"
+API_URL = "http://localhost:8000/api/rag/bulk-add"
+
+_READ_CHUNK = 64 * 1024
+
+
+def _iter_ndjson(f):
+    """逐行讀取 NDJSON"""
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def _iter_json_array(f):
+    """增量解析大型 JSON 陣列，不一次載入整個檔案"""
+    decoder = json.JSONDecoder()
+    buf = ""
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buf, eof
+        chunk = f.read(_READ_CHUNK)
+        if not chunk:
+            eof = True
+            return False
+        buf += chunk
+        return True
+
+    # 找到陣列開頭 '['
+    while not buf.lstrip():
+        if not fill():
+            return
+    buf = buf.lstrip()
+    if not buf.startswith("["):
+        raise ValueError("JSON 檔案最外層必須是陣列")
+    buf = buf[1:]
+
+    while True:
+        buf = buf.lstrip().lstrip(",").lstrip()
+        if not buf:
+            if not fill():
+                raise ValueError("JSON 陣列未正確結束")
+            continue
+        if buf.startswith("]"):
+            return
+        try:
+            obj, end = decoder.raw_decode(buf)
+        except json.JSONDecodeError:
+            if eof or not fill():
+                raise
+            continue
+        if end == len(buf) and not eof:
+            # 數值等純量可能在讀取邊界被截斷（例如 12|34），補讀後重新解析
+            fill()
+            continue
+        yield obj
+        buf = buf[end:]
+
+
+def iter_records(file_path):
+    """依檔案格式串流讀取記錄（.ndjson/.jsonl 或以 '[' 開頭者視為 JSON 陣列）"""
+    with open(file_path, "r", encoding="utf-8") as f:
+        if file_path.endswith((".ndjson", ".jsonl")):
+            yield from _iter_ndjson(f)
+            return
+
+        head = f.read(_READ_CHUNK)
+        f.seek(0)
+        if head.lstrip().startswith("["):
+            yield from _iter_json_array(f)
+        else:
+            yield from _iter_ndjson(f)
+
+
+def _iter_batches(records, batch_size, start_offset):
+    """略過已完成的記錄，依序產生 (批次序號, 起始位置, payload 列表)"""
+    records = islice(records, start_offset, None)
+    batch_no = 0
+    offset = start_offset
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        items = [{
+            "equipment_type": item.get("equipment_type", "Unknown"),
+            "content": item.get("content", ""),
+            "source_type": "document",  # 標記為文件導入
+            "source_id": f"import_{offset + i + 1}",
+            "metadata": item.get("metadata", {}),
+        } for i, item in enumerate(batch)]
+        yield batch_no, offset, items
+        batch_no += 1
+        offset += len(batch)
+
+
+class CheckpointMismatch(Exception):
+    """checkpoint 與目前的來源檔案不符，不可續傳"""
+
+
+def _source_fingerprint(file_path):
+    """來源檔案的路徑、大小與修改時間（判斷 checkpoint 是否仍適用）"""
+    stat = os.stat(file_path)
+    return {
+        "source": os.path.abspath(file_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
 
-def import_knowledge(json_file_path):
+def _load_checkpoint(checkpoint_path, file_path):
+    """讀取續傳位置；checkpoint 記錄的來源檔案與目前檔案不符時拋出 CheckpointMismatch"""
+    if not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+
+    expected = _source_fingerprint(file_path)
+    recorded = {key: checkpoint.get(key) for key in expected}
+    if recorded != expected:
+        changed = ", ".join(key for key in expected if recorded[key] != expected[key])
+        raise CheckpointMismatch(
+            f"checkpoint {checkpoint_path} 與來源檔案不符（{changed}），"
+            f"請刪除 checkpoint 或以 --resume-from 指定起始位置"
+        )
+    return int(checkpoint.get("offset", 0))
+
+
+def _save_checkpoint(checkpoint_path, file_path, offset):
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            **_source_fingerprint(file_path),
+            "offset": offset,
+            "updated_at": datetime.now().isoformat(),
+        }, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def _send_batch(session, api_url, items, retries):
+    """送出一個批次，失敗時以指數退避重試"""
+    for attempt in range(retries + 1):
+        try:
+            response = session.post(api_url, json={"items": items}, timeout=300)
+            if response.status_code == 200:
+                return response.json().get("count", len(items))
+            error = f"{response.status_code} - {response.text[:200]}"
+        except requests.RequestException as e:
+            error = str(e)
+        if attempt < retries:
+            time.sleep(2 ** attempt)
+    raise RuntimeError(error)
+
+
+def import_knowledge(
+    json_file_path,
+    api_url=API_URL,
+    batch_size=100,
+    workers=4,
+    retries=3,
+    resume_from=None,
+    checkpoint_path=None,
+):
     """
-    從 JSON 文件導入知識到 RAG 系統
+    從 JSON / NDJSON 文件串流導入知識到 RAG 系統
     """
     if not os.path.exists(json_file_path):
         print(f"❌ 錯誤: 找不到文件 {json_file_path}")
-        return
+        return False
+
+    checkpoint_path = checkpoint_path or f"{json_file_path}.checkpoint.json"
+    if resume_from is not None:
+        start_offset = resume_from
+    else:
+        try:
+            start_offset = _load_checkpoint(checkpoint_path, json_file_path)
+        except CheckpointMismatch as e:
+            print(f"❌ 錯誤: {e}")
+            return False
+    if start_offset:
+        print(f"⏩ 從第 {start_offset + 1} 筆繼續導入")
+
+    success_count = 0
+    fail_count = 0
+    committed = start_offset   # 已連續完成的記錄位置（寫入 checkpoint）
+    done_batches = {}          # 已完成但尚未連續的批次: batch_no -> 結束位置
+    next_batch = 0
+    started = time.time()
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
 
     try:
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            
-        print(f"📦 準備導入 {len(data)} 筆資料...")
-        
-        success_count = 0
-        fail_count = 0
-        
-        for i, item in enumerate(data):
-            try:
-                # 準備 payload
-                payload = {
-                    "equipment_type": item.get("equipment_type", "Unknown"),
-                    "content": item.get("content", ""),
-                    "source_type": "document",  # 標記為文件導入
-                    "source_id": f"import_{i+1}",
-                    "metadata": item.get("metadata", {})
-                }
-                
-                # 發送請求
-                response = requests.post(API_URL, json=payload)
-                
-                if response.status_code == 200:
-                    print(f"✅ [{i+1}/{len(data)}] 成功: {item.get('equipment_type')} - {item.get('content')[:20]}...")
-                    success_count += 1
-                else:
-                    print(f"❌ [{i+1}/{len(data)}] 失敗: {response.status_code} - {response.text}")
-                    fail_count += 1
-                    
-            except Exception as e:
-                print(f"❌ [{i+1}/{len(data)}] 請求錯誤: {e}")
-                fail_count += 1
-        
+        batches = _iter_batches(iter_records(json_file_path), batch_size, start_offset)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+
+            def submit_next() -> bool:
+                try:
+                    batch_no, offset, items = next(batches)
+                except StopIteration:
+                    return False
+                future = executor.submit(_send_batch, session, api_url, items, retries)
+                pending[future] = (batch_no, offset, len(items))
+                return True
+
+            # 同時在途的批次數有上限，記憶體用量不隨檔案大小成長
+            for _ in range(workers * 2):
+                if not submit_next():
+                    break
+
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    batch_no, offset, size = pending.pop(future)
+                    try:
+                        success_count += future.result()
+                        done_batches[batch_no] = offset + size
+                        print(f"✅ 批次 #{batch_no + 1} 成功: 第 {offset + 1}-{offset + size} 筆")
+                    except Exception as e:
+                        fail_count += size
+                        print(f"❌ 批次 #{batch_no + 1} 失敗 (第 {offset + 1}-{offset + size} 筆): {e}")
+
+                    submit_next()
+
+                # 只推進連續完成的批次，確保續傳不會跳過失敗的資料
+                while next_batch in done_batches:
+                    committed = done_batches.pop(next_batch)
+                    next_batch += 1
+                _save_checkpoint(checkpoint_path, json_file_path, committed)
+
+                if fail_count:
+                    # 有批次失敗時停止送出新批次，等待在途批次完成後結束
+                    batches = iter(())
+
+        elapsed = time.time() - started
         print("\n" + "="*30)
-        print(f"🎉 導入完成!")
+        print(f"🎉 導入完成!" if not fail_count else "⚠️ 導入中斷")
         print(f"   成功: {success_count}")
         print(f"   失敗: {fail_count}")
+        print(f"   耗時: {elapsed:.1f} 秒")
+        print(f"   checkpoint: {checkpoint_path} (offset={committed})")
         print("="*30)
-        
-    except json.JSONDecodeError:
-        print(f"❌ 錯誤: JSON 格式無效")
+
+        if not fail_count and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        return fail_count == 0
+
+    except json.JSONDecodeError as e:
+        print(f"❌ 錯誤: JSON 格式無效 ({e})")
     except Exception as e:
         print(f"❌ 系統錯誤: {e}")
+    return False
+
 
 if __name__ == "__main__":
-    # 使用範例文件路徑，或讓用戶輸入
     default_path = os.path.join(os.path.dirname(__file__), "data", "knowledge_template.json")
-    
-    file_path = default_path
-    if len(sys.argv) > 1:
-        file_path = sys.argv[1]
-    
-    print(f"正在讀取檔案: {file_path}")
-    import_knowledge(file_path)
+
+    parser = argparse.ArgumentParser(description="批次匯入知識到 RAG 知識庫")
+    parser.add_argument("file", nargs="?", default=default_path, help="JSON 陣列或 NDJSON 檔案")
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--batch-size", type=int, default=100, help="每批筆數")
+    parser.add_argument("--workers", type=int, default=4, help="同時送出的批次數")
+    parser.add_argument("--retries", type=int, default=3, help="批次失敗重試次數")
+    parser.add_argument("--resume-from", type=int, default=None, help="從指定筆數位置開始（覆蓋 checkpoint）")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint 檔案路徑")
+    args = parser.parse_args()
+
+    print(f"正在讀取檔案: {args.file}")
+    ok = import_knowledge(
+        args.file,
+        api_url=args.api_url,
+        batch_size=max(1, args.batch_size),
+        workers=max(1, args.workers),
+        retries=max(0, args.retries),
+        resume_from=args.resume_from,
+        checkpoint_path=args.checkpoint,
+    )
+    sys.exit(0 if ok else 1)
@@ -7,7 +7,9 @@
 3. 預覽回填
 4. 執行回填（Excel / Word）
 5. 輔助方法（欄位類型推測、佔位符識別、值轉換）
-6. API 端點整合測試
+6. 已解析模板快取
+7. xlsx / docx 直接 XML 修補（快速回填路徑）
+8. API 端點整合測試
 
 注意：AI 映射 (map_fields) 需要 Gemini API Key，故以 mock 方式測試。
 """
@@ -22,6 +24,7 @@ import pytest
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
 from openpyxl import Workbook
+from openpyxl.styles import Font
 from openpyxl.utils import get_column_letter
 from docx import Document
 
@@ -571,6 +574,59 @@ class TestExcelAutoFill:
         )
         assert len(filled_bytes) > 0
 
+    @pytest.mark.asyncio
+    async def test_fill_merged_cells_resolved_with_index(self, monkeypatch):
+        """寫入合併格時改寫左上角；每個工作表的合併索引只建立一次"""
+        from openpyxl import load_workbook as lw
+        from app.autofill_core import ExcelAutoFillEngine, excel_engine
+
+        wb = Workbook()
+        ws = wb.active
+        ws.title = "表單"
+        for row in range(1, 41):
+            ws.cell(row=row, column=1, value=f"欄位{row}：")
+            ws.merge_cells(start_row=row, start_column=2, end_row=row, end_column=4)
+        output = io.BytesIO()
+        wb.save(output)
+
+        builds = []
+        build = excel_engine.build_merge_lookup
+
+        def counting_build(worksheet):
+            builds.append(worksheet.title)
+            return build(worksheet)
+
+        monkeypatch.setattr(excel_engine, "build_merge_lookup", counting_build)
+
+        field_lookup = {
+            f"f{row}": {"field_type": "text", "value_location": {"sheet": "表單", "cell": f"C{row}"}}
+            for row in range(1, 41)
+        }
+        value_lookup = {f"f{row}": f"值{row}" for row in range(1, 41)}
+        engine = ExcelAutoFillEngine(xml_patch=False)
+        filled = await engine.fill(output.getvalue(), field_lookup, value_lookup)
+
+        assert builds == ["表單"]
+        ws = lw(io.BytesIO(filled))["表單"]
+        assert ws["B1"].value == "值1"
+        assert ws["B40"].value == "值40"
+        assert ws["C1"].value is None
+
+    def test_merge_lookup_top_left(self):
+        """合併索引：範圍內任一座標（含小寫、絕對參照）對應左上角"""
+        from app.autofill_core import build_merge_lookup, merged_top_left
+
+        wb = Workbook()
+        ws = wb.active
+        ws.merge_cells("B2:D5")
+        lookup = build_merge_lookup(ws)
+
+        assert lookup["C4"] == {"range": "B2:D5", "top_left": "B2", "rows": 4, "cols": 3}
+        assert merged_top_left(lookup, "D5") == "B2"
+        assert merged_top_left(lookup, "$c$3") == "B2"
+        assert merged_top_left(lookup, "E5") is None
+        assert merged_top_left(lookup, "not-a-cell") is None
+
 
 # ================================================================
 # Word 回填執行測試
@@ -639,6 +695,398 @@ class TestWordAutoFill:
             assert len(doc.tables) >= 1
 
 
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("xml_patch", [False, True])
+    async def test_document_index_built_once(self, monkeypatch, xml_patch):
+        """段落清單與表格格線每份文件只建立一次，不隨欄位數重建"""
+        from docx.blkcntnr import BlockItemContainer
+        from docx.table import Table
+        from app.autofill_core import WordAutoFillEngine
+
+        doc = Document()
+        for i in range(30):
+            doc.add_paragraph(f"欄位{i}：")
+        table = doc.add_table(rows=30, cols=2)
+        table.cell(0, 0).merge(table.cell(1, 0))
+        output = io.BytesIO()
+        doc.save(output)
+
+        builds = {"paragraphs": 0, "cells": 0}
+        paragraphs, cells = BlockItemContainer.paragraphs, Table._cells
+
+        def counting(name, prop):
+            def getter(self):
+                if name != "paragraphs" or not hasattr(self, "_tc"):  # 儲存格內段落不計
+                    builds[name] += 1
+                return prop.fget(self)
+            return property(getter)
+
+        monkeypatch.setattr(BlockItemContainer, "paragraphs", counting("paragraphs", paragraphs))
+        monkeypatch.setattr(Table, "_cells", counting("cells", cells))
+
+        field_lookup, value_lookup = {}, {}
+        for i in range(30):
+            field_lookup[f"p{i}"] = {"value_location": {"type": "paragraph", "paragraph_index": i}}
+            field_lookup[f"t{i}"] = {"value_location": {
+                "type": "table", "table_index": 0, "row_index": i, "cell_index": 1}}
+            value_lookup[f"p{i}"] = f"段落{i}"
+            value_lookup[f"t{i}"] = f"儲存格{i}"
+        field_lookup["merged"] = {"value_location": {
+            "type": "table", "table_index": 0, "row_index": 1, "cell_index": 0}}
+        value_lookup["merged"] = "合併格"
+
+        filled = await WordAutoFillEngine().fill(output.getvalue(), field_lookup, value_lookup, xml_patch=xml_patch)
+
+        assert builds == {"paragraphs": 1, "cells": 1}
+        monkeypatch.undo()
+        result = Document(io.BytesIO(filled))
+        assert result.paragraphs[29].text == "欄位29： 段落29"
+        assert result.tables[0].cell(29, 1).text == "儲存格29"
+        assert result.tables[0].cell(0, 0).text == "合併格"
+
+
+    @pytest.mark.asyncio
+    async def test_cell_grid_falls_back_to_public_api(self, monkeypatch):
+        """python-docx 內部 Table._cells 不可用時，改以 row.cells 建立格線，結果相同"""
+        from app.autofill_core import WordAutoFillEngine, word_engine
+
+        doc = Document()
+        table = doc.add_table(rows=3, cols=3)
+        table.cell(0, 1).merge(table.cell(0, 2))
+        output = io.BytesIO()
+        doc.save(output)
+
+        field_lookup = {
+            f"r{r}c{c}": {"value_location": {"type": "table", "table_index": 0, "row_index": r, "cell_index": c}}
+            for r, c in [(0, 0), (0, 2), (2, 1), (5, 0)]
+        }
+        value_lookup = {field_id: field_id for field_id in field_lookup}
+        expected = await WordAutoFillEngine().fill(output.getvalue(), field_lookup, value_lookup)
+
+        monkeypatch.setattr(word_engine, "_internal_cells", lambda table: None)
+        filled = await WordAutoFillEngine().fill(output.getvalue(), field_lookup, value_lookup)
+
+        texts = [[c.text for c in row.cells] for row in Document(io.BytesIO(filled)).tables[0].rows]
+        assert texts == [[c.text for c in row.cells] for row in Document(io.BytesIO(expected)).tables[0].rows]
+        assert texts == [["r0c0", "r0c2", "r0c2"], ["", "", ""], ["", "r2c1", ""]]
+
+
+# ================================================================
+# 已解析模板快取
+# ================================================================
+
+class TestTemplateCache:
+    """測試已解析模板快取：重複回填同一模板不重新解析，且每次回填互不影響"""
+
+    @staticmethod
+    def _cell_field(cell: str, field_type: str = "text") -> dict:
+        return {"field_type": field_type, "value_location": {"sheet": "定檢表", "cell": cell}}
+
+    @pytest.mark.asyncio
+    async def test_repeated_excel_fills_are_independent(self):
+        from openpyxl import load_workbook as lw
+        from app.autofill_core import ExcelAutoFillEngine, TemplateCache
+
+        cache = TemplateCache()
+        engine = ExcelAutoFillEngine(cache, xml_patch=False)
+        content = create_test_excel_simple()
+        field_lookup = {"name": self._cell_field("B1"), "temp": self._cell_field("B5", "number")}
+
+        first = await engine.fill(content, field_lookup, {"name": "馬達 A-01"})
+        second = await engine.fill(content, field_lookup, {"temp": "65.5"})
+
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+        ws = lw(io.BytesIO(first))["定檢表"]
+        assert ws["B1"].value == "馬達 A-01" and ws["B5"].value == "______"
+        ws = lw(io.BytesIO(second))["定檢表"]
+        assert ws["B1"].value == "______" and ws["B5"].value == 65.5
+
+    @pytest.mark.asyncio
+    async def test_repeated_word_fills_are_independent(self):
+        from app.autofill_core import TemplateCache, WordAutoFillEngine
+
+        cache = TemplateCache()
+        engine = WordAutoFillEngine(cache, xml_patch=False)
+        content = create_test_word_simple()
+        field_lookup = {
+            "name": {"value_location": {"type": "paragraph", "paragraph_index": 0}},
+            "date": {"value_location": {"type": "paragraph", "paragraph_index": 1}},
+        }
+
+        first = await engine.fill(content, field_lookup, {"name": "馬達 B-02"})
+        second = await engine.fill(content, field_lookup, {"date": "2026-01-01"})
+
+        assert cache.stats()["hits"] == 1
+        paragraphs = Document(io.BytesIO(first)).paragraphs
+        assert "馬達 B-02" in paragraphs[0].text and "2026" not in paragraphs[1].text
+        paragraphs = Document(io.BytesIO(second)).paragraphs
+        assert "馬達" not in paragraphs[0].text and "2026-01-01" in paragraphs[1].text
+
+    def test_lru_eviction_by_entries_and_bytes(self):
+        from app.autofill_core import TemplateCache
+
+        templates = []
+        for i in range(3):
+            wb = Workbook()
+            wb.active["A1"] = f"模板 {i}"
+            output = io.BytesIO()
+            wb.save(output)
+            templates.append(output.getvalue())
+
+        cache = TemplateCache(max_entries=2)
+        cache.workbook(templates[0])
+        cache.workbook(templates[1])
+        cache.workbook(templates[0])  # 0 成為最近使用
+        cache.workbook(templates[2])  # 淘汰 1
+        assert cache.stats()["entries"] == 2
+        assert cache.workbook(templates[0]).active["A1"].value == "模板 0"
+        cache.workbook(templates[1])
+        assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 4
+
+        snapshot_size = cache.stats()["bytes"] // 2
+        small = TemplateCache(max_bytes=snapshot_size + snapshot_size // 2)
+        small.workbook(templates[0])
+        small.workbook(templates[1])
+        assert small.stats()["entries"] == 1
+
+        # docx 以未壓縮大小（快照與解析物件兩份）計算，而非 zip 檔大小
+        import zipfile
+        document = create_test_word_simple()
+        with zipfile.ZipFile(io.BytesIO(document)) as zf:
+            estimate = 2 * sum(info.file_size for info in zf.infolist())
+        assert estimate > len(document)
+        too_small = TemplateCache(max_bytes=estimate - 1)
+        too_small.document(document)
+        assert too_small.stats()["entries"] == 0
+        fits = TemplateCache(max_bytes=estimate)
+        fits.document(document)
+        assert fits.stats()["bytes"] == estimate
+
+        disabled = TemplateCache(max_entries=0)
+        disabled.workbook(templates[0])
+        disabled.workbook(templates[0])
+        assert disabled.stats()["entries"] == 0 and disabled.stats()["hits"] == 0
+
+
+# ================================================================
+# xlsx 直接 XML 修補
+# ================================================================
+
+class TestXlsxPatch:
+    """測試 xlsx 快速回填路徑：結果與 openpyxl 一致、未改動的 zip 成員原樣保留"""
+
+    @staticmethod
+    def _members(content: bytes) -> dict[str, bytes]:
+        import zipfile
+        with zipfile.ZipFile(io.BytesIO(content)) as zf:
+            return {name: zf.read(name) for name in zf.namelist()}
+
+    @staticmethod
+    def _template() -> bytes:
+        wb = Workbook()
+        ws = wb.active
+        ws.title = "表單"
+        ws["A1"] = "設備名稱："
+        ws["B1"] = "______"
+        ws["B1"].font = Font(bold=True)
+        ws["A3"] = "溫度："
+        ws["B3"].number_format = "0.00"
+        ws["D3"] = "備註"
+        ws.merge_cells("B5:D6")
+        ws["A8"] = "=SUM(B3:C3)"
+        wb.create_sheet("附件")["A1"] = "不改動"
+        output = io.BytesIO()
+        wb.save(output)
+        return output.getvalue()
+
+    @pytest.mark.asyncio
+    async def test_fast_path_matches_openpyxl(self, monkeypatch):
+        from openpyxl import load_workbook as lw
+        from app.autofill_core import ExcelAutoFillEngine, excel_engine
+
+        def fail_load(*args, **kwargs):
+            raise AssertionError("fast path should not load the workbook with openpyxl")
+
+        field_lookup = {
+            "name": {"field_type": "text", "value_location": {"sheet": "表單", "cell": "B1"}},
+            "temp": {"field_type": "number", "value_location": {"sheet": "表單", "cell": "b3"}},
+            "note": {"field_type": "text", "value_location": {"sheet": "表單", "cell": "C3"}},
+            "merged": {"field_type": "text", "value_location": {"sheet": "表單", "cell": "C6"}},
+            "new_row": {"field_type": "checkbox", "value_location": {"sheet": "表單", "cell": "$B$4"}},
+            "label": {"field_type": "text", "label_location": {"sheet": "表單", "cell": "A10"}},
+            "missing": {"field_type": "text", "value_location": {"sheet": "不存在", "cell": "A1"}},
+        }
+        value_lookup = {
+            "name": "馬達 A-01", "temp": "65.5", "note": " 需複檢 ", "merged": "合併格",
+            "new_row": True, "label": "標籤格", "missing": "略過",
+        }
+        content = self._template()
+
+        expected = await ExcelAutoFillEngine(xml_patch=False).fill(content, field_lookup, value_lookup)
+        monkeypatch.setattr(excel_engine, "load_workbook", fail_load)
+        filled = await ExcelAutoFillEngine().fill(content, field_lookup, value_lookup)
+
+        fast, slow = lw(io.BytesIO(filled)), lw(io.BytesIO(expected))
+        for name in ("表單", "附件"):
+            assert [[c.value for c in row] for row in fast[name].iter_rows()] == \
+                [[c.value for c in row] for row in slow[name].iter_rows()]
+        ws = fast["表單"]
+        assert ws["B1"].value == "馬達 A-01" and ws["B1"].font.bold
+        assert ws["B3"].value == 65.5 and ws["B3"].number_format == "0.00"
+        assert ws["C3"].value == " 需複檢 "
+        assert ws["B5"].value == "合併格" and "B5:D6" in ws.merged_cells
+        assert ws["B4"].value == "合格" and ws["A10"].value == "標籤格"
+        assert ws["A8"].value == "=SUM(B3:C3)"
+
+        before, after = self._members(content), self._members(filled)
+        assert before.keys() == after.keys()
+        changed = {name for name in before if before[name] != after[name]}
+        assert changed == {"xl/worksheets/sheet1.xml"}
+
+    @staticmethod
+    def _as_saved_by_excel(content: bytes) -> bytes:
+        """模擬 Excel 存檔：公式帶快取值、workbook.xml 未要求開啟時重算"""
+        import re
+        import zipfile
+
+        output = io.BytesIO()
+        with zipfile.ZipFile(io.BytesIO(content)) as zin, zipfile.ZipFile(output, "w") as zout:
+            for info in zin.infolist():
+                data = zin.read(info)
+                if info.filename == "xl/workbook.xml":
+                    data = re.sub(rb"<calcPr[^>]*/>", b"", data)
+                elif info.filename == "xl/worksheets/sheet1.xml":
+                    data = data.replace(b"<f>SUM(B3:C3)</f><v></v>", b"<f>SUM(B3:C3)</f><v>10</v>")
+                zout.writestr(info, data)
+        return output.getvalue()
+
+    @pytest.mark.parametrize("sheet, cell", [("表單", "B3"), ("附件", "B1")])
+    def test_formulas_recalculated_on_load(self, sheet, cell):
+        """寫入公式的輸入格後，不保留依舊值計算的快取結果並要求開啟時全部重算"""
+        from openpyxl import load_workbook as lw
+        from app.autofill_core import patch_xlsx
+
+        content = self._as_saved_by_excel(self._template())
+        assert lw(io.BytesIO(content), data_only=True)["表單"]["A8"].value == 10
+        assert lw(io.BytesIO(content)).calculation is None
+
+        filled = patch_xlsx(content, [(sheet, cell, 65.5)])
+
+        assert lw(io.BytesIO(filled)).calculation.fullCalcOnLoad
+        assert lw(io.BytesIO(filled))["表單"]["A8"].value == "=SUM(B3:C3)"
+        if sheet == "表單":
+            assert lw(io.BytesIO(filled), data_only=True)["表單"]["A8"].value is None
+
+        changed = {
+            name for name, data in self._members(filled).items()
+            if self._members(content)[name] != data
+        }
+        part = "xl/worksheets/sheet1.xml" if sheet == "表單" else "xl/worksheets/sheet2.xml"
+        assert changed == {"xl/workbook.xml", part}
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("cell, value", [("A8", "覆寫公式"), ("B1", "=1+1")])
+    async def test_falls_back_to_openpyxl(self, cell, value):
+        """公式儲存格、"=" 開頭字串等交由 openpyxl 處理"""
+        from openpyxl import load_workbook as lw
+        from app.autofill_core import ExcelAutoFillEngine, XlsxPatchUnsupported, patch_xlsx
+
+        content = self._template()
+        with pytest.raises(XlsxPatchUnsupported):
+            patch_xlsx(content, [("表單", cell, value)])
+
+        field_lookup = {"f": {"field_type": "text", "value_location": {"sheet": "表單", "cell": cell}}}
+        filled = await ExcelAutoFillEngine().fill(content, field_lookup, {"f": value})
+        assert lw(io.BytesIO(filled))["表單"][cell].value == value
+
+
+class TestDocxPatch:
+    """測試 docx 快速回填路徑：結果與 python-docx 一致、只改寫主文件 XML"""
+
+    @staticmethod
+    def _template() -> bytes:
+        from docx.shared import Inches
+        from PIL import Image
+
+        doc = Document()
+        doc.add_paragraph("設備名稱：______").runs[0].bold = True
+        doc.add_paragraph("檢查日期：")
+        table = doc.add_table(rows=3, cols=3)
+        table.cell(0, 0).text = "溫度"
+        table.cell(1, 1).merge(table.cell(1, 2))
+        image = io.BytesIO()
+        Image.new("RGB", (4, 4), "red").save(image, format="PNG")
+        image.seek(0)
+        doc.add_picture(image, width=Inches(1))
+        doc.sections[0].header.paragraphs[0].text = "頁首"
+        output = io.BytesIO()
+        doc.save(output)
+        return output.getvalue()
+
+    @pytest.mark.asyncio
+    async def test_fast_path_matches_python_docx(self, monkeypatch):
+        from app.autofill_core import WordAutoFillEngine, word_engine
+
+        def fail_document(*args, **kwargs):
+            raise AssertionError("fast path should not load the Document")
+
+        field_lookup = {
+            "name": {"value_location": {"type": "paragraph", "paragraph_index": 0}},
+            "date": {"value_location": {
+                "type": "paragraph", "paragraph_index": 1, "replace_pattern": "after_colon"}},
+            "temp": {"value_location": {"type": "table", "table_index": 0, "row_index": 0, "cell_index": 1}},
+            "merged": {"label_location": {"table_index": 0},
+                       "value_location": {"type": "table", "row_index": 1, "cell_index": 2}},
+            "out_of_range": {"value_location": {"type": "paragraph", "paragraph_index": 99}},
+        }
+        value_lookup = {
+            "name": "馬達 B-02", "date": "2026-01-01", "temp": 65.5, "merged": "合併格", "out_of_range": "略過",
+        }
+        content = self._template()
+
+        expected = await WordAutoFillEngine().fill(content, field_lookup, value_lookup, xml_patch=False)
+        monkeypatch.setattr(word_engine, "Document", fail_document)
+        filled = await WordAutoFillEngine().fill(content, field_lookup, value_lookup)
+
+        fast, slow = Document(io.BytesIO(filled)), Document(io.BytesIO(expected))
+        assert [p.text for p in fast.paragraphs] == [p.text for p in slow.paragraphs]
+        assert [c.text for c in fast.tables[0]._cells] == [c.text for c in slow.tables[0]._cells]
+        assert fast.paragraphs[0].text == "設備名稱： 馬達 B-02"
+        assert fast.paragraphs[0].runs[0].bold
+        assert fast.tables[0].cell(1, 1).text == "合併格"
+        assert len(fast.inline_shapes) == 1
+
+        before, after = TestXlsxPatch._members(content), TestXlsxPatch._members(filled)
+        assert before.keys() == after.keys()
+        changed = {name for name in before if before[name] != after[name]}
+        assert changed == {"word/document.xml"}
+
+    @pytest.mark.asyncio
+    async def test_per_call_selection(self, monkeypatch):
+        """每次呼叫可覆寫建構時的設定；無法修補的輸入拋出 DocxPatchUnsupported"""
+        from app.autofill_core import DocxPatchUnsupported, WordAutoFillEngine, patch_docx, word_engine
+
+        with pytest.raises(DocxPatchUnsupported):
+            patch_docx(b"not a zip", lambda body: None)
+
+        loads = []
+        document = word_engine.Document
+
+        def counting_document(*args, **kwargs):
+            loads.append(1)
+            return document(*args, **kwargs)
+
+        monkeypatch.setattr(word_engine, "Document", counting_document)
+        engine = WordAutoFillEngine(xml_patch=False)
+        field_lookup = {"name": {"value_location": {"type": "paragraph", "paragraph_index": 0}}}
+
+        filled = await engine.fill(self._template(), field_lookup, {"name": "馬達"}, xml_patch=True)
+        assert loads == []
+        await engine.fill(self._template(), field_lookup, {"name": "馬達"})
+        assert loads == [1]
+        assert Document(io.BytesIO(filled)).paragraphs[0].text == "設備名稱： 馬達"
+
+
 # ================================================================
 # API 端點整合測試
 # ================================================================
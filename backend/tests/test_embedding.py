@@ -0,0 +1,379 @@
+"""
+Embedding 服務測試
+
+測試範圍：
+1. 批次切分（筆數 / 字元數上限）
+2. embed_batch 並行送出且維持輸入順序
+3. Embedding 快取（LRU 淘汰、SQLite 持久化、批次讀寫於執行緒中進行、命中統計）
+4. 同步 SDK 呼叫不阻塞 event loop、請求逾時
+5. 供應商客戶端與服務為全程序共用
+
+注意：不呼叫真實 Embedding API，以替身方法取代供應商請求。
+"""
+
+import asyncio
+import sys
+import os
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key-for-unit-tests")
+
+from app.config import settings
+from app.services.clients import ProviderClients
+from app.services.embedding import EmbeddingService, _chunk_texts, get_embedding_service
+from app.services.embedding_cache import EmbeddingCache
+
+
+def _fake_vector(text: str) -> list[float]:
+    return [float(len(text)), float(sum(map(ord, text)) % 997)]
+
+
+def _make_service(cache: EmbeddingCache = None, clients: ProviderClients = None) -> EmbeddingService:
+    """每個測試使用獨立快取，避免共用快取互相影響"""
+    return EmbeddingService(
+        provider="gemini", cache=cache or EmbeddingCache(max_entries=1024), clients=clients
+    )
+
+
+class LegacyOnlyClients(ProviderClients):
+    """未安裝新版 google-genai 時的客戶端（改用舊版 SDK）"""
+
+    def gemini_client(self):
+        return None
+
+
+class TestChunkTexts:
+    """批次切分"""
+
+    def test_split_by_item_count(self):
+        chunks = _chunk_texts(["a"] * 7, max_items=3, max_chars=1000)
+        assert chunks == [(0, 3), (3, 6), (6, 7)]
+
+    def test_split_by_char_budget(self):
+        texts = ["x" * 40, "y" * 40, "z" * 40]
+        chunks = _chunk_texts(texts, max_items=100, max_chars=100)
+        assert chunks == [(0, 2), (2, 3)]
+
+    def test_oversized_text_gets_own_chunk(self):
+        texts = ["a", "b" * 500, "c"]
+        chunks = _chunk_texts(texts, max_items=100, max_chars=100)
+        assert chunks == [(0, 1), (1, 2), (2, 3)]
+
+    def test_empty(self):
+        assert _chunk_texts([], max_items=10, max_chars=10) == []
+
+
+class TestEmbedBatch:
+    """批次向量化"""
+
+    @pytest.mark.asyncio
+    async def test_preserves_input_order(self):
+        service = _make_service()
+        texts = [f"齒輪箱異常 {i}" * (i % 3 + 1) for i in range(25)]
+
+        async def fake_chunk(chunk):
+            # 讓較早的批次較晚完成，驗證結果仍依輸入順序組合
+            await asyncio.sleep(0.001 * (30 - len(chunk)))
+            return [_fake_vector(t) for t in chunk]
+
+        service._embed_chunk = fake_chunk
+        embeddings = await service.embed_batch(texts, batch_size=4, concurrency=3)
+
+        assert embeddings == [_fake_vector(t) for t in texts]
+
+    @pytest.mark.asyncio
+    async def test_respects_concurrency_limit(self):
+        service = _make_service()
+        active = 0
+        peak = 0
+        calls = 0
+
+        async def fake_chunk(chunk):
+            nonlocal active, peak, calls
+            calls += 1
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.005)
+            active -= 1
+            return [_fake_vector(t) for t in chunk]
+
+        service._embed_chunk = fake_chunk
+        await service.embed_batch([f"t{i}" for i in range(20)], batch_size=2, concurrency=2)
+
+        assert calls == 10
+        assert peak <= 2
+
+    @pytest.mark.asyncio
+    async def test_count_mismatch_raises(self):
+        service = _make_service()
+
+        async def fake_chunk(chunk):
+            return [_fake_vector(t) for t in chunk[:-1]]
+
+        service._embed_chunk = fake_chunk
+        with pytest.raises(ValueError, match="mismatch"):
+            await service.embed_batch(["a", "b", "c"])
+
+    @pytest.mark.asyncio
+    async def test_empty_input(self):
+        service = _make_service()
+        assert await service.embed_batch([]) == []
+
+
+class TestEmbeddingCache:
+    """Embedding 快取"""
+
+    def test_lru_eviction(self):
+        cache = EmbeddingCache(max_entries=2)
+        cache.put("a", [1.0])
+        cache.put("b", [2.0])
+        assert cache.get("a") == [1.0]  # a 變為最近使用
+        cache.put("c", [3.0])
+
+        assert cache.get("b") is None
+        assert cache.get("a") == [1.0]
+        assert cache.get("c") == [3.0]
+
+    def test_stats_counts_hits_and_misses(self):
+        cache = EmbeddingCache(max_entries=10)
+        cache.put("k", [0.5])
+        cache.get("k")
+        cache.get("missing")
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
+        assert stats["disk_entries"] is None
+
+    def test_disk_layer_survives_restart(self, tmp_path):
+        db_path = str(tmp_path / "embedding_cache.db")
+        cache = EmbeddingCache(max_entries=10, db_path=db_path)
+        cache.put("k", [0.25, -1.5, 3.0])
+        cache.close()
+
+        reopened = EmbeddingCache(max_entries=10, db_path=db_path)
+        assert reopened.get("k") == [0.25, -1.5, 3.0]
+        assert reopened.stats()["disk_hits"] == 1
+        reopened.close()
+
+    def test_put_many_single_transaction_and_disk_cap(self, tmp_path):
+        db_path = str(tmp_path / "embedding_cache.db")
+        cache = EmbeddingCache(max_entries=0, db_path=db_path, max_disk_entries=3)
+        cache.put_many([("a", [1.0]), ("b", [2.0])])
+        cache.put_many([("c", [3.0]), ("d", [4.0]), ("e", [5.0])])
+
+        assert cache.stats()["disk_entries"] == 3
+        assert cache.get("a") is None and cache.get("b") is None  # 最早寫入者被淘汰
+        assert cache.get("e") == [5.0]
+        cache.close()
+
+    def test_get_many_reads_disk_in_one_query(self, tmp_path):
+        db_path = str(tmp_path / "embedding_cache.db")
+        cache = EmbeddingCache(max_entries=10, db_path=db_path)
+        cache.put_many([("a", [1.0]), ("b", [2.0]), ("c", [3.0])])
+        cache.close()
+
+        reopened = EmbeddingCache(max_entries=10, db_path=db_path)
+        queries = []
+        reopened._conn.set_trace_callback(queries.append)
+        reopened.get("a")  # 記憶體層命中者不再查詢磁碟
+        queries.clear()
+
+        found = reopened.get_many(["a", "b", "c", "missing", "b"])
+
+        assert found == {"a": [1.0], "b": [2.0], "c": [3.0]}
+        assert len([q for q in queries if q.startswith("SELECT")]) == 1
+        stats = reopened.stats()
+        assert (stats["hits"], stats["disk_hits"], stats["misses"]) == (4, 3, 1)
+        reopened.close()
+
+    @pytest.mark.asyncio
+    async def test_embed_batch_reads_cache_once_off_loop(self):
+        import threading
+
+        class RecordingCache(EmbeddingCache):
+            def __init__(self):
+                super().__init__(max_entries=1024)
+                self.reads = []
+
+            def get_many(self, keys):
+                self.reads.append((threading.current_thread() is threading.main_thread(), len(keys)))
+                return super().get_many(keys)
+
+        cache = RecordingCache()
+        service = _make_service(cache)
+
+        async def fake_batch(texts):
+            return [_fake_vector(t) for t in texts]
+
+        service._embed_batch_with_gemini = fake_batch
+        await service.embed_batch([f"text {i}" for i in range(10)])
+        await service.embed_text("text 0")
+
+        assert cache.reads == [(False, 10), (False, 1)]
+
+    @pytest.mark.asyncio
+    async def test_embed_batch_writes_cache_once_off_loop(self):
+        import threading
+
+        class RecordingCache(EmbeddingCache):
+            def __init__(self):
+                super().__init__(max_entries=1024)
+                self.writes = []
+
+            def put_many(self, items):
+                self.writes.append((threading.current_thread() is threading.main_thread(), len(items)))
+                super().put_many(items)
+
+        cache = RecordingCache()
+        service = _make_service(cache)
+
+        async def fake_batch(texts):
+            return [_fake_vector(t) for t in texts]
+
+        service._embed_batch_with_gemini = fake_batch
+        await service.embed_batch([f"text {i}" for i in range(250)])
+
+        assert cache.writes == [(False, 250)]
+        assert cache.stats()["entries"] == 250
+
+    def test_key_depends_on_provider_model_dimension(self):
+        base = EmbeddingCache.make_key("gemini", "embedding-001", 768, "text")
+        assert base == EmbeddingCache.make_key("gemini", "embedding-001", 768, "text")
+        assert base != EmbeddingCache.make_key("openai", "embedding-001", 768, "text")
+        assert base != EmbeddingCache.make_key("gemini", "text-embedding-004", 768, "text")
+        assert base != EmbeddingCache.make_key("gemini", "embedding-001", 1536, "text")
+
+    @pytest.mark.asyncio
+    async def test_embed_text_uses_cache(self):
+        service = _make_service()
+        calls = []
+
+        async def fake_embed(text):
+            calls.append(text)
+            return _fake_vector(text)
+
+        service._embed_with_gemini = fake_embed
+        first = await service.embed_text("齒輪箱 油封滲漏")
+        second = await service.embed_text("齒輪箱 油封滲漏")
+
+        assert first == second
+        assert len(calls) == 1
+        assert service.cache_stats()["hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_embed_batch_only_sends_misses(self):
+        service = _make_service()
+        sent = []
+
+        async def fake_chunk(chunk):
+            sent.extend(chunk)
+            return [_fake_vector(t) for t in chunk]
+
+        service._embed_chunk = fake_chunk
+        await service.embed_batch(["a", "b"])
+        embeddings = await service.embed_batch(["b", "c", "c", "a"])
+
+        assert sent == ["a", "b", "c"]
+        assert embeddings == [_fake_vector(t) for t in ["b", "c", "c", "a"]]
+
+
+class TestNonBlockingTransport:
+    """同步 SDK 呼叫交由執行緒池，event loop 不被阻塞"""
+
+    @staticmethod
+    def _patch_legacy_sdk(monkeypatch, delay: float):
+        import google.generativeai as genai_old
+
+        def slow_embed_content(model, content, task_type=None):
+            time.sleep(delay)
+            return {"embedding": [_fake_vector(t) for t in content]}
+
+        monkeypatch.setattr(genai_old, "embed_content", slow_embed_content)
+
+    @pytest.mark.asyncio
+    async def test_legacy_sdk_does_not_block_event_loop(self, monkeypatch):
+        self._patch_legacy_sdk(monkeypatch, delay=0.2)
+        service = _make_service(clients=LegacyOnlyClients())
+
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        try:
+            embedding = await service.embed_text("馬達 軸承 異音")
+        finally:
+            task.cancel()
+
+        assert embedding == _fake_vector(
+            "bearing | 馬達 軸承 異音"
+        )
+        assert ticks >= 5
+
+    @pytest.mark.asyncio
+    async def test_request_timeout(self, monkeypatch):
+        self._patch_legacy_sdk(monkeypatch, delay=0.3)
+        monkeypatch.setattr(settings, "embedding_timeout_seconds", 0.05)
+        service = _make_service(clients=LegacyOnlyClients())
+
+        with pytest.raises(TimeoutError):
+            await service.embed_text("timeout case")
+
+
+class TestSharedClients:
+    """客戶端與服務只建立一次"""
+
+    @pytest.mark.asyncio
+    async def test_gemini_client_fetched_per_call(self):
+        """共用客戶端關閉後重新建立，服務使用新的客戶端而非建構時的舊物件"""
+        from types import SimpleNamespace
+
+        def fake_client(name, calls):
+            async def embed_content(model, contents):
+                calls.append(name)
+                return SimpleNamespace(embeddings=[SimpleNamespace(values=_fake_vector(t)) for t in contents])
+            return SimpleNamespace(aio=SimpleNamespace(models=SimpleNamespace(embed_content=embed_content)))
+
+        calls = []
+        clients = ProviderClients()
+        clients._genai_client = fake_client("first", calls)
+        service = _make_service(clients=clients)
+        await service.embed_text("a")
+
+        await clients.aclose()
+        clients._genai_client = fake_client("second", calls)
+        await service.embed_text("b")
+
+        assert calls == ["first", "second"]
+
+    def test_generative_model_is_reused(self, monkeypatch):
+        import google.generativeai as genai_old
+
+        configure_calls = []
+        monkeypatch.setattr(genai_old, "configure", lambda **kw: configure_calls.append(kw))
+        clients = ProviderClients()
+
+        first = clients.generative_model("gemini-test-model")
+        second = clients.generative_model("gemini-test-model")
+
+        assert first is second
+        assert len(configure_calls) == 1
+
+    def test_embedding_service_singleton(self):
+        assert get_embedding_service() is get_embedding_service()
+
+    def test_services_share_provider_clients(self):
+        clients = ProviderClients()
+        a = EmbeddingService(provider="openai", clients=clients)
+        b = EmbeddingService(provider="openai", clients=clients)
+        assert a._clients.openai_client() is b._clients.openai_client()
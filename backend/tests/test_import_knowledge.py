@@ -0,0 +1,147 @@
+"""
+知識庫批次匯入工具 (import_knowledge.py) 測試
+
+測試範圍：
+1. JSON 陣列串流解析（記錄跨越讀取區塊、純量於區塊邊界截斷）
+2. NDJSON / JSONL 解析
+3. 中斷後依連續完成的 checkpoint 續傳
+4. 來源檔案變更時拒絕續傳
+
+以替身函式取代 HTTP 請求，不需啟動後端。
+"""
+
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import import_knowledge
+from import_knowledge import CheckpointMismatch, _load_checkpoint, iter_records
+
+
+def _records(n: int) -> list[dict]:
+    return [{
+        "equipment_type": "馬達",
+        "content": f"第 {i} 筆：軸承溫度偏高，檢查潤滑脂 " + "說明" * 20,
+        "metadata": {"row": i},
+    } for i in range(n)]
+
+
+class FakeSender:
+    """記錄送出的批次；fail_offsets 中的批次送出失敗"""
+
+    def __init__(self, fail_offsets=()):
+        self.fail_offsets = set(fail_offsets)
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def __call__(self, session, api_url, items, retries):
+        offset = int(items[0]["source_id"].split("_")[1]) - 1
+        if offset in self.fail_offsets:
+            raise RuntimeError("503 - unavailable")
+        with self._lock:
+            self.sent.append(offset)
+        return len(items)
+
+
+class TestStreamingParser:
+
+    def test_json_array_record_split_across_chunks(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(import_knowledge, "_READ_CHUNK", 16)
+        records = _records(5)
+        path = tmp_path / "knowledge.json"
+        path.write_text(json.dumps(records, ensure_ascii=False, indent=2), encoding="utf-8")
+
+        assert list(iter_records(str(path))) == records
+
+    def test_json_array_scalar_split_at_chunk_boundary(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(import_knowledge, "_READ_CHUNK", 4)
+        path = tmp_path / "numbers.json"
+        path.write_text("[1, 123456, 7]", encoding="utf-8")
+
+        assert list(iter_records(str(path))) == [1, 123456, 7]
+
+    def test_unterminated_array(self, tmp_path):
+        path = tmp_path / "broken.json"
+        path.write_text('[{"content": "a"},', encoding="utf-8")
+
+        with pytest.raises(ValueError):
+            list(iter_records(str(path)))
+
+    @pytest.mark.parametrize("name", ["knowledge.ndjson", "knowledge.jsonl", "knowledge.txt"])
+    def test_ndjson(self, tmp_path, name):
+        records = _records(3)
+        path = tmp_path / name
+        lines = [json.dumps(r, ensure_ascii=False) for r in records]
+        path.write_text("\n".join(lines[:2]) + "\n\n" + lines[2] + "\n", encoding="utf-8")
+
+        assert list(iter_records(str(path))) == records
+
+
+class TestResume:
+
+    @staticmethod
+    def _write(path, records):
+        path.write_text(
+            "\n".join(json.dumps(r, ensure_ascii=False) for r in records), encoding="utf-8"
+        )
+
+    def test_resume_after_partial_run(self, tmp_path, monkeypatch):
+        path = tmp_path / "knowledge.ndjson"
+        self._write(path, _records(10))
+        checkpoint = str(tmp_path / "import.checkpoint.json")
+
+        failing = FakeSender(fail_offsets={4})
+        monkeypatch.setattr(import_knowledge, "_send_batch", failing)
+        assert import_knowledge.import_knowledge(
+            str(path), batch_size=2, workers=1, checkpoint_path=checkpoint
+        ) is False
+        # 只記錄連續完成的位置，失敗批次之後的資料不會被跳過
+        assert _load_checkpoint(checkpoint, str(path)) == 4
+        assert {0, 2} <= set(failing.sent)
+
+        resumed = FakeSender()
+        monkeypatch.setattr(import_knowledge, "_send_batch", resumed)
+        assert import_knowledge.import_knowledge(
+            str(path), batch_size=2, workers=2, checkpoint_path=checkpoint
+        ) is True
+        assert sorted(resumed.sent) == [4, 6, 8]
+        assert not os.path.exists(checkpoint)
+
+    def test_refuse_resume_when_source_changed(self, tmp_path, monkeypatch):
+        path = tmp_path / "knowledge.ndjson"
+        self._write(path, _records(6))
+        checkpoint = str(tmp_path / "import.checkpoint.json")
+        import_knowledge._save_checkpoint(checkpoint, str(path), 4)
+
+        self._write(path, _records(8))
+        with pytest.raises(CheckpointMismatch, match="size"):
+            _load_checkpoint(checkpoint, str(path))
+
+        sender = FakeSender()
+        monkeypatch.setattr(import_knowledge, "_send_batch", sender)
+        assert import_knowledge.import_knowledge(
+            str(path), batch_size=2, workers=1, checkpoint_path=checkpoint
+        ) is False
+        assert sender.sent == []
+
+        # 明確指定起始位置時不檢查 checkpoint
+        assert import_knowledge.import_knowledge(
+            str(path), batch_size=2, workers=1, checkpoint_path=checkpoint, resume_from=4
+        ) is True
+        assert sender.sent == [4, 6]
+
+    def test_checkpoint_for_other_source_rejected(self, tmp_path):
+        first = tmp_path / "a.ndjson"
+        second = tmp_path / "b.ndjson"
+        self._write(first, _records(2))
+        self._write(second, _records(2))
+        checkpoint = str(tmp_path / "import.checkpoint.json")
+        import_knowledge._save_checkpoint(checkpoint, str(first), 1)
+
+        with pytest.raises(CheckpointMismatch, match="source"):
+            _load_checkpoint(checkpoint, str(second))
@@ -0,0 +1,221 @@
+"""
+本機向量索引 (LocalVectorStore) 測試
+
+測試範圍：
+1. 新增 / 相似度排序 / 門檻過濾
+2. metadata 過濾（語意同 jsonb @>：缺少的鍵、布林與數值不互相符合）
+3. 刪除（tombstone）
+4. 重新開啟後資料保留、容量自動擴充
+5. 量化儲存（halfvec / int8）與全精度重排序
+6. 運算與 I/O 於工作執行緒中執行
+"""
+
+import sys
+import os
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key-for-unit-tests")
+
+from app.services.local_vector_store import LocalVectorStore
+from app.services.quantization import bytes_per_vector, quantize, validate_storage
+
+DIM = 8
+
+
+def _unit(index: int, noise: float = 0.0) -> list[float]:
+    vec = np.zeros(DIM, dtype=np.float32)
+    vec[index] = 1.0
+    vec[(index + 1) % DIM] = noise
+    return vec.tolist()
+
+
+async def _seed(store: LocalVectorStore) -> dict:
+    ids = {}
+    ids["gear"] = await store.add(
+        "齒輪箱油封滲漏", "齒輪箱", "inspection", _unit(0), metadata={"vendor": "Delta"}
+    )
+    ids["gear_similar"] = await store.add(
+        "齒輪箱油封輕微滲漏", "齒輪箱", "history", _unit(0, noise=0.3),
+        metadata={"vendor": "ABB", "tags": ["oil", "seal"]},
+    )
+    ids["blade"] = await store.add(
+        "葉片前緣腐蝕", "葉片", "document", _unit(3), metadata={"vendor": "Delta"}
+    )
+    return ids
+
+
+class TestLocalVectorStore:
+
+    @pytest.mark.asyncio
+    async def test_search_orders_by_similarity(self, tmp_path):
+        store = LocalVectorStore(str(tmp_path), DIM)
+        ids = await _seed(store)
+
+        results = await store.search(_unit(0), top_k=5, min_similarity=0.5)
+
+        assert [r["id"] for r in results] == [ids["gear"], ids["gear_similar"]]
+        assert results[0]["similarity"] == pytest.approx(1.0, abs=1e-4)
+        assert results[0]["content"] == "齒輪箱油封滲漏"
+        assert results[0]["metadata"] == {"vendor": "Delta"}
+
+    @pytest.mark.asyncio
+    async def test_top_k_limits_results(self, tmp_path):
+        store = LocalVectorStore(str(tmp_path), DIM)
+        ids = await _seed(store)
+
+        results = await store.search(_unit(0), top_k=1)
+        assert [r["id"] for r in results] == [ids["gear"]]
+
+    @pytest.mark.asyncio
+    async def test_metadata_filters(self, tmp_path):
+        store = LocalVectorStore(str(tmp_path), DIM)
+        ids = await _seed(store)
+
+        results = await store.search(_unit(0), top_k=5, filters={"vendor": "ABB"})
+        assert [r["id"] for r in results] == [ids["gear_similar"]]
+
+        results = await store.search(_unit(0), top_k=5, filters={"tags": ["seal"]})
+        assert [r["id"] for r in results] == [ids["gear_similar"]]
+
+    @pytest.mark.asyncio
+    async def test_metadata_filters_match_jsonb_containment(self, tmp_path):
+        """缺少的鍵不符合 null，true 不等於 1（同 jsonb @>）"""
+        store = LocalVectorStore(str(tmp_path), DIM)
+        ids = await _seed(store)
+        flagged = await store.add(
+            "主軸承溫度偏高", "主軸承", "inspection", _unit(0),
+            metadata={"vendor": None, "critical": True, "level": 1, "spec": {"rpm": 1500}},
+        )
+        counted = await store.add(
+            "主軸承潤滑不足", "主軸承", "inspection", _unit(0),
+            metadata={"critical": 1, "level": 1.0, "spec": {"rpm": "1500"}},
+        )
+
+        async def matching(filters):
+            return {r["id"] for r in await store.search(_unit(0), top_k=10, filters=filters)}
+
+        assert await matching({"vendor": None}) == {flagged}
+        assert await matching({"critical": True}) == {flagged}
+        assert await matching({"critical": 1}) == {counted}
+        assert await matching({"level": 1}) == {flagged, counted}
+        assert await matching({"spec": {"rpm": 1500}}) == {flagged}
+        assert ids["gear"] not in await matching({"tags": []})
+
+    @pytest.mark.asyncio
+    async def test_work_runs_off_event_loop(self, tmp_path, monkeypatch):
+        import threading
+
+        store = LocalVectorStore(str(tmp_path), DIM)
+        threads = []
+        for name in ("_search", "_add_many", "_list_items"):
+            original = getattr(store, name)
+
+            def record(*args, _original=original):
+                threads.append(threading.current_thread() is threading.main_thread())
+                return _original(*args)
+
+            monkeypatch.setattr(store, name, record)
+
+        await _seed(store)
+        await store.search(_unit(0), top_k=5)
+        await store.list_items()
+
+        assert threads and not any(threads)
+        assert [item_id async for item_id, _ in store.iter_contents(batch_size=2)] == [
+            i["id"] for i in reversed(await store.list_items())
+        ]
+
+    @pytest.mark.asyncio
+    async def test_delete_hides_item(self, tmp_path):
+        store = LocalVectorStore(str(tmp_path), DIM)
+        ids = await _seed(store)
+
+        assert await store.delete(ids["gear"]) is True
+        assert await store.delete(ids["gear"]) is False
+
+        results = await store.search(_unit(0), top_k=5)
+        assert ids["gear"] not in [r["id"] for r in results]
+        stats = await store.stats()
+        assert stats["total"] == 2
+        assert stats["by_equipment"] == {"齒輪箱": 1, "葉片": 1}
+
+    @pytest.mark.asyncio
+    async def test_reopen_and_grow(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(LocalVectorStore, "INITIAL_CAPACITY", 2)
+        store = LocalVectorStore(str(tmp_path), DIM)
+        ids = await _seed(store)
+        await store.delete(ids["blade"])
+        store.close()
+
+        reopened = LocalVectorStore(str(tmp_path), DIM)
+        results = await reopened.search(_unit(0, noise=0.3), top_k=1)
+        assert results[0]["id"] == ids["gear_similar"]
+        assert (await reopened.stats())["total"] == 2
+
+        items = await reopened.list_items()
+        assert {i["id"] for i in items} == {ids["gear"], ids["gear_similar"]}
+
+    @pytest.mark.asyncio
+    async def test_dimension_mismatch(self, tmp_path):
+        store = LocalVectorStore(str(tmp_path), DIM)
+        with pytest.raises(ValueError, match="dimension"):
+            await store.add("x", "y", "inspection", [1.0, 0.0])
+
+
+class TestQuantizedStorage:
+
+    @pytest.mark.parametrize("storage", ["halfvec", "int8"])
+    @pytest.mark.asyncio
+    async def test_search_reranks_with_full_precision(self, tmp_path, storage):
+        store = LocalVectorStore(str(tmp_path), DIM, storage=storage)
+        ids = await _seed(store)
+
+        results = await store.search(_unit(0), top_k=5, min_similarity=0.5)
+
+        assert [r["id"] for r in results] == [ids["gear"], ids["gear_similar"]]
+        # 相似度以 float32 向量重新計算，與全精度儲存一致
+        assert results[0]["similarity"] == pytest.approx(1.0, abs=1e-4)
+        assert results[1]["similarity"] == pytest.approx(1 / np.sqrt(1.09), abs=1e-4)
+
+        filtered = await store.search(_unit(0), top_k=5, filters={"vendor": "ABB"})
+        assert [r["id"] for r in filtered] == [ids["gear_similar"]]
+
+    @pytest.mark.asyncio
+    async def test_quantized_matrix_rebuilt_on_reopen(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(LocalVectorStore, "INITIAL_CAPACITY", 2)
+        store = LocalVectorStore(str(tmp_path), DIM)
+        ids = await _seed(store)
+        store.close()
+
+        reopened = LocalVectorStore(str(tmp_path), DIM, storage="int8", rerank_factor=2)
+        assert reopened._quantized.dtype == np.int8
+        ids["pump"] = await reopened.add("泵浦異音", "泵浦", "inspection", _unit(5))
+
+        results = await reopened.search(_unit(5), top_k=1)
+        assert results[0]["id"] == ids["pump"]
+        results = await reopened.search(_unit(0, noise=0.3), top_k=1)
+        assert results[0]["id"] == ids["gear_similar"]
+
+    def test_int8_quantization_error(self):
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((100, 768)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        quantized, scales = quantize(vectors, "int8")
+        restored = quantized.astype(np.float32) * scales[:, None]
+
+        assert quantized.dtype == np.int8
+        assert np.abs(restored - vectors).max() <= scales.max() / 2 + 1e-6
+        assert bytes_per_vector("int8", 768) * 3.9 < bytes_per_vector("full", 768)
+
+    def test_storage_validation(self):
+        assert validate_storage("halfvec", "pgvector") == "halfvec"
+        with pytest.raises(ValueError, match="local backend"):
+            validate_storage("int8", "pgvector")
+    def test_unknown_storage(self, tmp_path):
+        with pytest.raises(ValueError, match="Unknown embedding storage"):
+            LocalVectorStore(str(tmp_path), DIM, storage="fp8")
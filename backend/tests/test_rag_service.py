@@ -0,0 +1,1125 @@
+"""
+RAG 服務測試（不需 PostgreSQL）
+
+測試範圍：
+1. 向量索引參數（IVFFlat lists、ef_search / probes 等級、過濾查詢的 iterative scan、halfvec 索引、
+   CONCURRENTLY 重建與跨 worker 狀態通知）
+2. 批次匯入 (add_items / /api/rag/bulk-add)
+3. 混合檢索（字元 bigram BM25 詞彙索引 + 向量，RRF 融合）
+4. 查詢結果快取（TTL、世代計數失效）
+5. 維修建議串流（/api/rag/query/stream SSE）
+6. 文件匯入背景工作佇列（重試、同時執行數、重啟續跑）
+7. 大型文件分段並行擷取（分段、重疊去重）
+8. 入庫去重（內容雜湊、近重複向量（整批單一查詢、同批比對）、skip / replace / keep）
+9. 知識項目 keyset 分頁與 NDJSON 匯出
+10. 增量維護的知識庫統計
+11. metadata 過濾（提升欄位、JSONB）
+12. 資料庫連線池量測與請求共用 Session
+
+RAGService 以本機向量索引與替身 Embedding 服務測試，不呼叫外部 API。
+"""
+
+import asyncio
+import hashlib
+import json
+import sys
+import os
+from contextlib import asynccontextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key-for-unit-tests")
+
+from app.db import database, vector_index
+from app.db.pool import InstrumentedAsyncPool, PoolMetrics, pool_status
+from app.db.vector_index import ivfflat_lists_for, search_settings
+from app.services.clients import ProviderClients
+from app.services.document_chunker import chunk_units, dedup_key
+from app.services.import_jobs import ImportJobQueue, ImportJobStore
+from app.services.lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+from app.services.local_vector_store import LocalVectorStore
+from app.services.pagination import decode_cursor, encode_cursor, next_cursor
+from app.services.query_cache import QueryResultCache
+from app.services.rag import RAGService, get_rag_service
+
+DIM = 16
+
+
+class FakeEmbeddingService:
+    """以文字雜湊產生固定向量的替身 Embedding 服務"""
+
+    def __init__(self):
+        self.batch_calls = []
+
+    @staticmethod
+    def _vector(text: str) -> list[float]:
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [b / 255.0 - 0.5 for b in digest[:DIM]]
+
+    async def embed_text(self, text: str) -> list[float]:
+        return self._vector(text)
+
+    async def embed_batch(self, texts: list[str], **kwargs) -> list[list[float]]:
+        self.batch_calls.append(len(texts))
+        return [self._vector(t) for t in texts]
+
+
+def _make_rag_service(tmp_path) -> RAGService:
+    return RAGService(
+        embedding_service=FakeEmbeddingService(),
+        clients=ProviderClients(),
+        store=LocalVectorStore(str(tmp_path / "rag_index"), DIM),
+        query_cache=QueryResultCache(),
+    )
+
+
+def _records(n: int) -> list[dict]:
+    return [{
+        "content": f"齒輪箱第 {i} 號軸承溫度偏高，建議檢查潤滑",
+        "equipment_type": "齒輪箱",
+        "source_type": "document",
+        "source_id": f"manual-{i}",
+        "metadata": {"page": i},
+    } for i in range(n)]
+
+
+class TestVectorIndexSettings:
+    """向量索引管理"""
+
+    def test_ivfflat_lists_scale_with_rows(self):
+        assert ivfflat_lists_for(0) == 1
+        assert ivfflat_lists_for(50_000) == 50
+        assert ivfflat_lists_for(1_000_000) == 1000
+        assert ivfflat_lists_for(4_000_000) == 2000
+
+    def test_no_index_means_no_settings(self, monkeypatch):
+        monkeypatch.setattr(vector_index, "_index_state", {"type": None, "lists": None})
+        assert search_settings(5) == []
+
+    def test_hnsw_ef_search_follows_recall_level(self, monkeypatch):
+        monkeypatch.setattr(vector_index, "_index_state", {"type": "hnsw", "lists": None})
+        fast = search_settings(5, "fast")
+        accurate = search_settings(5, "accurate")
+
+        assert fast == ["SET LOCAL hnsw.ef_search = 20"]
+        assert accurate == ["SET LOCAL hnsw.ef_search = 160"]
+        # ef_search 不得小於 top_k
+        assert search_settings(100, "fast") == ["SET LOCAL hnsw.ef_search = 100"]
+
+    def test_ivfflat_probes_capped_by_lists(self, monkeypatch):
+        monkeypatch.setattr(vector_index, "_index_state", {"type": "ivfflat", "lists": 100})
+        assert search_settings(5) == ["SET LOCAL ivfflat.probes = 10"]
+        assert search_settings(5, "accurate") == ["SET LOCAL ivfflat.probes = 40"]
+
+        monkeypatch.setattr(vector_index, "_index_state", {"type": "ivfflat", "lists": 4})
+        assert search_settings(5, "accurate") == ["SET LOCAL ivfflat.probes = 4"]
+
+    def test_unknown_recall_level(self):
+        with pytest.raises(ValueError):
+            search_settings(5, "turbo")
+
+    def test_filtered_search_uses_iterative_scan(self, monkeypatch):
+        monkeypatch.setattr(
+            vector_index, "_index_state", {"type": "hnsw", "lists": None, "iterative_scan": True}
+        )
+        assert search_settings(5, filtered=True) == [
+            "SET LOCAL hnsw.ef_search = 40",
+            "SET LOCAL hnsw.iterative_scan = relaxed_order",
+        ]
+
+        # 舊版 pgvector：改為放大 ef_search
+        monkeypatch.setattr(vector_index, "_index_state", {"type": "hnsw", "lists": None})
+        assert search_settings(5, filtered=True) == ["SET LOCAL hnsw.ef_search = 160"]
+
+    @pytest.mark.asyncio
+    async def test_rebuild_builds_concurrently_and_notifies(self, monkeypatch):
+        statements = []
+
+        class FakeConnection:
+            isolation_level = None
+
+            async def execution_options(self, isolation_level):
+                self.isolation_level = isolation_level
+                return self
+
+            async def scalar(self, stmt):
+                return 5000 if "count(*)" in str(stmt) else "0.8.0"
+
+            async def execute(self, stmt, params=None):
+                assert self.isolation_level == "AUTOCOMMIT"
+                statements.append((str(stmt), params))
+
+                class Result:
+                    def first(self):
+                        return ("CREATE INDEX ix_rag_items_embedding ON rag_items "
+                                "USING ivfflat (embedding vector_cosine_ops) WITH (lists='5')",)
+                return Result()
+
+        class FakeEngine:
+            @asynccontextmanager
+            async def connect(self):
+                yield FakeConnection()
+
+        monkeypatch.setattr(vector_index, "engine", FakeEngine())
+        monkeypatch.setattr(vector_index, "_index_state", {"type": "hnsw", "lists": None})
+
+        result = await vector_index.rebuild_vector_index("ivfflat")
+
+        sql = [stmt for stmt, _ in statements]
+        assert sql[0] == "DROP INDEX CONCURRENTLY IF EXISTS ix_rag_items_embedding_rebuild"
+        assert sql[1].startswith("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_rag_items_embedding_rebuild")
+        assert sql[2:4] == [
+            "DROP INDEX CONCURRENTLY IF EXISTS ix_rag_items_embedding",
+            "ALTER INDEX ix_rag_items_embedding_rebuild RENAME TO ix_rag_items_embedding",
+        ]
+        channel, payload = statements[-1][1]["channel"], statements[-1][1]["payload"]
+        assert channel == vector_index.INDEX_CHANNEL
+        assert json.loads(payload) == {"type": "ivfflat", "lists": 5, "iterative_scan": True}
+        assert result == {"index_type": "ivfflat", "lists": 5, "rows": 5000}
+
+    def test_rebuild_notification_updates_index_state(self, monkeypatch):
+        monkeypatch.setattr(vector_index, "_index_state", {"type": "hnsw", "lists": None})
+        vector_index._on_index_changed(
+            None, 1234, vector_index.INDEX_CHANNEL, json.dumps({"type": "ivfflat", "lists": 100})
+        )
+        assert search_settings(5) == ["SET LOCAL ivfflat.probes = 10"]
+
+        vector_index._on_index_changed(None, 1234, vector_index.INDEX_CHANNEL, "not json")
+        assert vector_index._index_state["type"] == "ivfflat"
+
+    def test_halfvec_storage_index_ops(self, monkeypatch):
+        monkeypatch.setattr(vector_index.settings, "rag_embedding_storage", "halfvec")
+        assert "USING hnsw (embedding halfvec_cosine_ops)" in vector_index._build_index_sql("hnsw", 0)
+        assert "USING ivfflat (embedding halfvec_cosine_ops)" in vector_index._build_index_sql("ivfflat", 5000)
+
+        monkeypatch.setattr(vector_index.settings, "rag_embedding_storage", "full")
+        assert "vector_cosine_ops" in vector_index._build_index_sql("hnsw", 0)
+
+
+class TestMetadataFilters:
+    """metadata 過濾（提升欄位 + JSONB）"""
+
+    def test_promoted_keys_use_columns(self):
+        from sqlalchemy.dialects import postgresql
+        from app.db.migrations import promoted_values
+        from app.services.vector_store import _filter_clauses
+
+        clauses = _filter_clauses({"vendor": "Delta", "equipment_type": "馬達", "line": "A"})
+        sql = [str(c.compile(dialect=postgresql.dialect())) for c in clauses]
+
+        assert sql[0].startswith("rag_items.vendor =")
+        assert sql[1].startswith("rag_items.equipment_type =")
+        assert "@>" in sql[2]
+        assert promoted_values({"vendor": "Delta", "location": 3}) == {"vendor": "Delta", "location": None}
+
+    @pytest.mark.asyncio
+    async def test_local_store_filters_equipment_type_column(self, tmp_path):
+        service = _make_rag_service(tmp_path)
+        await service.add_items([
+            {"content": "軸承過熱", "equipment_type": "馬達", "source_type": "inspection"},
+            {"content": "端子鬆脫", "equipment_type": "配電盤", "source_type": "inspection"},
+        ])
+        query = FakeEmbeddingService._vector("query")
+
+        results = await service.store.search(
+            query, top_k=10, min_similarity=-1.0, filters={"equipment_type": "配電盤"}
+        )
+        assert [r["equipment_type"] for r in results] == ["配電盤"]
+
+
+class TestBulkAdd:
+    """批次匯入"""
+
+    @pytest.mark.asyncio
+    async def test_add_items_iter_reports_progress(self, tmp_path):
+        service = _make_rag_service(tmp_path)
+
+        progress = [p async for p in service.add_items_iter(_records(7), chunk_size=3)]
+
+        assert [p["processed"] for p in progress] == [3, 6, 7]
+        assert all(p["total"] == 7 for p in progress)
+        assert service.embedding_service.batch_calls == [3, 3, 1]
+        assert (await service.get_stats())["total"] == 7
+
+    @pytest.mark.asyncio
+    async def test_add_items_ids_match_input_order(self, tmp_path):
+        service = _make_rag_service(tmp_path)
+        records = _records(5)
+
+        ids = await service.add_items(records, chunk_size=2)
+        items = {i["id"]: i for i in await service.get_all_items()}
+
+        assert [items[item_id]["source_id"] for item_id in ids] == [r["source_id"] for r in records]
+
+    def test_bulk_add_endpoint_streams_progress(self, tmp_path, monkeypatch):
+        from fastapi.testclient import TestClient
+        from app.config import settings
+        from app.main import app
+
+        service = _make_rag_service(tmp_path)
+        monkeypatch.setattr(settings, "rag_bulk_chunk_size", 2)
+        app.dependency_overrides[get_rag_service] = lambda: service
+        try:
+            client = TestClient(app)
+            payload = {
+                "items": [
+                    {"equipment_type": r["equipment_type"], "content": r["content"], "source_type": "document"}
+                    for r in _records(3)
+                ],
+                "stream": True,
+            }
+            response = client.post("/api/rag/bulk-add", json=payload)
+            events = [json.loads(line) for line in response.text.splitlines()]
+
+            assert response.status_code == 200
+            assert [e["event"] for e in events] == ["progress", "progress", "done"]
+            assert events[-1]["count"] == 3
+
+            payload["stream"] = False
+            response = client.post("/api/rag/bulk-add", json=payload)
+            assert response.json()["count"] == 3
+        finally:
+            app.dependency_overrides.clear()
+
+
+class TestLexicalIndex:
+    """字元 bigram + BM25 詞彙索引"""
+
+    def test_tokenize_cjk_bigrams_and_ascii_words(self):
+        assert tokenize("軸承過熱 PT100") == ["軸承", "承過", "過熱", "pt100"]
+        assert tokenize("油") == ["油"]
+
+    def test_bm25_ranks_matching_document_first(self):
+        index = LexicalIndex()
+        index.add("a", "馬達軸承過熱，需更換潤滑脂")
+        index.add("b", "配電盤端子鬆脫")
+        index.add("c", "冷卻水塔風扇皮帶磨損")
+
+        results = index.search("軸承過熱", limit=10)
+        assert [doc_id for doc_id, _ in results] == ["a"]
+
+    def test_remove_and_replace(self):
+        index = LexicalIndex()
+        index.add("a", "軸承過熱")
+        index.add("a", "皮帶磨損")
+        assert index.search("軸承", limit=10) == []
+        assert len(index) == 1
+
+        index.remove("a")
+        assert index.search("皮帶", limit=10) == []
+        assert len(index) == 0
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([["a", "b"], ["b", "c"]], k=60)
+        assert max(fused, key=fused.get) == "b"
+        assert set(fused) == {"a", "b", "c"}
+
+
+class TestHybridSearch:
+    """RAGService 混合檢索"""
+
+    @staticmethod
+    def _items():
+        return [
+            {"content": "馬達軸承過熱，需更換潤滑脂", "equipment_type": "馬達", "source_type": "document"},
+            {"content": "配電盤端子鬆脫，需重新鎖緊", "equipment_type": "配電盤", "source_type": "document"},
+            {"content": "冷卻水塔風扇皮帶磨損", "equipment_type": "冷卻水塔", "source_type": "document"},
+        ]
+
+    @pytest.mark.asyncio
+    async def test_lexical_match_found_when_vectors_disagree(self, tmp_path):
+        service = _make_rag_service(tmp_path)
+        ids = await service.add_items(self._items())
+
+        # 替身向量與文字語意無關：未通過相似度門檻者即使詞彙命中也不混入結果
+        assert await service.search_similar("軸承過熱怎麼處理", mode="vector") == []
+        assert await service.search_similar("軸承過熱怎麼處理", mode="hybrid") == []
+
+        # 門檻放寬後，詞彙命中的項目排在第一
+        service.similarity_threshold = -1.0
+        results = await service.search_similar("軸承過熱怎麼處理", mode="hybrid")
+        assert results[0]["id"] == ids[0]
+        assert all(r["similarity"] >= -1.0 for r in results)
+
+    @pytest.mark.asyncio
+    async def test_default_mode_is_vector(self, tmp_path):
+        service = _make_rag_service(tmp_path)
+        await service.add_items(self._items())
+
+        await service.search_similar("軸承過熱")
+        assert not service._lexical_ready  # 預設不建立詞彙索引（不掃描全表）
+
+    @pytest.mark.asyncio
+    async def test_lexical_index_loaded_from_existing_store(self, tmp_path):
+        ids = await _make_rag_service(tmp_path).add_items(self._items())
+
+        # 新的服務實例：詞彙索引於第一次查詢時由儲存後端載入
+        service = RAGService(
+            embedding_service=FakeEmbeddingService(),
+            clients=ProviderClients(),
+            store=LocalVectorStore(str(tmp_path / "rag_index"), DIM),
+        )
+        service.similarity_threshold = -1.0
+        results = await service.search_similar("皮帶磨損", mode="hybrid")
+        assert results[0]["id"] == ids[2]
+
+    @pytest.mark.asyncio
+    async def test_deleted_item_not_returned(self, tmp_path):
+        service = _make_rag_service(tmp_path)
+        ids = await service.add_items(self._items())
+        await service.delete_item(ids[1])
+
+        results = await service.search_similar("端子鬆脫", mode="hybrid")
+        assert ids[1] not in [r["id"] for r in results]
+
+    @pytest.mark.asyncio
+    async def test_filters_apply_to_lexical_candidates(self, tmp_path):
+        service = _make_rag_service(tmp_path)
+        items = self._items()
+        items[0]["metadata"] = {"vendor": "Delta"}
+        await service.add_items(items)
+
+        results = await service.search_similar("軸承過熱", mode="hybrid", filters={"vendor": "TECO"})
+        assert results == []
+
+    @pytest.mark.asyncio
+    async def test_store_search_restricted_to_candidate_ids(self, tmp_path):
+        service = _make_rag_service(tmp_path)
+        ids = await service.add_items(self._items())
+        query = FakeEmbeddingService._vector("query")
+
+        results = await service.store.search(query, top_k=10, min_similarity=-1.0, ids=[ids[2]])
+        assert [r["id"] for r in results] == [ids[2]]
+        assert await service.store.search(query, top_k=10, ids=[]) == []
+
+
+class TestQueryCache:
+    """查詢結果快取"""
+
+    def test_key_normalizes_text_and_orders_filters(self):
+        a = QueryResultCache.make_key(["馬達 ", "軸承　過熱"], {"vendor": "Delta", "line": "A"}, top_k=5)
+        b = QueryResultCache.make_key(["馬達", "軸承 過熱"], {"line": "A", "vendor": "Delta"}, top_k=5)
+        c = QueryResultCache.make_key(["馬達", "軸承 過熱"], {"line": "A", "vendor": "Delta"}, top_k=3)
+        assert a == b
+        assert a != c
+
+    def test_ttl_expiry(self, monkeypatch):
+        from app.services import query_cache
+
+        now = [1000.0]
+        monkeypatch.setattr(query_cache.time, "monotonic", lambda: now[0])
+        cache = QueryResultCache(ttl_seconds=10)
+        cache.put("k", "value")
+        assert cache.get("k") == "value"
+
+        now[0] += 11
+        assert cache.get("k") is None
+
+    def test_stale_generation_not_stored(self):
+        cache = QueryResultCache()
+        generation = cache.generation
+        cache.invalidate()
+        cache.put("k", "value", generation=generation)
+        assert cache.get("k") is None
+
+    @pytest.mark.asyncio
+    async def test_writes_invalidate(self, tmp_path):
+        service = _make_rag_service(tmp_path)
+        cache = service.query_cache
+
+        cache.put("k", "value")
+        ids = await service.add_items(_records(2))
+        assert cache.get("k") is None
+
+        cache.put("k", "value")
+        await service.delete_item(ids[0])
+        assert cache.get("k") is None
+
+    def test_query_endpoint_serves_cache_hit(self, tmp_path):
+        from fastapi.testclient import TestClient
+        from app.main import app
+
+        service = _make_rag_service(tmp_path)
+        calls = []
+
+        async def fake_suggestions(query, similar_cases):
+            calls.append(query)
+            return ["更換潤滑脂並確認軸承溫度"]
+
+        service.generate_suggestions = fake_suggestions
+        app.dependency_overrides[get_rag_service] = lambda: service
+        try:
+            client = TestClient(app)
+            payload = {"equipment_type": "馬達", "anomaly_description": "軸承過熱"}
+
+            first = client.post("/api/rag/query", json=payload).json()
+            second = client.post("/api/rag/query", json={**payload, "anomaly_description": " 軸承過熱 "}).json()
+
+            assert first["cached"] is False
+            assert second["cached"] is True
+            assert second["suggestions"] == first["suggestions"]
+            assert len(calls) == 1
+
+            client.post("/api/rag/add", json={**payload, "content": "軸承過熱需更換潤滑脂", "source_type": "inspection"})
+            assert client.post("/api/rag/query", json=payload).json()["cached"] is False
+            assert len(calls) == 2
+        finally:
+            app.dependency_overrides.clear()
+
+
+class FakeStreamingModel:
+    """依固定片段串流回應的替身 Gemini 模型（片段邊界刻意切在行中間）"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def generate_content_async(self, prompt, stream=False):
+        if not stream:
+            return type("Response", (), {"text": "".join(self.chunks)})()
+
+        async def response():
+            for text in self.chunks:
+                if isinstance(text, Exception):
+                    raise text
+                yield type("Chunk", (), {"text": text})()
+
+        return response()
+
+
+class FakeStreamingClients(ProviderClients):
+    def __init__(self, chunks):
+        super().__init__()
+        self.model = FakeStreamingModel(chunks)
+
+    def generative_model(self, model_name):
+        return self.model
+
+
+def _parse_sse(text: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class TestSuggestionStream:
+    """維修建議串流"""
+
+    CHUNKS = ["1. 停機後清除齒輪", "表面舊潤滑劑\n2. 重新塗抹", "高溫潤滑脂\n\n3. 一週後複查軸承溫度"]
+
+    def _service(self, tmp_path) -> RAGService:
+        return RAGService(
+            embedding_service=FakeEmbeddingService(),
+            clients=FakeStreamingClients(self.CHUNKS),
+            store=LocalVectorStore(str(tmp_path / "rag_index"), DIM),
+            query_cache=QueryResultCache(),
+        )
+
+    @pytest.mark.asyncio
+    async def test_lines_yielded_across_chunk_boundaries(self, tmp_path):
+        service = self._service(tmp_path)
+        cases = [{"similarity": 0.9, "content": "齒輪髒污"}]
+
+        suggestions = [s async for s in service.stream_suggestions({}, cases)]
+        assert suggestions == ["停機後清除齒輪表面舊潤滑劑", "重新塗抹高溫潤滑脂", "一週後複查軸承溫度"]
+
+    @pytest.mark.asyncio
+    async def test_non_streaming_suggestions_use_async_api(self, tmp_path):
+        """generate_suggestions 以 generate_content_async 呼叫，不在 event loop 上同步等待"""
+        service = self._service(tmp_path)
+        cases = [{"similarity": 0.9, "content": "齒輪髒污"}]
+
+        suggestions = await service.generate_suggestions({}, cases)
+        assert suggestions == ["停機後清除齒輪表面舊潤滑劑", "重新塗抹高溫潤滑脂", "一週後複查軸承溫度"]
+
+    def test_stream_endpoint_sends_results_first(self, tmp_path):
+        from fastapi.testclient import TestClient
+        from app.main import app
+
+        service = self._service(tmp_path)
+        service.similarity_threshold = -1.0  # 替身向量與語意無關，此處只驗證串流順序
+        app.dependency_overrides[get_rag_service] = lambda: service
+        try:
+            client = TestClient(app)
+            client.post("/api/rag/add", json={
+                "equipment_type": "齒輪", "content": "齒輪表面髒污堆積", "source_type": "inspection",
+            })
+            payload = {"equipment_type": "齒輪", "anomaly_description": "齒輪表面髒污堆積"}
+
+            response = client.post("/api/rag/query/stream", json=payload)
+            events = _parse_sse(response.text)
+
+            assert response.headers["content-type"].startswith("text/event-stream")
+            assert [e for e, _ in events] == ["results", "suggestion", "suggestion", "suggestion", "done"]
+            assert events[0][1]["results"]
+            assert events[-1][1] == {"count": 3, "cached": False}
+
+            cached = _parse_sse(client.post("/api/rag/query/stream", json=payload).text)
+            assert cached[0][1]["cached"] is True
+            assert [d["text"] for e, d in cached if e == "suggestion"] == [d["text"] for e, d in events if e == "suggestion"]
+        finally:
+            app.dependency_overrides.clear()
+
+
+    def test_stream_failure_after_partial_output_not_cached(self, tmp_path):
+        from fastapi.testclient import TestClient
+        from app.main import app
+
+        service = RAGService(
+            embedding_service=FakeEmbeddingService(),
+            clients=FakeStreamingClients(["1. 停機檢查\n2. 清除", RuntimeError("stream reset")]),
+            store=LocalVectorStore(str(tmp_path / "rag_index"), DIM),
+            query_cache=QueryResultCache(),
+        )
+        service.similarity_threshold = -1.0
+        app.dependency_overrides[get_rag_service] = lambda: service
+        try:
+            client = TestClient(app)
+            client.post("/api/rag/add", json={
+                "equipment_type": "齒輪", "content": "齒輪表面髒污堆積", "source_type": "inspection",
+            })
+            payload = {"equipment_type": "齒輪", "anomaly_description": "齒輪表面髒污堆積"}
+
+            events = _parse_sse(client.post("/api/rag/query/stream", json=payload).text)
+            assert [e for e, _ in events] == ["results", "suggestion", "error"]
+            assert events[-1][1]["detail"] == "stream reset"
+
+            again = _parse_sse(client.post("/api/rag/query/stream", json=payload).text)
+            assert again[0][1]["cached"] is False
+        finally:
+            app.dependency_overrides.clear()
+
+
+class FakeImporter:
+    """依序回傳預設結果的替身 RAGService.import_from_document"""
+
+    def __init__(self, outcomes, delay=0.0):
+        self.outcomes = list(outcomes)
+        self.delay = delay
+        self.running = 0
+        self.max_running = 0
+
+    async def import_from_document(self, file_path, source_filename, progress=None):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+            outcome = self.outcomes.pop(0) if self.outcomes else {"success": True, "count": 1}
+            if outcome.get("analyzed"):
+                progress("analyzing", 1, 2)
+            if outcome.get("partial"):
+                progress("importing", 1, 2)
+            return outcome
+        finally:
+            self.running -= 1
+
+
+class TestImportJobQueue:
+    """文件匯入工作佇列"""
+
+    @staticmethod
+    def _upload(tmp_path, name="manual.pdf") -> str:
+        path = tmp_path / name
+        path.write_bytes(b"%PDF")
+        return str(path)
+
+    @staticmethod
+    async def _wait(queue):
+        await asyncio.gather(*list(queue._tasks.values()))
+
+    @pytest.mark.asyncio
+    async def test_retries_then_completes(self, tmp_path):
+        importer = FakeImporter([{"success": False, "error": "503"}, {"success": True, "count": 4}])
+        queue = ImportJobQueue(
+            ImportJobStore(str(tmp_path / "jobs.db")), importer, max_attempts=3, retry_backoff_seconds=0
+        )
+        path = self._upload(tmp_path)
+
+        job = queue.submit(path, "manual.pdf")
+        assert job["status"] == "queued"
+        await self._wait(queue)
+
+        job = queue.get(job["id"])
+        assert job["status"] == "completed"
+        assert job["attempts"] == 2
+        assert job["result"]["count"] == 4
+        assert not os.path.exists(path)
+
+    @pytest.mark.asyncio
+    async def test_failure_during_analysis_retried(self, tmp_path):
+        """分析階段（尚未入庫）失敗仍會重試"""
+        importer = FakeImporter([
+            {"success": False, "error": "Gemini timeout", "analyzed": True},
+            {"success": False, "error": "invalid JSON", "analyzed": True},
+            {"success": True, "count": 3},
+        ])
+        queue = ImportJobQueue(
+            ImportJobStore(str(tmp_path / "jobs.db")), importer, max_attempts=3, retry_backoff_seconds=0
+        )
+
+        job = queue.submit(self._upload(tmp_path), "manual.pdf")
+        await self._wait(queue)
+
+        job = queue.get(job["id"])
+        assert job["status"] == "completed"
+        assert job["attempts"] == 3
+
+    @pytest.mark.asyncio
+    async def test_partial_import_not_retried(self, tmp_path):
+        importer = FakeImporter([{"success": False, "error": "db down", "partial": True}])
+        queue = ImportJobQueue(
+            ImportJobStore(str(tmp_path / "jobs.db")), importer, max_attempts=3, retry_backoff_seconds=0
+        )
+
+        job = queue.submit(self._upload(tmp_path), "manual.pdf")
+        await self._wait(queue)
+
+        job = queue.get(job["id"])
+        assert job["status"] == "failed"
+        assert job["attempts"] == 1
+        assert job["error"] == "db down"
+
+    @pytest.mark.asyncio
+    async def test_concurrency_limit(self, tmp_path):
+        importer = FakeImporter([], delay=0.01)
+        queue = ImportJobQueue(ImportJobStore(str(tmp_path / "jobs.db")), importer, concurrency=2)
+
+        for i in range(5):
+            queue.submit(self._upload(tmp_path, f"m{i}.pdf"), f"m{i}.pdf")
+        await self._wait(queue)
+
+        assert importer.max_running == 2
+        assert all(job["status"] == "completed" for job in queue.recent())
+
+    @pytest.mark.asyncio
+    async def test_resume_unfinished_jobs(self, tmp_path):
+        store = ImportJobStore(str(tmp_path / "jobs.db"))
+        pending = store.create("a.pdf", self._upload(tmp_path, "a.pdf"))
+        missing = store.create("b.pdf", str(tmp_path / "gone.pdf"))
+        analyzing = store.create("c.pdf", self._upload(tmp_path, "c.pdf"))
+        store.update(analyzing["id"], status="running", stage="analyzing", processed=3, total=5)
+        partial = store.create("d.pdf", self._upload(tmp_path, "d.pdf"))
+        store.update(partial["id"], status="running", stage="importing", processed=3, total=5)
+
+        queue = ImportJobQueue(store, FakeImporter([]))
+        assert queue.resume() == 2
+        await self._wait(queue)
+
+        assert queue.get(pending["id"])["status"] == "completed"
+        assert queue.get(missing["id"])["status"] == "failed"
+        assert queue.get(analyzing["id"])["status"] == "completed"
+        assert queue.get(partial["id"])["error"] == "Interrupted after partial import"
+
+
+class FakeSectionModel:
+    """每段回傳固定知識的替身 Gemini 模型；每段都會重複回傳一筆共用知識"""
+
+    def __init__(self):
+        self.prompts = []
+
+    def generate_content(self, prompt):
+        self.prompts.append(prompt)
+        index = len(self.prompts)
+        items = [
+            {"equipment_type": "馬達", "content": f"第 {index} 段：檢查軸承溫度", "category": "保養"},
+            {"equipment_type": "馬達", "content": "定期 更換潤滑脂。", "category": "保養"},
+            {"equipment_type": "馬達", "content": "", "category": "保養"},  # 無效項目，不計為重複
+        ]
+        return type("Response", (), {"text": "```json\n" + json.dumps(items, ensure_ascii=False) + "\n```"})()
+
+
+class FakeSectionClients(ProviderClients):
+    def __init__(self):
+        super().__init__()
+        self.model = FakeSectionModel()
+
+    def generative_model(self, model_name):
+        return self.model
+
+
+class TestDocumentChunking:
+    """大型文件分段擷取"""
+
+    def test_chunks_respect_size_and_overlap(self):
+        chunks = chunk_units(["aaaa", "bb", "cccc", "dd"], max_chars=8, overlap_chars=2)
+        assert chunks == ["aaaa\nbb", "bb\ncccc\ndd"]
+        assert chunk_units(["x" * 20], max_chars=8) == ["x" * 8, "x" * 8, "x" * 4]
+        assert chunk_units([], max_chars=8) == []
+
+    def test_heading_starts_new_chunk(self):
+        chunks = chunk_units(["aaaaa", "\n第二章", "bb"], max_chars=8)
+        assert chunks == ["aaaaa", "第二章\nbb"]
+
+    def test_dedup_key_ignores_spacing_and_punctuation(self):
+        assert dedup_key("馬達", "定期 更換潤滑脂。") == dedup_key("馬達", "定期更換潤滑脂")
+
+    @pytest.mark.asyncio
+    async def test_docx_sections_extracted_and_deduplicated(self, tmp_path, monkeypatch):
+        from docx import Document
+        from app.config import settings
+
+        monkeypatch.setattr(settings, "rag_doc_chunk_chars", 200)
+        monkeypatch.setattr(settings, "rag_doc_chunk_overlap_chars", 0)
+        path = tmp_path / "manual.docx"
+        doc = Document()
+        for i in range(6):
+            doc.add_paragraph(f"第 {i} 節 馬達保養說明。" * 8)
+        doc.save(str(path))
+
+        clients = FakeSectionClients()
+        service = RAGService(
+            embedding_service=FakeEmbeddingService(),
+            clients=clients,
+            store=LocalVectorStore(str(tmp_path / "rag_index"), DIM),
+            query_cache=QueryResultCache(),
+        )
+        stages = []
+        result = await service.import_from_document(
+            str(path), "manual.docx", progress=lambda stage, *args: stages.append(stage)
+        )
+
+        sections = len(clients.model.prompts)
+        assert sections > 1
+        assert result["success"] is True
+        assert result["sections"] == sections
+        assert result["count"] == sections + 1
+        assert result["duplicates"] == sections - 1
+        assert "uploading" not in stages
+        assert (await service.get_stats())["total"] == sections + 1
+
+
+class TestIngestDedup:
+    """入庫去重"""
+
+    @staticmethod
+    def _item(content, **extra):
+        return {"content": content, "equipment_type": "馬達", "source_type": "inspection", **extra}
+
+    @pytest.mark.asyncio
+    async def test_exact_duplicate_skipped(self, tmp_path):
+        service = _make_rag_service(tmp_path)
+        first = await service.add_item("馬達軸承過熱，需更換潤滑脂", "馬達", "inspection")
+        again = await service.add_item("  馬達軸承過熱，需更換潤滑脂 ", "馬達", "inspection")
+
+        assert again == first
+        assert (await service.get_stats())["total"] == 1
+
+    @pytest.mark.asyncio
+    async def test_near_duplicate_by_vector(self, tmp_path):
+        service = _make_rag_service(tmp_path)
+        vector = FakeEmbeddingService._vector
+
+        async def embed_text(text):
+            # 兩種說法視為同一語意
+            return vector("軸承過熱") if "軸承" in text else vector(text)
+
+        service.embedding_service.embed_text = embed_text
+        first = await service.add_item("馬達軸承過熱", "馬達", "inspection")
+        again = await service.add_item("馬達的軸承溫度過高", "馬達", "inspection")
+        other = await service.add_item("配電盤端子鬆脫", "配電盤", "inspection")
+
+        assert again == first
+        assert other != first
+        assert (await service.get_stats())["total"] == 2
+
+    @pytest.mark.asyncio
+    async def test_bulk_duplicates_within_and_across_batches(self, tmp_path):
+        service = _make_rag_service(tmp_path)
+        existing = await service.add_item("冷卻風扇皮帶磨損", "風扇", "inspection")
+
+        progress = [p async for p in service.add_items_iter([
+            self._item("軸承過熱"),
+            self._item("軸承過熱"),
+            self._item("冷卻風扇皮帶磨損"),
+            self._item("端子鬆脫"),
+        ])]
+
+        ids = progress[0]["ids"]
+        assert progress[0]["duplicates"] == 2
+        assert ids[0] == ids[1]
+        assert ids[2] == existing
+        assert (await service.get_stats())["total"] == 3
+
+    @pytest.mark.asyncio
+    async def test_bulk_near_duplicates_use_one_store_query(self, tmp_path):
+        service = _make_rag_service(tmp_path)
+        vector = FakeEmbeddingService._vector
+        existing = await service.add_item("配電盤端子鬆脫", "配電盤", "inspection")
+
+        async def embed_batch(texts, **kwargs):
+            # 「軸承」相關說法視為同一語意
+            return [vector("軸承過熱") if "軸承" in t else vector(t) for t in texts]
+
+        service.embedding_service.embed_batch = embed_batch
+        store_calls = []
+        nearest_ids = service.store.nearest_ids
+
+        async def recording_nearest_ids(embeddings, min_similarity):
+            store_calls.append(len(embeddings))
+            return await nearest_ids(embeddings, min_similarity)
+
+        async def unexpected_search(*args, **kwargs):
+            raise AssertionError("dedup must not issue per-item searches")
+
+        service.store.nearest_ids = recording_nearest_ids
+        service.store.search = unexpected_search
+
+        progress = [p async for p in service.add_items_iter([
+            self._item("馬達軸承過熱"),
+            self._item("葉片前緣腐蝕"),
+            self._item("馬達的軸承溫度過高"),
+            self._item("配電盤端子鬆脫，已鎖緊", equipment_type="配電盤"),
+            self._item("馬達軸承過熱"),
+        ])]
+
+        ids = progress[0]["ids"]
+        assert store_calls == [4]  # 內容雜湊重複者不送出
+        assert ids[0] == ids[2] == ids[4]  # 同批近重複併入第一筆
+        assert ids[1] != ids[0]
+        assert progress[0]["duplicates"] == 2
+        assert (await service.get_stats())["total"] == 4
+        assert existing not in ids[:3]
+
+    @pytest.mark.asyncio
+    async def test_replace_policy(self, tmp_path, monkeypatch):
+        from app.config import settings
+
+        monkeypatch.setattr(settings, "rag_dedup_policy", "replace")
+        service = _make_rag_service(tmp_path)
+        old = await service.add_item("軸承過熱", "馬達", "inspection", metadata={"rev": 1})
+        new = await service.add_item("軸承過熱", "馬達", "inspection", metadata={"rev": 2})
+
+        items = await service.get_all_items()
+        assert new != old
+        assert [(i["id"], i["metadata"]["rev"]) for i in items] == [(new, 2)]
+        assert [doc_id for doc_id, _ in service.lexical_index.search("軸承", limit=10)] == [new]
+
+    @pytest.mark.asyncio
+    async def test_keep_policy_records_duplicate_of(self, tmp_path, monkeypatch):
+        from app.config import settings
+
+        monkeypatch.setattr(settings, "rag_dedup_policy", "keep")
+        service = _make_rag_service(tmp_path)
+        old = await service.add_item("軸承過熱", "馬達", "inspection")
+        await service.add_item("軸承過熱", "馬達", "inspection")
+
+        items = await service.get_all_items()
+        assert len(items) == 2
+        assert {i["metadata"].get("duplicate_of") for i in items} == {old, None}
+
+    @pytest.mark.asyncio
+    async def test_local_store_adds_hash_column_to_old_index(self, tmp_path):
+        import sqlite3
+
+        index_dir = tmp_path / "rag_index"
+        index_dir.mkdir()
+        conn = sqlite3.connect(str(index_dir / "items.db"))
+        conn.execute("""
+            CREATE TABLE rag_items (
+                row_index INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, content TEXT NOT NULL,
+                equipment_type TEXT NOT NULL, source_type TEXT NOT NULL, source_id TEXT,
+                metadata TEXT, created_at TEXT NOT NULL, deleted INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.commit()
+        conn.close()
+
+        store = LocalVectorStore(str(index_dir), DIM)
+        item_id = await store.add("軸承過熱", "馬達", "inspection", FakeEmbeddingService._vector("a"), content_hash="h1")
+        assert await store.find_by_hashes(["h1", "h2"]) == {"h1": item_id}
+
+
+class TestKeysetPagination:
+    """知識項目 keyset 分頁"""
+
+    def test_cursor_round_trip(self):
+        cursor = encode_cursor("2026-01-01T00:00:00", "abc")
+        assert decode_cursor(cursor) == ("2026-01-01T00:00:00", "abc")
+        with pytest.raises(ValueError):
+            decode_cursor("not-a-cursor")
+
+    @pytest.mark.asyncio
+    async def test_cursor_pages_cover_all_items_once(self, tmp_path):
+        service = _make_rag_service(tmp_path)
+        await service.add_items(_records(3), chunk_size=3)
+        await service.add_items(_records(7)[3:], chunk_size=2)
+        await service.delete_item((await service.get_all_items(limit=1))[0]["id"])
+
+        expected = [item["id"] for item in await service.get_all_items(limit=100)]
+        paged, cursor = [], None
+        while True:
+            page = await service.get_all_items(limit=2, cursor=cursor)
+            paged += [item["id"] for item in page]
+            cursor = next_cursor(page, 2)
+            if cursor is None:
+                break
+
+        assert len(expected) == 6
+        assert paged == expected
+        assert [item["id"] async for item in service.iter_all_items(batch_size=4)] == expected
+
+    def test_items_header_and_export_endpoint(self, tmp_path):
+        from fastapi.testclient import TestClient
+        from app.main import app
+
+        service = _make_rag_service(tmp_path)
+        app.dependency_overrides[get_rag_service] = lambda: service
+        try:
+            client = TestClient(app)
+            client.post("/api/rag/bulk-add", json={"items": [
+                {"equipment_type": r["equipment_type"], "content": r["content"], "source_type": "document"}
+                for r in _records(3)
+            ]})
+
+            first = client.get("/api/rag/items", params={"limit": 2})
+            second = client.get("/api/rag/items", params={"limit": 2, "cursor": first.headers["x-next-cursor"]})
+            assert len(first.json()) == 2
+            assert len(second.json()) == 1
+            assert "x-next-cursor" not in second.headers
+            assert client.get("/api/rag/items", params={"cursor": "bogus"}).status_code == 400
+
+            export = client.get("/api/rag/items/export", params={"batch_size": 2})
+            lines = [json.loads(line) for line in export.text.splitlines()]
+            assert [item["id"] for item in lines] == [item["id"] for item in first.json() + second.json()]
+            assert all("embedding" not in item for item in lines)
+        finally:
+            app.dependency_overrides.clear()
+
+
+class TestKnowledgeBaseStats:
+    """增量維護的知識庫統計"""
+
+    @staticmethod
+    def _count_recounts(service) -> list:
+        calls = []
+        recount = service.store.stats
+
+        async def counting_stats():
+            calls.append(1)
+            return await recount()
+
+        service.store.stats = counting_stats
+        return calls
+
+    @pytest.mark.asyncio
+    async def test_counts_maintained_without_recount(self, tmp_path):
+        service = _make_rag_service(tmp_path)
+        recounts = self._count_recounts(service)
+        await service.get_stats()
+
+        ids = await service.add_items(_records(3))
+        await service.add_item("馬達軸承過熱", "馬達", "inspection")
+        await service.delete_item(ids[0])
+        await service.delete_item(ids[0])
+
+        stats = await service.get_stats()
+        assert len(recounts) == 1
+        assert stats["total"] == 3
+        assert stats["by_source"] == {"document": 2, "inspection": 1}
+        assert stats["by_equipment"] == {"齒輪箱": 2, "馬達": 1}
+
+        store_stats = await service.store.stats()
+        assert {k: stats[k] for k in store_stats} == store_stats
+
+    @pytest.mark.asyncio
+    async def test_refresh_and_reconcile_interval(self, tmp_path, monkeypatch):
+        service = _make_rag_service(tmp_path)
+        recounts = self._count_recounts(service)
+
+        await service.get_stats()
+        await service.get_stats(refresh=True)
+        assert len(recounts) == 2
+
+        monkeypatch.setattr(service.stats, "reconcile_seconds", 0.0001)
+        await asyncio.sleep(0.001)
+        await service.get_stats()
+        assert len(recounts) == 3
+
+
+class FakeSession:
+    def __init__(self):
+        self.commits = 0
+        self.rollbacks = 0
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class TestDatabasePool:
+    """資料庫連線池量測與請求共用 Session"""
+
+    def test_pool_metrics_snapshot(self):
+        metrics = PoolMetrics()
+        for seconds in (0.001, 0.002, 0.003, 0.1):
+            metrics.record_wait(seconds)
+        metrics.record_timeout()
+
+        snapshot = metrics.snapshot()
+        assert snapshot["checkouts"] == 4
+        assert snapshot["timeouts"] == 1
+        assert snapshot["wait_ms_max"] == 100.0
+        assert snapshot["wait_ms_p50"] == 3.0
+        assert snapshot["wait_ms_avg"] == pytest.approx(26.5)
+
+        metrics.reset()
+        assert metrics.snapshot()["checkouts"] == 0
+
+    def test_engine_uses_configured_pool(self):
+        status = pool_status(database.engine.pool)
+        assert isinstance(database.engine.pool, InstrumentedAsyncPool)
+        assert status["size"] == database.settings.db_pool_size
+        assert status["max_overflow"] == database.settings.db_max_overflow
+        assert status["checked_out"] == 0
+        assert "wait" in status
+
+    @pytest.mark.asyncio
+    async def test_session_shared_within_request_task(self, monkeypatch):
+        created = []
+
+        def make_session():
+            created.append(FakeSession())
+            return created[-1]
+
+        monkeypatch.setattr(database, "async_session_maker", make_session)
+
+        async def request():
+            shared = FakeSession()
+            database._request_session.set((shared, asyncio.current_task()))
+            try:
+                async with database.session_scope() as first:
+                    pass
+                async with database.session_scope() as second:
+                    pass
+                with pytest.raises(RuntimeError):
+                    async with database.session_scope():
+                        raise RuntimeError("query failed")
+
+                # 同一請求分出的 task 不可共用 AsyncSession
+                async def in_other_task():
+                    async with database.session_scope() as session:
+                        return session
+
+                others = await asyncio.gather(in_other_task(), in_other_task())
+            finally:
+                database._request_session.set(None)
+            return shared, first, second, others
+
+        shared, first, second, others = await asyncio.create_task(request())
+        assert first is shared and second is shared
+        assert shared.commits == 2 and shared.rollbacks == 1
+        assert list(others) == created and len(created) == 2
+
+        async with database.session_scope() as session:
+            assert session is created[-1]